@@ -0,0 +1 @@
+# portmap: build helpers for the Cherchell port environmental study webmap (webmap.py)
@@ -0,0 +1,242 @@
+# ########## Build benchmark
+# Runs the map build (webmap.py) in a scratch copy of the project, with Earth Engine replaced by
+# a local stand-in (no account or network: every ee call returns a chainable placeholder, map
+# ids a placeholder tiles url), over the bundled layers/ data and synthetic scaled up copies of
+# it (each layer's features repeated side by side 10x, 100x...). For every scale, a cold build
+# (empty caches) then a warm build (incremental build cache filled) are measured:
+# - wall time and time of each build step, preparation time of each layer
+# - peak memory (max RSS of the build process)
+# - webmap.html size and embedded bytes/vertices per layer (after preprocessing)
+# - static client cost proxy: bytes of inline script the browser parses on load and the count
+#   of numbers (coordinates...) they hold
+# Results are written as JSON (benchmarks/<date>-<commit>.json) and two results are compared with:
+#   python -m portmap.bench                      (scales 1, 10, 100)
+#   python -m portmap.bench --scales 1,10
+#   python -m portmap.bench --compare benchmarks/old.json benchmarks/new.json
+import argparse
+import copy
+import datetime
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from collections import defaultdict
+
+from portmap.geometry import geometry_bounds
+from portmap.preprocess import load_geojson
+
+RESULTS_DIR = 'benchmarks'
+SCALES = [1, 10, 100]
+# project files copied into the scratch directory
+PROJECT_FILES = ['webmap.py', 'portmap', 'src', 'layers']
+STANDIN_TILES = 'https://earthengine.invalid/bench/{z}/{x}/{y}'
+
+#################### EARTH ENGINE STAND-IN ####################
+
+# any ee attribute/call returns another placeholder; the call chain is kept as its serialized
+# form so different expressions keep different cache keys
+class _Placeholder:
+
+  def __init__(self, path='ee'):
+    self._path = path
+
+  def __getattr__(self, name):
+    if name.startswith('__'):
+      raise AttributeError(name)
+    return _Placeholder('{}.{}'.format(self._path, name))
+
+  def __call__(self, *args, **kwargs):
+    return _Placeholder('{}({})'.format(self._path, ', '.join([repr(a) for a in args] +
+                                                             ['{}={!r}'.format(k, v) for k, v in sorted(kwargs.items())])))
+
+  def __repr__(self):
+    return self._path
+
+  def serialize(self):
+    return self._path
+
+  # reduceRegion(s) results: no group/feature
+  def getInfo(self):
+    return defaultdict(list)
+
+  def getMapId(self, vis_params=None):
+    return {'mapid': 'bench', 'tile_fetcher': types.SimpleNamespace(url_format=STANDIN_TILES)}
+
+def install_standin():
+  module = types.ModuleType('ee')
+  for name in ('Image', 'ImageCollection', 'Geometry', 'Feature', 'FeatureCollection', 'Filter', 'Reducer',
+               'Terrain', 'batch', 'data'):
+    setattr(module, name, _Placeholder('ee.' + name))
+  module.Initialize = module.Authenticate = lambda *args, **kwargs: None
+  module.image = types.ModuleType('ee.image')
+  sys.modules['ee'] = module
+  sys.modules['ee.image'] = module.image
+
+#################### SYNTHETIC DATA ####################
+
+def _translate(coordinates, dx):
+  if coordinates and isinstance(coordinates[0], (int, float)):
+    return [coordinates[0] + dx] + list(coordinates[1:])
+  return [_translate(c, dx) for c in coordinates]
+
+def _translate_geometry(geometry, dx):
+  if geometry['type'] == 'GeometryCollection':
+    return dict(geometry, geometries=[_translate_geometry(g, dx) for g in geometry['geometries']])
+  return dict(geometry, coordinates=_translate(geometry['coordinates'], dx))
+
+# features of a layer repeated 'scale' times, each copy shifted east by the layer width
+def scale_layer(data, scale):
+  features = [f for f in data['features'] if f.get('geometry')]
+  if scale == 1 or not features:
+    return data
+  bounds = [geometry_bounds(f['geometry']) for f in features]
+  width = (max(b[2] for b in bounds) - min(b[0] for b in bounds)) * 1.05 or 0.01
+  scaled = []
+  for k in range(scale):
+    for feature in data['features']:
+      feature = copy.deepcopy(feature)
+      if k and feature.get('geometry'):
+        feature['geometry'] = _translate_geometry(feature['geometry'], k * width)
+      scaled.append(feature)
+  return dict(data, features=scaled)
+
+# scratch copy of the project with its layers scaled
+def prepare(root, directory, scale):
+  for name in PROJECT_FILES:
+    source = os.path.join(root, name)
+    if os.path.isdir(source):
+      shutil.copytree(source, os.path.join(directory, name), ignore=shutil.ignore_patterns('__pycache__'))
+    else:
+      shutil.copy(source, directory)
+  if scale > 1:
+    layers = os.path.join(directory, 'layers')
+    for name in os.listdir(layers):
+      if name.endswith('.geojson'):
+        path = os.path.join(layers, name)
+        data = scale_layer(load_geojson(path), scale)
+        with open(path, 'w', encoding='utf-8') as f:
+          json.dump(data, f)
+
+#################### MEASURES ####################
+
+# inline scripts of the page: bytes parsed on load and the numbers they hold
+def client_cost(html_path):
+  with open(html_path, 'rb') as f:
+    html = f.read()
+  scripts = re.findall(rb'<script>(.*?)</script>', html, re.S)
+  return {
+    'inline_script_bytes': sum(len(s) for s in scripts),
+    'numbers': sum(len(re.findall(rb'-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?', s)) for s in scripts)
+  }
+
+# ##### one build in the current directory (child process): measures written to result_path
+def child(result_path):
+  import resource
+  install_standin()
+  sys.path.insert(0, os.getcwd())
+  started = time.perf_counter()
+  import webmap
+  builder, cache = webmap.build(open_browser=False)
+  wall = time.perf_counter() - started
+  result = {
+    'wall': wall,
+    'steps': dict(cache.steps),
+    'layers': getattr(builder, 'timings', {}),
+    'payload': {path: {'bytes': stats['after']['bytes'], 'vertices': stats['after']['vertices']}
+                for path, stats in builder.payload.items()},
+    'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'html_bytes': os.path.getsize(webmap.MAP_FILE),
+    'client': client_cost(webmap.MAP_FILE),
+    'reused': len(cache.reused),
+    'rebuilt': len(cache.rebuilt)
+  }
+  with open(result_path, 'w', encoding='utf-8') as f:
+    json.dump(result, f)
+
+def _build(directory, log):
+  result_path = os.path.join(directory, 'bench.json')
+  command = [sys.executable, '-m', 'portmap.bench', '--child', result_path]
+  env = dict(os.environ, PYTHONPATH=directory)
+  with open(log, 'a', encoding='utf-8') as out:
+    subprocess.run(command, cwd=directory, stdout=out, stderr=subprocess.STDOUT, env=env, check=True)
+  with open(result_path, encoding='utf-8') as f:
+    return json.load(f)
+
+def _commit(root):
+  try:
+    return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=root, capture_output=True, text=True,
+                          check=True).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+# ##### cold + warm build for every scale, returning the results
+def run(root='.', scales=SCALES, report=True):
+  root = os.path.abspath(root)
+  results = {'commit': _commit(root), 'date': datetime.datetime.now().isoformat(timespec='seconds'),
+             'python': sys.version.split()[0], 'scales': {}}
+  for scale in scales:
+    with tempfile.TemporaryDirectory(prefix='portmap-bench-') as directory:
+      prepare(root, directory, scale)
+      log = os.path.join(directory, 'build.log')
+      results['scales'][str(scale)] = {'cold': _build(directory, log), 'warm': _build(directory, log)}
+    if report:
+      cold, warm = results['scales'][str(scale)]['cold'], results['scales'][str(scale)]['warm']
+      print('x{:<4} cold {:>8.2f}s  warm {:>8.2f}s  peak {:>8.1f} MB  html {:>9.1f} KB  script numbers {:>9}'.format(
+        scale, cold['wall'], warm['wall'], cold['peak_rss_kb'] / 1024, cold['html_bytes'] / 1024,
+        cold['client']['numbers']))
+  return results
+
+def save(results, results_dir=RESULTS_DIR):
+  os.makedirs(results_dir, exist_ok=True)
+  name = '{}-{}.json'.format(results['date'].replace(':', '').replace('-', ''), results['commit'] or 'nocommit')
+  path = os.path.join(results_dir, name)
+  with open(path, 'w', encoding='utf-8') as f:
+    json.dump(results, f, indent=2)
+  return path
+
+#################### COMPARISON ####################
+
+def _metrics(run):
+  metrics = {
+    'wall (s)': run['wall'],
+    'peak memory (MB)': run['peak_rss_kb'] / 1024,
+    'html (KB)': run['html_bytes'] / 1024,
+    'inline script (KB)': run['client']['inline_script_bytes'] / 1024,
+    'script numbers': run['client']['numbers']
+  }
+  for step, seconds in run['steps'].items():
+    metrics['step {} (s)'.format(step)] = seconds
+  return metrics
+
+# ##### metrics of two results side by side (change in %)
+def compare(old, new):
+  lines = ['{:<44} {:>12} {:>12} {:>8}'.format('metric', old['commit'] or 'old', new['commit'] or 'new', 'change')]
+  for scale in sorted(set(old['scales']) & set(new['scales']), key=int):
+    for build in ('cold', 'warm'):
+      a, b = _metrics(old['scales'][scale][build]), _metrics(new['scales'][scale][build])
+      for name in a:
+        if name in b:
+          change = 100.0 * (b[name] - a[name]) / a[name] if a[name] else 0.0
+          lines.append('{:<44} {:>12.2f} {:>12.2f} {:>+7.1f}%'.format(
+            'x{} {} {}'.format(scale, build, name), a[name], b[name], change))
+  return '\n'.join(lines)
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Map build benchmark')
+  parser.add_argument('--scales', default=','.join(str(s) for s in SCALES))
+  parser.add_argument('--output', default=RESULTS_DIR)
+  parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+  parser.add_argument('--child', help=argparse.SUPPRESS)
+  args = parser.parse_args()
+  if args.child:
+    child(args.child)
+  elif args.compare:
+    with open(args.compare[0], encoding='utf-8') as a, open(args.compare[1], encoding='utf-8') as b:
+      print(compare(json.load(a), json.load(b)))
+  else:
+    print(save(run(scales=[int(s) for s in args.scales.split(',')]), args.output))
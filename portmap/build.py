@@ -0,0 +1,356 @@
+# ########## Map layers build
+# The map layers are described by a registry of LayerSpec entries: each entry's 'prepare'
+# function does the slow part (reading/parsing its GeoJSON file, Earth Engine calls...) and
+# returns the folium element to draw. Entries are prepared concurrently in a thread pool
+# and attached to the map in the registry order, so the layer control order is deterministic
+# and the build takes as long as the slowest layer instead of the sum of all of them.
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from functools import partial
+
+from folium.raster_layers import TileLayer
+
+from portmap import trace
+from portmap.canvas import HoverIndex, filled, hover_tooltip
+from portmap.ee_cache import cache_key, get_map_id
+from portmap.ee_tiles import cache_tiles, is_cached, local_url
+from portmap.incremental import BuildCache, file_digest, stable_ids
+from portmap.lazy import LazyGeoJson
+from portmap.lod import LodGeoJson, variants
+from portmap.mvt import VectorTileLayer, slugify
+from portmap.preprocess import PRECISION, payload_report, preprocess_layer
+from portmap.registry import RasterLayer, VectorLayer
+from portmap.stream import ingest
+from portmap.styles import StyledGeoJson
+from portmap.topojson import TopoGeoJson
+from portmap.values import ENCODED_VIS, ValueTileLayer, ee_encoded
+from portmap.zonal import apply as apply_zonal, tooltip_fields as zonal_tooltip_fields
+
+WORKERS = 8
+# layer files over this size (bytes) are streamed feature by feature (portmap.stream) into
+# .cache/layers before being loaded, instead of being parsed whole
+STREAM_THRESHOLD = 16 * 1024 * 1024
+INGEST_DIR = os.path.join('.cache', 'layers')
+
+class LayerSpec:
+
+  def __init__(self, name, prepare):
+    self.name = name
+    self.prepare = prepare
+
+def _prepare(spec):
+  started = time.perf_counter()
+  with trace.span('layer', layer=spec.name):
+    element = spec.prepare()
+  return element, time.perf_counter() - started
+
+# ##### preparing all the layers concurrently then adding them to the map in order
+# returns the per layer preparation time (seconds)
+def build_layers(m, specs, workers=WORKERS, report=True):
+  started = time.perf_counter()
+  with ThreadPoolExecutor(max_workers=workers) as pool:
+    results = list(pool.map(_prepare, specs))
+  timings = {}
+  for spec, (element, seconds) in zip(specs, results):
+    m.add_child(element)
+    timings[spec.name] = seconds
+  if report:
+    for name, seconds in timings.items():
+      print('{:<48} {:>7.2f}s'.format(name, seconds))
+    print('{} layers prepared in {:.2f}s (sequential: {:.2f}s)'.format(
+      len(specs), time.perf_counter() - started, sum(timings.values())))
+  return timings
+
+#################### BUILDER ####################
+
+# ##### building the map layers from the registry tables (portmap.registry):
+# vector_mode: 'inline', 'mvt' or 'lazy' (see webmap.py build options)
+# ee_tiles: None (live Earth Engine tiles), 'xyz' or 'mbtiles' (local tiles cache over aoi_bounds)
+# cache: portmap.incremental.BuildCache reusing the rendered layers whose inputs didn't change
+# local_engine: portmap.raster.LocalEngine computing the raster layers offline instead of Earth Engine
+# zonal: portmap.zonal.ZonalStats adding the rasters statistics of the layers 'zonal' entries
+# renderer: 'svg' or 'canvas' (GeoJSON vector modes): see portmap.canvas
+# value_tiles: raster layers with a 'values' encoding drawn from value tiles (see portmap.values)
+class LayerBuilder:
+
+  def __init__(self, vector_mode='inline', precision=PRECISION, ee_tiles=None, ee_tiles_zoom=(10, 15),
+               aoi_bounds=None, tiles_root='tiles', data_dir='data', vector_zoom=(8, 14), cache=None,
+               local_engine=None, zonal=None, renderer='svg', value_tiles=False):
+    self.vector_mode = vector_mode
+    self.renderer = renderer
+    self.value_tiles = value_tiles
+    self.precision = precision
+    self.ee_tiles = ee_tiles
+    self.ee_tiles_zoom = ee_tiles_zoom
+    self.aoi_bounds = aoi_bounds
+    self.tiles_root = tiles_root
+    self.data_dir = data_dir
+    self.vector_zoom = vector_zoom
+    self.cache = cache or BuildCache(enabled=False)
+    self.local_engine = local_engine
+    self.zonal = zonal
+    self.payload = {}
+    # preparation time of each layer (seconds) of the last build
+    self.timings = {}
+
+  # ########## Vector layers
+  # streamed ingestion of a large/filtered layer file (bbox filter, properties projection,
+  # simplification): the processed file and the stats of the source file, reused while unchanged
+  def ingested(self, layer):
+    key = self.cache.key('ingest', file_digest(layer.path), layer.bbox, layer.used_properties(),
+                         layer.tolerance, self.precision)
+    path = os.path.join(INGEST_DIR, key + '.geojson')
+    try:
+      with open(os.path.join(INGEST_DIR, key + '.json'), encoding='utf-8') as f:
+        stats = json.load(f)
+    except (OSError, ValueError):
+      stats = None
+    if stats is None or not os.path.exists(path):
+      stats = ingest(layer.path, path, bbox=layer.bbox, keep=layer.used_properties(), tolerance=layer.tolerance,
+                     precision=self.precision, topology=True)
+      with open(os.path.join(INGEST_DIR, key + '.json'), 'w', encoding='utf-8') as f:
+        json.dump(stats, f)
+    return path, stats
+
+  # reading and preprocessing the layer file
+  def load(self, layer):
+    with trace.span('read', path=layer.path):
+      if layer.bbox is not None or os.path.getsize(layer.path) > STREAM_THRESHOLD:
+        path, ingested = self.ingested(layer)
+        # already simplified and projected by the ingestion
+        data, stats = preprocess_layer(path, precision=self.precision)
+        stats = dict(stats, layer=layer.path, before=ingested['before'])
+      else:
+        data, stats = preprocess_layer(layer.path, tolerance=layer.tolerance, precision=self.precision,
+                                       keep=layer.used_properties())
+      trace.count('bytes_read', stats['before']['bytes'])
+      trace.count('features', len(data['features']))
+    self.payload[layer.path] = stats
+    if layer.zonal and self.zonal is not None:
+      apply_zonal(data, self.zonal_stats(layer, data))
+    return data
+
+  # zonal statistics properties of the features (stored in the build cache), keyed by everything
+  # selecting and shaping the features: their positions match the loaded data
+  def zonal_stats(self, layer, data):
+    key = self.cache.key('zonal', file_digest(layer.path), layer.bbox, layer.used_properties(), layer.tolerance,
+                         self.precision, self.zonal.fingerprint(layer.zonal))
+    entry = self.cache.read(key) if self.cache.enabled else None
+    if entry is None:
+      with trace.span('zonal', layer=layer.name):
+        entry = {'properties': self.zonal.compute(data, layer.zonal)}
+      if self.cache.enabled:
+        self.cache.write(key, entry)
+    return entry['properties']
+
+  def tooltip(self, layer):
+    if not layer.zonal or self.zonal is None:
+      return layer.tooltip()
+    return layer.tooltip(*zonal_tooltip_fields(self.zonal.rasters, layer.zonal))
+
+  # tooltip of the canvas hover engine (same fields as the SVG mode tooltip)
+  def hover_tooltip(self, layer):
+    if not layer.zonal or self.zonal is None:
+      return hover_tooltip(layer)
+    return hover_tooltip(layer, *zonal_tooltip_fields(self.zonal.rasters, layer.zonal))
+
+  def vector_element(self, layer):
+    data = self.load(layer)
+    if self.vector_mode == 'mvt':
+      # styles evaluated per feature into the tiles style table
+      min_zoom, max_zoom = self.vector_zoom
+      return VectorTileLayer(data, name=layer.name, control=True, style_function=layer.style_function(),
+                             highlight_function=layer.highlight_function(), tooltip=self.tooltip(layer),
+                             tiles_root=self.tiles_root + '/vector', min_zoom=min_zoom, max_zoom=max_zoom)
+    # styles written once in the page (see portmap.styles)
+    kwargs = {
+      'name': layer.name,
+      'control': True,
+      'style': layer.style,
+      'style_properties': layer.style_properties,
+      'highlight': layer.highlight,
+      'highlight_properties': layer.highlight_properties,
+      # folium's GeoJsonTooltip reads the first feature (layers clipped to another site can be empty)
+      'tooltip': self.tooltip(layer) if data['features'] else None
+    }
+    if self.renderer == 'canvas':
+      # drawn on the map canvas, highlight and tooltip handled by the HoverIndex
+      kwargs.update(tooltip=None, renderer='canvas')
+    lazy = self.vector_mode == 'lazy' and not layer.eager
+    # levels of detail are only fetched when their zoom is reached in the lazy mode (embedding
+    # all of them would only make the page heavier)
+    if layer.lod and lazy:
+      levels = variants(data, layer.lod, layer.tolerance, self.precision)
+      self.payload[layer.path]['lod'] = [(zoom, stats['vertices']) for zoom, _, stats in levels]
+      element = LodGeoJson(data, levels, data_dir=self.data_dir, show=False, topojson=layer.transport == 'topojson',
+                           **kwargs)
+    elif lazy:
+      element = LazyGeoJson(data, data_dir=self.data_dir, topojson=layer.transport == 'topojson', **kwargs)
+    elif layer.transport == 'topojson':
+      element = TopoGeoJson(data, **kwargs)
+    else:
+      element = StyledGeoJson(data, **kwargs)
+    if self.renderer == 'canvas':
+      element.add_child(HoverIndex(data, self.hover_tooltip(layer), filled=filled(layer.style)))
+    return element
+
+  # ########## Earth Engine layers
+  # the tiles are stamped with the image and visual parameters they were rendered from: a new
+  # scene, date range or style fetches them all again
+  def ee_tiles_cached(self, layer):
+    return bool(self.ee_tiles) and is_cached(self.tiles_root + '/ee', slugify(layer.name), self.ee_tiles,
+                                             self.aoi_bounds, *self.ee_tiles_zoom,
+                                             stamp=cache_key(layer.image, layer.vis_params))
+
+  # pre-rendering the missing tiles of the layer over the AOI, returning the local tiles url
+  def cached_ee_tiles(self, layer):
+    root, name = self.tiles_root + '/ee', slugify(layer.name)
+    min_zoom, max_zoom = self.ee_tiles_zoom
+    if not self.ee_tiles_cached(layer):
+      url_format = get_map_id(layer.image, layer.vis_params)['url_format']
+      stats = cache_tiles(url_format, root, name, self.aoi_bounds, min_zoom, max_zoom, tiles_format=self.ee_tiles,
+                          stamp=cache_key(layer.image, layer.vis_params))
+      print('{layer}: {fetched} tiles fetched, {cached} already cached, {failed} failed ({seconds}s)'.format(**stats))
+    return local_url(root, name)
+
+  # ########## Local raster layers
+  # product computed over the AOI and rendered into tiles/local/<layer> (skipped when up to date)
+  def local_element(self, layer):
+    min_zoom, max_zoom = self.ee_tiles_zoom
+    tiles = self.local_engine.tiles(layer.local, layer.vis_params, self.tiles_root + '/local', slugify(layer.name),
+                                    self.aoi_bounds, min_zoom, max_zoom)
+    west, south, east, north = self.aoi_bounds
+    return TileLayer(
+      tiles=tiles,
+      attr='Contains modified Copernicus Sentinel data / SRTM',
+      name=layer.name,
+      overlay=True,
+      control=True,
+      min_native_zoom=min_zoom,
+      max_native_zoom=max_zoom,
+      bounds=[[south, west], [north, east]]
+    )
+
+  # ########## Value tiles
+  # values of the layer encoded into tiles/values/<layer>/{z}/{x}/{y}.png over the AOI, rendered
+  # locally or fetched from the encoded Earth Engine image (tiles already cached for the same image
+  # and values range are kept)
+  def value_element(self, layer):
+    root, name = self.tiles_root + '/values', slugify(layer.name)
+    min_zoom, max_zoom = self.ee_tiles_zoom
+    low, high = layer.values['min'], layer.values['max']
+    if self.local_engine is not None:
+      tiles = self.local_engine.value_tiles(layer.local, low, high, root, name, self.aoi_bounds, min_zoom, max_zoom)
+    else:
+      tiles = local_url(root, name)
+      # stamped with the encoded image, which holds the image and its values range
+      encoded = ee_encoded(layer.image, low, high)
+      stamp = cache_key(encoded, ENCODED_VIS)
+      if not is_cached(root, name, 'xyz', self.aoi_bounds, min_zoom, max_zoom, stamp=stamp):
+        url_format = get_map_id(encoded, ENCODED_VIS)['url_format']
+        stats = cache_tiles(url_format, root, name, self.aoi_bounds, min_zoom, max_zoom, stamp=stamp)
+        print('{layer}: {fetched} value tiles fetched, {cached} already cached, {failed} failed ({seconds}s)'.format(**stats))
+    west, south, east, north = self.aoi_bounds
+    return ValueTileLayer(tiles, layer.values, layer.vis_params, name=layer.name, min_native_zoom=min_zoom,
+                          max_native_zoom=max_zoom, bounds=[[south, west], [north, east]])
+
+  def raster_element(self, layer):
+    if self.value_tiles and layer.values:
+      return self.value_element(layer)
+    if self.local_engine is not None:
+      return self.local_element(layer)
+    options = {}
+    if self.ee_tiles:
+      tiles = self.cached_ee_tiles(layer)
+      # lower/higher zoom levels are drawn by scaling the cached ones
+      west, south, east, north = self.aoi_bounds
+      options = {
+        'min_native_zoom': self.ee_tiles_zoom[0],
+        'max_native_zoom': self.ee_tiles_zoom[1],
+        'bounds': [[south, west], [north, east]]
+      }
+    else:
+      # map id cached on disk (.cache/ee), see portmap.ee_cache
+      tiles = get_map_id(layer.image, layer.vis_params)['url_format']
+    return TileLayer(
+      tiles=tiles,
+      attr='Map Data &copy; <a href="https://earthengine.google.com/">Google Earth Engine</a>',
+      name=layer.name,
+      overlay=True,
+      control=True,
+      **options
+    )
+
+  # ########## Incremental build
+  # fingerprint of a layer: its inputs and the build options it is rendered with
+  def fingerprint(self, layer):
+    if isinstance(layer, RasterLayer) and self.value_tiles and layer.values:
+      source = self.local_engine.fingerprint(layer.local) if self.local_engine is not None else cache_key(layer.image, {})
+      return self.cache.key('values', layer.name, source, layer.values, layer.vis_params, self.ee_tiles_zoom,
+                            self.aoi_bounds, self.tiles_root)
+    if isinstance(layer, RasterLayer) and self.local_engine is not None:
+      return self.cache.key('local', layer.name, self.local_engine.fingerprint(layer.local), layer.vis_params,
+                            self.ee_tiles_zoom, self.aoi_bounds, self.tiles_root)
+    if isinstance(layer, RasterLayer):
+      return self.cache.key('raster', layer.name, cache_key(layer.image, layer.vis_params),
+                            self.ee_tiles, self.ee_tiles_zoom, self.aoi_bounds, self.tiles_root)
+    zonal = self.zonal.fingerprint(layer.zonal) if layer.zonal and self.zonal is not None else None
+    return self.cache.key('vector', asdict(layer), file_digest(layer.path), zonal,
+                          self.vector_mode, self.renderer, self.precision, self.vector_zoom, self.tiles_root,
+                          self.data_dir)
+
+  # element of a layer + what its cached fragment depends on besides its fingerprint
+  def prepare(self, layer):
+    if isinstance(layer, RasterLayer):
+      element = self.raster_element(layer)
+      if isinstance(element, ValueTileLayer):
+        return element, {'outputs': [os.path.join(self.tiles_root, 'values', slugify(layer.name))]}
+      if self.local_engine is not None:
+        return element, {'outputs': [os.path.join(self.tiles_root, 'local', slugify(layer.name))]}
+      if self.ee_tiles == 'mbtiles':
+        return element, {'outputs': [os.path.join(self.tiles_root, 'ee', slugify(layer.name) + '.mbtiles')]}
+      if self.ee_tiles:
+        return element, {'outputs': [os.path.join(self.tiles_root, 'ee', slugify(layer.name))]}
+      # the page embeds the Earth Engine tiles url, valid until the map id expires
+      return element, {'expires': get_map_id(layer.image, layer.vis_params)['expires']}
+    element = self.vector_element(layer)
+    extra = {'payload': self.payload[layer.path]}
+    if isinstance(element, VectorTileLayer):
+      extra['outputs'] = [os.path.join(self.tiles_root, 'vector', element.layer_name)]
+    elif isinstance(element, LazyGeoJson):
+      extra['outputs'] = [element.data_url]
+    elif isinstance(element, LodGeoJson):
+      extra['outputs'] = element.data_urls
+    return element, extra
+
+  def element(self, layer, parent):
+    element, entry = self.cache.fragment(layer.name, self.fingerprint(layer), parent, partial(self.prepare, layer))
+    if 'payload' in entry:
+      self.payload[layer.path] = entry['payload']
+    return element
+
+  # ########## Build
+  def spec(self, layer, parent):
+    if not self.cache.enabled:
+      prepare = self.raster_element if isinstance(layer, RasterLayer) else self.vector_element
+      return LayerSpec(layer.name, partial(prepare, layer))
+    return LayerSpec(layer.name, partial(self.element, layer, parent))
+
+  # adding all the layers to the map (prepared concurrently, added in the registry order)
+  def build(self, m, layers, workers=WORKERS):
+    if self.local_engine is not None:
+      skipped = [layer.name for layer in layers if isinstance(layer, RasterLayer) and not layer.local]
+      if skipped:
+        print('No local product for: {} (skipped)'.format(', '.join(skipped)))
+      layers = [layer for layer in layers if not isinstance(layer, RasterLayer) or layer.local]
+    if self.cache.enabled:
+      # the cached fragments reference the map by its name
+      stable_ids(m, 'map')
+    timings = build_layers(m, [self.spec(layer, m) for layer in layers], workers=workers)
+    self.timings = timings
+    paths = [layer.path for layer in layers if isinstance(layer, VectorLayer)]
+    print(payload_report([self.payload[path] for path in paths if path in self.payload]))
+    return timings
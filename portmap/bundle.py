@@ -0,0 +1,377 @@
+# ########## Asset bundle
+# Splits the saved map page into a small HTML shell and content addressed assets, so a repeat
+# visit only downloads what changed since the last one:
+# - the inline scripts and styles of the page become assets/<name>.<hash>.js/.css files
+# - the layers data embedded in the map script (GeoJSON FeatureCollections and TopoJSON
+#   topologies) are moved to their own assets/data.<hash>.js files, loaded before the map
+#   script, so an edited layer only changes its own data asset
+# - the lazy mode data files (data/<layer>.json) are copied as hashed assets
+# - the third party libraries (Leaflet, jQuery, Bootstrap, Font Awesome...) are downloaded once
+#   (.cache/vendor) and vendored as assets, with the files their stylesheets reference (fonts,
+#   images); a library that can't be downloaded keeps its CDN url
+# - local stylesheets (src/ui.css) are hashed as well
+# Every text asset is also written precompressed (.gz and, with the brotli package, .br).
+# assets/ only keeps the current assets, manifest.json lists them with their sizes.
+# serve() answers the hashed assets with a one year immutable cache, the shell with no-cache,
+# both with ETags (304 on If-None-Match) and the precompressed variant the client accepts.
+# The other paths (tiles/, MBTiles) are served from the project directory.
+#   python -m portmap.bundle build webmap.html dist
+#   python -m portmap.bundle serve dist [--port 8000]
+import argparse
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+from portmap.ee_tiles import make_handler
+
+OUTPUT_DIR = 'dist'
+VENDOR_DIR = os.path.join('.cache', 'vendor')
+ASSETS = 'assets'
+# embedded data objects at least this large (bytes) are moved to their own asset
+DATA_THRESHOLD = 2048
+# extensions compressed (the others: fonts, images... already are)
+COMPRESSED = {'.js', '.css', '.html', '.json', '.topojson', '.svg', '.eot', '.ttf', '.otf', '.map'}
+IMMUTABLE = 'public, max-age=31536000, immutable'
+TIMEOUT = 30
+
+# global the data assets are registered in
+DATA_GLOBAL = 'PORTMAP_DATA'
+
+_SCRIPT = re.compile(r'<script>(.*?)</script>', re.S)
+_STYLE = re.compile(r'<style>(.*?)</style>', re.S)
+_SCRIPT_SRC = re.compile(r'<script src="([^"]+)"')
+_STYLESHEET = re.compile(r'(<link rel="stylesheet" href=")([^"]+)(")')
+_CSS_URL = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+_DATA_START = re.compile(r'[(=,:]\s*(\{")')
+_DATA_FILE = re.compile(r'"(data/[\w.\-/]+\.(?:json|topojson))"')
+
+def digest(data):
+  return hashlib.sha256(data).hexdigest()
+
+#################### BUNDLE ####################
+
+class Bundle:
+
+  # download=False: third party files only taken from the vendor cache (no network)
+  def __init__(self, output_dir=OUTPUT_DIR, vendor_dir=VENDOR_DIR, root='.', download=True):
+    self.output_dir = output_dir
+    self.vendor_dir = vendor_dir
+    self.root = root
+    self.download = download
+    # {file name in assets/: entry}
+    self.assets = {}
+    self.failed = []
+
+  # ##### writing an asset (and its compressed variants), returns its url from the shell
+  def add(self, name, data, kind):
+    stem, ext = os.path.splitext(os.path.basename(name))
+    key = digest(data)
+    filename = '{}.{}{}'.format(re.sub(r'[^\w\-]', '_', stem) or 'asset', key[:12], ext)
+    if filename not in self.assets:
+      path = os.path.join(self.output_dir, ASSETS, filename)
+      entry = {'source': name, 'kind': kind, 'etag': key[:32], 'bytes': len(data)}
+      if not os.path.exists(path):
+        _write(path, data)
+      entry.update(_compress(path, data, ext))
+      self.assets[filename] = entry
+    return '{}/{}'.format(ASSETS, filename)
+
+  # ##### third party file: downloaded once into the vendor cache (None when unreachable)
+  def fetch(self, url):
+    cached = os.path.join(self.vendor_dir, digest(url.encode('utf-8')))
+    if os.path.exists(cached):
+      with open(cached, 'rb') as f:
+        return f.read()
+    if not self.download:
+      self.failed.append(url)
+      return None
+    try:
+      with urllib.request.urlopen(urllib.request.Request(url, headers={'User-Agent': 'portmap'}), timeout=TIMEOUT) as response:
+        data = response.read()
+    except (urllib.error.URLError, OSError, ValueError):
+      self.failed.append(url)
+      return None
+    _write(cached, data)
+    return data
+
+  # stylesheet with its url(...) references bundled (resolved against its url or file path)
+  def stylesheet(self, css, base, remote):
+    def replace(match):
+      quote, reference = match.groups()
+      if reference.startswith(('data:', '#')):
+        return match.group(0)
+      parts = urllib.parse.urlsplit(reference)
+      suffix = ('?' + parts.query if parts.query else '') + ('#' + parts.fragment if parts.fragment else '')
+      target = urllib.parse.urlunsplit(parts._replace(query='', fragment=''))
+      if remote:
+        location = urllib.parse.urljoin(base, target)
+        data = self.fetch(location)
+      else:
+        location = os.path.normpath(os.path.join(os.path.dirname(base), target))
+        data = _read(location) if os.path.isfile(location) else None
+      if data is None:
+        return match.group(0)
+      # assets sit in the same directory as the stylesheet
+      url = self.add(location, data, 'vendor' if remote else 'file').split('/', 1)[1]
+      return 'url({0}{1}{2}{0})'.format(quote, url, suffix)
+    return _CSS_URL.sub(replace, css)
+
+  def external(self, url, kind):
+    if url.startswith('//'):
+      url = 'https:' + url
+    if not url.startswith(('http://', 'https://')):
+      path = os.path.join(self.root, url)
+      if not os.path.isfile(path):
+        return None
+      data = _read(path)
+      if kind == 'css':
+        data = self.stylesheet(data.decode('utf-8', 'surrogateescape'), path, remote=False).encode('utf-8', 'surrogateescape')
+      return self.add(path, data, 'file')
+    data = self.fetch(url)
+    if data is None:
+      return None
+    if kind == 'css':
+      data = self.stylesheet(data.decode('utf-8', 'surrogateescape'), url, remote=True).encode('utf-8', 'surrogateescape')
+    return self.add(urllib.parse.urlsplit(url).path, data, 'vendor')
+
+  # embedded layers data moved to data assets: returns the script and the data asset urls
+  def split_data(self, script):
+    decoder = json.JSONDecoder()
+    # pos: end of the script part already copied, search: where the next object is looked for
+    parts, urls, pos, search = [], [], 0, 0
+    while True:
+      match = _DATA_START.search(script, search)
+      if match is None:
+        break
+      start = match.start(1)
+      try:
+        value, end = decoder.raw_decode(script, start)
+      except ValueError:
+        search = start + 1
+        continue
+      if isinstance(value, dict) and value.get('type') in ('FeatureCollection', 'Topology') and end - start >= DATA_THRESHOLD:
+        data = script[start:end].encode('utf-8')
+        key = digest(data)[:12]
+        asset = '(window.{0} = window.{0} || {{}})["{1}"] = {2};\n'.format(DATA_GLOBAL, key, script[start:end])
+        urls.append(self.add('data.js', asset.encode('utf-8'), 'data'))
+        parts.append(script[pos:start] + '{}["{}"]'.format(DATA_GLOBAL, key))
+        pos = search = end
+      else:
+        # any other object may hold layers data, e.g. the levels of detail variants
+        search = start + 1
+    parts.append(script[pos:])
+    return ''.join(parts), urls
+
+  # lazy mode data files referenced by the script
+  def data_files(self, script):
+    def replace(match):
+      path = os.path.join(self.root, match.group(1))
+      if not os.path.isfile(path):
+        return match.group(0)
+      return '"{}"'.format(self.add(path, _read(path), 'data'))
+    return _DATA_FILE.sub(replace, script)
+
+  # ##### html: saved map page, returns the shell
+  def build(self, html):
+    def script(match):
+      code, urls = self.split_data(match.group(1))
+      code = self.data_files(code)
+      tags = ['<script src="{}"></script>'.format(url) for url in urls]
+      tags.append('<script src="{}"></script>'.format(self.add('script.js', code.encode('utf-8'), 'script')))
+      return '\n'.join(tags)
+
+    def style(match):
+      return '<link rel="stylesheet" href="{}"/>'.format(self.add('style.css', match.group(1).encode('utf-8'), 'style'))
+
+    def script_src(match):
+      url = self.external(match.group(1), 'js')
+      return '<script src="{}"'.format(url or match.group(1))
+
+    def stylesheet(match):
+      url = self.external(match.group(2), 'css')
+      return match.group(1) + (url or match.group(2)) + match.group(3)
+
+    html = _SCRIPT.sub(script, html)
+    html = _STYLE.sub(style, html)
+    html = _SCRIPT_SRC.sub(script_src, html)
+    return _STYLESHEET.sub(stylesheet, html)
+
+# ##### bundling a saved map page into output_dir (shell written under the page name)
+# returns the manifest: {'shell', 'assets': {file: entry}, 'failed': [urls], 'changed': [files]}
+def build(page='webmap.html', output_dir=OUTPUT_DIR, vendor_dir=VENDOR_DIR, download=True, report=True):
+  previous = read_manifest(output_dir)
+  bundle = Bundle(output_dir, vendor_dir, root=os.path.dirname(os.path.abspath(page)), download=download)
+  with open(page, encoding='utf-8') as f:
+    shell = bundle.build(f.read()).encode('utf-8')
+  name = os.path.basename(page)
+  _write(os.path.join(output_dir, name), shell)
+  shell_entry = dict({'etag': digest(shell)[:32], 'bytes': len(shell)}, **_compress(os.path.join(output_dir, name), shell, '.html', force=True))
+  # removing the assets of the previous builds
+  assets_dir = os.path.join(output_dir, ASSETS)
+  kept = set(bundle.assets) | {filename + ext for filename in bundle.assets for ext in ('.gz', '.br')}
+  for filename in os.listdir(assets_dir):
+    if filename not in kept:
+      os.remove(os.path.join(assets_dir, filename))
+  manifest = {'shell': dict(shell_entry, file=name), 'assets': bundle.assets, 'failed': bundle.failed,
+              'changed': sorted(set(bundle.assets) - set(previous.get('assets', {})))}
+  _write(os.path.join(output_dir, 'manifest.json'), json.dumps(manifest, indent=2).encode('utf-8'))
+  if report:
+    print(bundle_report(manifest))
+  return manifest
+
+def read_manifest(output_dir=OUTPUT_DIR):
+  try:
+    with open(os.path.join(output_dir, 'manifest.json'), encoding='utf-8') as f:
+      return json.load(f)
+  except (OSError, ValueError):
+    return {}
+
+# sizes of the bundle and what a repeat visit downloads (shell + changed assets)
+def bundle_report(manifest):
+  def size(entry):
+    return entry.get('br') or entry.get('gzip') or entry['bytes']
+  assets = manifest['assets'].values()
+  changed = [manifest['assets'][filename] for filename in manifest['changed']]
+  lines = ['{}: {} assets, {:.1f} KB raw, {:.1f} KB compressed'.format(
+    manifest['shell']['file'], len(manifest['assets']), sum(entry['bytes'] for entry in assets) / 1024,
+    sum(size(entry) for entry in assets) / 1024)]
+  lines.append('shell {:.1f} KB, {} changed assets ({:.1f} KB compressed) since the last bundle'.format(
+    size(manifest['shell']) / 1024, len(changed), sum(size(entry) for entry in changed) / 1024))
+  if manifest['failed']:
+    lines.append('not vendored (unreachable or offline, CDN url kept): {}'.format(', '.join(manifest['failed'])))
+  return '\n'.join(lines)
+
+def _read(path):
+  with open(path, 'rb') as f:
+    return f.read()
+
+def _write(path, data):
+  os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+  temp = '{}.{}.tmp'.format(path, os.getpid())
+  with open(temp, 'wb') as f:
+    f.write(data)
+  os.replace(temp, path)
+
+# .gz/.br variants when smaller than the file, returns their sizes (the variants of a content
+# addressed file already written are kept, force: rewritten)
+def _compress(path, data, ext, force=False):
+  sizes = {}
+  if ext.lower() not in COMPRESSED:
+    return sizes
+  variants = [('gzip', '.gz', lambda data: gzip.compress(data, 9, mtime=0))]
+  if brotli is not None:
+    variants.append(('br', '.br', lambda data: brotli.compress(data, quality=11)))
+  for encoding, suffix, compress in variants:
+    if not force and os.path.exists(path + suffix):
+      sizes[encoding] = os.path.getsize(path + suffix)
+      continue
+    compressed = compress(data)
+    if len(compressed) < len(data):
+      _write(path + suffix, compressed)
+      sizes[encoding] = len(compressed)
+    elif os.path.exists(path + suffix):
+      os.remove(path + suffix)
+  return sizes
+
+#################### SERVING ####################
+
+# bundle files (hashed assets cached for a year, the shell revalidated), the other paths served
+# from the project directory (tiles, MBTiles)
+def make_bundle_handler(directory, root='.'):
+  base = make_handler(os.path.abspath(root))
+
+  class BundleHandler(base):
+
+    def bundled(self):
+      path = urllib.parse.unquote(self.path.split('?')[0]).lstrip('/')
+      manifest = read_manifest(directory)
+      if not manifest:
+        return None
+      if path in ('', 'index.html'):
+        path = manifest['shell']['file']
+      if path == manifest['shell']['file']:
+        return path, manifest['shell'], 'no-cache'
+      if path.startswith(ASSETS + '/') and path[len(ASSETS) + 1:] in manifest['assets']:
+        return path, manifest['assets'][path[len(ASSETS) + 1:]], IMMUTABLE
+      return None
+
+    def send_bundled(self, head):
+      found = self.bundled()
+      if found is None:
+        return False
+      path, entry, cache_control = found
+      accepted = self.headers.get('Accept-Encoding', '')
+      encoding, suffix = None, ''
+      if 'br' in entry and 'br' in accepted:
+        encoding, suffix = 'br', '.br'
+      elif 'gzip' in entry and 'gzip' in accepted:
+        encoding, suffix = 'gzip', '.gz'
+      etag = '"{}{}"'.format(entry['etag'], '-' + encoding if encoding else '')
+      if etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]:
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', cache_control)
+        self.send_header('Vary', 'Accept-Encoding')
+        self.end_headers()
+        return True
+      data = _read(os.path.join(directory, path + suffix))
+      self.send_response(200)
+      self.send_header('Content-Type', mimetypes.guess_type(path)[0] or 'application/octet-stream')
+      if encoding:
+        self.send_header('Content-Encoding', encoding)
+      self.send_header('Content-Length', str(len(data)))
+      self.send_header('ETag', etag)
+      self.send_header('Cache-Control', cache_control)
+      self.send_header('Vary', 'Accept-Encoding')
+      self.end_headers()
+      if not head:
+        self.wfile.write(data)
+      return True
+
+    def do_GET(self):
+      if not self.send_bundled(head=False):
+        super().do_GET()
+
+    def do_HEAD(self):
+      if not self.send_bundled(head=True):
+        super().do_HEAD()
+
+  return BundleHandler
+
+def serve(directory=OUTPUT_DIR, port=8000, root='.'):
+  server = ThreadingHTTPServer(('', port), make_bundle_handler(os.path.abspath(directory), root))
+  shell = read_manifest(directory).get('shell', {}).get('file', '')
+  print('Serving {} on http://localhost:{}/{}'.format(os.path.abspath(directory), port, shell))
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Hashed, precompressed map bundle')
+  commands = parser.add_subparsers(dest='command', required=True)
+  build_parser = commands.add_parser('build')
+  build_parser.add_argument('page', nargs='?', default='webmap.html')
+  build_parser.add_argument('output_dir', nargs='?', default=OUTPUT_DIR)
+  serve_parser = commands.add_parser('serve')
+  serve_parser.add_argument('directory', nargs='?', default=OUTPUT_DIR)
+  serve_parser.add_argument('--port', type=int, default=8000)
+  args = parser.parse_args()
+  if args.command == 'build':
+    build(args.page, args.output_dir)
+  else:
+    serve(args.directory, args.port)
@@ -0,0 +1,279 @@
+# ########## Canvas rendering with a client side spatial index
+# With Leaflet's default SVG renderer every feature is a DOM node with its own mouse listeners
+# (highlight, tooltip): large polygon layers make panning stutter. In the canvas mode the vector
+# layers are drawn on a shared L.canvas renderer as non interactive paths, and a single map
+# mousemove handler finds the feature under the mouse through a static R-tree of the features
+# bounding boxes, packed at build time (Hilbert sorted, flat arrays, same layout as the
+# flatbush JS library), then an exact test (point in polygon, distance to the lines in pixels)
+# on the few candidates. The hovered feature gets the layer highlight style and a tooltip with
+# the layer tooltip fields, like the SVG mode. As with SVG paths, unfilled polygons (fillColor
+# 'none', fillOpacity 0 or fill false) are only hovered along their outline.
+import json
+
+from branca.element import Element, MacroElement
+from jinja2 import Template
+
+from portmap.geometry import geometry_bounds
+from portmap.registry import TOOLTIP_STYLE
+
+# R-tree node capacity
+NODE_SIZE = 16
+# hover tolerance around lines and points (pixels)
+TOLERANCE = 4
+HILBERT_MAX = (1 << 16) - 1
+
+# position of (x, y) (0 to 65535) along the Hilbert curve
+def hilbert(x, y):
+  d = 0
+  s = 1 << 15
+  while s > 0:
+    rx = 1 if x & s else 0
+    ry = 1 if y & s else 0
+    d += s * s * ((3 * rx) ^ ry)
+    if ry == 0:
+      if rx == 1:
+        x, y = HILBERT_MAX - x, HILBERT_MAX - y
+      x, y = y, x
+    s >>= 1
+  return d
+
+# ##### packed R-tree of boxes [(west, south, east, north), ...]: boxes of the items (Hilbert
+# sorted) followed by the nodes of each level, indices: item index of the leaves, offset of
+# the first child box of the nodes, level_bounds: end offset of each level in boxes
+def pack(boxes, node_size=NODE_SIZE):
+  n = len(boxes)
+  if not n:
+    return {'n': 0, 'node_size': node_size, 'boxes': [], 'indices': [], 'level_bounds': []}
+  west = min(box[0] for box in boxes)
+  south = min(box[1] for box in boxes)
+  width = (max(box[2] for box in boxes) - west) or 1.0
+  height = (max(box[3] for box in boxes) - south) or 1.0
+  order = sorted(range(n), key=lambda i: hilbert(int(HILBERT_MAX * ((boxes[i][0] + boxes[i][2]) / 2 - west) / width),
+                                                 int(HILBERT_MAX * ((boxes[i][1] + boxes[i][3]) / 2 - south) / height)))
+  packed = [list(boxes[i]) for i in order]
+  indices = list(order)
+  level_bounds = [4 * n]
+  start, end = 0, n
+  while True:
+    for first in range(start, end, node_size):
+      children = packed[first:min(first + node_size, end)]
+      packed.append([min(box[0] for box in children), min(box[1] for box in children),
+                     max(box[2] for box in children), max(box[3] for box in children)])
+      indices.append(4 * first)
+    start, end = end, len(packed)
+    level_bounds.append(4 * end)
+    if end - start == 1:
+      break
+  return {'n': n, 'node_size': node_size, 'boxes': [round(value, 6) for box in packed for value in box],
+          'indices': indices, 'level_bounds': level_bounds}
+
+# polygons of a layer style hovered over their area (Leaflet defaults: fill true, fillOpacity 0.2)
+def filled(style):
+  return style.get('fill', True) is not False and style.get('fillColor') != 'none' and style.get('fillOpacity', 0.2) != 0
+
+# index of the features with a geometry (the ones Leaflet draws, in the same order)
+def feature_index(data, node_size=NODE_SIZE):
+  return pack([geometry_bounds(feature['geometry']) for feature in data['features'] if feature.get('geometry')], node_size)
+
+# ##### hover engine (one per page): shared canvas renderer of each map, layers registry,
+# R-tree search and hit tests
+_ENGINE = u"""
+<style>.portmap-tooltip { {{ style }} } .portmap-tooltip th { text-align: left; padding-right: 6px; }</style>
+<script>
+var portmapHover = (function() {
+  function upperBound(value, bounds) {
+    var i = 0, j = bounds.length - 1;
+    while (i < j) {
+      var m = (i + j) >> 1;
+      if (bounds[m] > value) { j = m; } else { i = m + 1; }
+    }
+    return bounds[i];
+  }
+  // items whose box intersects the query box
+  function search(tree, minX, minY, maxX, maxY) {
+    var boxes = tree.boxes, results = [], queue = [];
+    var node = boxes.length - 4;
+    while (node !== undefined) {
+      var end = Math.min(node + tree.nodeSize * 4, upperBound(node, tree.levelBounds));
+      for (var pos = node; pos < end; pos += 4) {
+        if (maxX < boxes[pos] || maxY < boxes[pos + 1] || minX > boxes[pos + 2] || minY > boxes[pos + 3]) { continue; }
+        if (node >= tree.n * 4) { queue.push(tree.indices[pos >> 2]); } else { results.push(tree.indices[pos >> 2]); }
+      }
+      node = queue.pop();
+    }
+    return results;
+  }
+  function inRing(x, y, ring) {
+    var inside = false;
+    for (var i = 0, j = ring.length - 1; i < ring.length; j = i++) {
+      var xi = ring[i][0], yi = ring[i][1], xj = ring[j][0], yj = ring[j][1];
+      if ((yi > y) !== (yj > y) && x < (xj - xi) * (y - yi) / (yj - yi) + xi) { inside = !inside; }
+    }
+    return inside;
+  }
+  function inPolygon(x, y, rings) {
+    if (!inRing(x, y, rings[0])) { return false; }
+    for (var i = 1; i < rings.length; i++) {
+      if (inRing(x, y, rings[i])) { return false; }
+    }
+    return true;
+  }
+  function nearLine(map, point, line, tolerance) {
+    var previous = null;
+    for (var i = 0; i < line.length; i++) {
+      var current = map.latLngToLayerPoint([line[i][1], line[i][0]]);
+      if (previous && L.LineUtil.pointToSegmentDistance(point, previous, current) <= tolerance) { return true; }
+      if (!previous && line.length === 1 && point.distanceTo(current) <= tolerance) { return true; }
+      previous = current;
+    }
+    return false;
+  }
+  function nearRings(map, point, rings, tolerance) {
+    for (var i = 0; i < rings.length; i++) { if (nearLine(map, point, rings[i], tolerance)) { return true; } }
+    return false;
+  }
+  // filled: polygons hit over their area, along their rings otherwise
+  function hit(map, geometry, latlng, point, tolerance, filled) {
+    var c = geometry.coordinates, i, x = latlng.lng, y = latlng.lat;
+    switch (geometry.type) {
+      case 'Polygon': return filled ? inPolygon(x, y, c) : nearRings(map, point, c, tolerance);
+      case 'MultiPolygon':
+        for (i = 0; i < c.length; i++) {
+          if (filled ? inPolygon(x, y, c[i]) : nearRings(map, point, c[i], tolerance)) { return true; }
+        }
+        return false;
+      case 'LineString': return nearLine(map, point, c, tolerance);
+      case 'MultiLineString':
+        for (i = 0; i < c.length; i++) { if (nearLine(map, point, c[i], tolerance)) { return true; } }
+        return false;
+      case 'Point': return nearLine(map, point, [c], tolerance);
+      case 'MultiPoint':
+        for (i = 0; i < c.length; i++) { if (nearLine(map, point, [c[i]], tolerance)) { return true; } }
+        return false;
+      case 'GeometryCollection':
+        for (i = 0; i < geometry.geometries.length; i++) { if (hit(map, geometry.geometries[i], latlng, point, tolerance, filled)) { return true; } }
+        return false;
+    }
+    return false;
+  }
+  function escape(value) {
+    return String(value).replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;');
+  }
+  function content(tooltip, feature) {
+    if (tooltip.text) { return escape(tooltip.text); }
+    var properties = feature.properties || {}, rows = '';
+    for (var i = 0; i < tooltip.fields.length; i++) {
+      var value = properties[tooltip.fields[i]];
+      rows += '<tr><th>' + escape(tooltip.aliases[i]) + '</th><td>' + (value === undefined || value === null ? '' : escape(value)) + '</td></tr>';
+    }
+    return '<table>' + rows + '</table>';
+  }
+  var states = {};
+  function state(map) {
+    var id = L.stamp(map);
+    if (states[id]) { return states[id]; }
+    var s = states[id] = {
+      renderer: L.canvas({padding: 0.5}), layers: [], current: null, frame: null,
+      tooltip: L.tooltip({sticky: true, className: 'portmap-tooltip'})
+    };
+    map.on('mousemove', function(e) {
+      s.event = e;
+      if (s.frame === null) {
+        s.frame = L.Util.requestAnimFrame(function() { s.frame = null; query(map, s, s.event); });
+      }
+    });
+    map.on('mouseout', function() { leave(map, s); });
+    return s;
+  }
+  function leave(map, s) {
+    if (s.current) {
+      s.current.entry.layer.resetStyle(s.current.layer);
+      s.current = null;
+      map.closeTooltip(s.tooltip);
+      map.getContainer().style.cursor = '';
+    }
+  }
+  function enter(map, s, entry, layer, latlng) {
+    if (!s.current || s.current.layer !== layer) {
+      leave(map, s);
+      s.current = {entry: entry, layer: layer};
+      if (entry.highlight) {
+        layer.setStyle(typeof entry.highlight === 'function' ? entry.highlight(layer.feature) : entry.highlight);
+      }
+      map.getContainer().style.cursor = 'pointer';
+      if (entry.tooltip) { s.tooltip.setContent(content(entry.tooltip, layer.feature)); }
+    }
+    if (entry.tooltip) {
+      s.tooltip.setLatLng(latlng);
+      if (!map.hasLayer(s.tooltip)) { map.openTooltip(s.tooltip); }
+    }
+  }
+  // topmost layer first, topmost feature of a layer first
+  function query(map, s, e) {
+    var point = e.layerPoint, tolerance = {{ tolerance }};
+    var sw = map.layerPointToLatLng([point.x - tolerance, point.y + tolerance]);
+    var ne = map.layerPointToLatLng([point.x + tolerance, point.y - tolerance]);
+    for (var i = s.layers.length - 1; i >= 0; i--) {
+      var entry = s.layers[i];
+      if (!map.hasLayer(entry.layer)) { continue; }
+      var layers = entry.layer.getLayers();
+      // lazy layers: data not loaded yet
+      if (layers.length !== entry.tree.n) { continue; }
+      var found = search(entry.tree, sw.lng, sw.lat, ne.lng, ne.lat).sort(function(a, b) { return b - a; });
+      for (var j = 0; j < found.length; j++) {
+        var layer = layers[found[j]];
+        var weight = (layer.options && layer.options.weight) || 0;
+        if (hit(map, layer.feature.geometry, e.latlng, point, tolerance + weight / 2, entry.filled)) {
+          enter(map, s, entry, layer, e.latlng);
+          return;
+        }
+      }
+    }
+    leave(map, s);
+  }
+  return {
+    renderer: function(map) { return state(map).renderer; },
+    add: function(map, layer, tree, highlight, tooltip, filled) {
+      state(map).layers.push({layer: layer, highlight: highlight, tooltip: tooltip, filled: filled, tree: {
+        n: tree.n, nodeSize: tree.node_size, boxes: new Float64Array(tree.boxes),
+        indices: new Uint32Array(tree.indices), levelBounds: tree.level_bounds
+      }});
+    }
+  };
+})();
+</script>
+"""
+
+# ##### child of a vector layer drawn on canvas (renderer='canvas'): registers the layer, its
+# R-tree and tooltip with the hover engine
+# tooltip: {'fields': [...], 'aliases': [...]} or {'text': '...'} (None: no tooltip), filled:
+# polygons hovered over their area (see filled())
+class HoverIndex(MacroElement):
+  _template = Template(u"""
+    {% macro script(this, kwargs) %}
+    portmapHover.add({{ this._parent._parent.get_name() }}, {{ this._parent.get_name() }}, {{ this.tree|tojson }},
+      {%- if this._parent.highlight_js %} {{ this._parent.get_name() }}_highlight{% else %} null{% endif %}, {{ this.tooltip|tojson }},
+      {{ this.filled|tojson }});
+    {% endmacro %}
+    """)
+
+  def __init__(self, data, tooltip=None, filled=True, node_size=NODE_SIZE):
+    super(HoverIndex, self).__init__()
+    self._name = 'HoverIndex'
+    self.tree = feature_index(data, node_size)
+    self.tooltip = tooltip
+    self.filled = filled
+
+  def render(self, **kwargs):
+    engine = Template(_ENGINE).render(style=TOOLTIP_STYLE, tolerance=json.dumps(TOLERANCE))
+    self.get_root().header.add_child(Element(engine), name='portmap_hover')
+    super(HoverIndex, self).render(**kwargs)
+
+# tooltip of a vector layer for the hover engine
+def hover_tooltip(layer, fields=(), aliases=()):
+  if layer.tooltip_fields or fields:
+    fields = list(layer.tooltip_fields) + list(fields)
+    return {'fields': fields, 'aliases': list(layer.tooltip_aliases or layer.tooltip_fields) + list(aliases)}
+  if layer.tooltip_text:
+    return {'text': layer.tooltip_text}
+  return None
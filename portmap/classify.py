@@ -0,0 +1,95 @@
+# ########## Classification
+# A classification is one sorted table of classes (lower bound, color, label) shared by the
+# classified raster, its visual parameters and the legend. Class i (1..n) holds the values in
+# [bound i, bound i + 1), values below the first bound are left unclassified (masked). Classes
+# are assigned in a single pass, digitize-style: the number of bounds a value reaches, with
+# Earth Engine (one comparison against a constant image of all the bounds, summed) or with
+# NumPy (np.digitize) for the local raster backend. Per class pixel counts and areas over the
+# AOI are computed from the classified raster (ee reduceRegion or portmap.raster.value_areas).
+import numpy as np
+from jinja2 import Template
+
+class Classification:
+
+  # classes: [(lower bound, color, label), ...] sorted by strictly increasing bounds
+  def __init__(self, classes):
+    bounds = [bound for bound, _, _ in classes]
+    if not bounds or any(lower >= upper for lower, upper in zip(bounds, bounds[1:])):
+      raise ValueError('classes bounds must be strictly increasing: {}'.format(bounds))
+    self.classes = list(classes)
+    self.bounds = bounds
+    self.colors = [color for _, color, _ in classes]
+    self.labels = [label for _, _, label in classes]
+
+  def __repr__(self):
+    return 'Classification({!r})'.format(self.classes)
+
+  # visual parameters of the classified raster: one palette color per class value
+  def vis_params(self):
+    return {'min': 1, 'max': len(self.classes), 'palette': self.colors}
+
+  # ##### Earth Engine: single band image -> class values (byte, masked below the first bound)
+  def ee_classify(self, image):
+    import ee
+    classes = image.gte(ee.Image.constant(self.bounds)).reduce(ee.Reducer.sum())
+    return classes.updateMask(image.gte(self.bounds[0])).toByte().rename('class')
+
+  # ##### NumPy: values -> class values as float32 (NaN: unclassified, like the other products)
+  def classify(self, values):
+    classes = np.digitize(values, self.bounds).astype(np.float32)
+    classes[(classes == 0) | np.isnan(values)] = np.nan
+    return classes
+
+  # ##### per class pixel counts and hectares, areas: {class value: (pixels, square meters)}
+  def summary(self, areas):
+    rows = []
+    for value, (bound, color, label) in enumerate(self.classes, 1):
+      pixels, area = areas.get(value, (0, 0.0))
+      rows.append({'class': value, 'range': self.range(value), 'label': label, 'color': color,
+                   'pixels': int(pixels), 'hectares': area / 10000})
+    return rows
+
+  # class areas of an Earth Engine classified image over a region: {class value: (pixels, square meters)}
+  def ee_areas(self, classified, region, scale):
+    import ee
+    mask = classified.mask()
+    image = ee.Image.pixelArea().updateMask(mask).addBands(ee.Image.constant(1).updateMask(mask)).addBands(classified)
+    reducer = ee.Reducer.sum().unweighted().repeat(2).group(groupField=2, groupName='class')
+    groups = image.reduceRegion(reducer, region, scale, maxPixels=1e10).getInfo()['groups']
+    return {int(group['class']): (group['sum'][1], group['sum'][0]) for group in groups}
+
+  def range(self, value):
+    if value == len(self.classes):
+      return '> {:g}'.format(self.bounds[-1])
+    return '{:g} - {:g}'.format(self.bounds[value - 1], self.bounds[value])
+
+  def report(self, areas, title='classes'):
+    rows = self.summary(areas)
+    lines = ['{:<40} {:>12} {:>12}'.format(title, 'pixels', 'hectares')]
+    for row in rows:
+      lines.append('{:<40} {:>12} {:>12.2f}'.format('{} : {}'.format(row['range'], row['label']),
+                                                   row['pixels'], row['hectares']))
+    lines.append('{:<40} {:>12} {:>12.2f}'.format('total', sum(r['pixels'] for r in rows),
+                                                 sum(r['hectares'] for r in rows)))
+    return '\n'.join(lines)
+
+  # ##### legend list items (with the class areas when given)
+  def legend(self, areas=None):
+    return _LEGEND.render(rows=self.summary(areas or {}), areas=areas is not None)
+
+_LEGEND = Template(u"""
+{%- for row in rows %}
+<li><span style='background:{{ row.color }};opacity:0.8;'></span>{{ row.range }} : {{ row.label }}{% if areas %} ({{ '%.1f'|format(row.hectares) }} ha){% endif %}</li>
+{%- endfor %}
+""")
+
+# NDVI classes (webmap.py 'NDVI - Classified' layer and legend)
+NDVI_CLASSES = Classification([
+  (0.0, '#ed5e3d', 'Bareland / Settlements'),
+  (0.15, '#f9f7ae', 'Sparse vegetation'),
+  (0.25, '#fec978', 'Crops'),
+  (0.35, '#9ed569', 'Low vegetation'),
+  (0.45, '#229b51', 'Moderate vegetation'),
+  (0.65, '#006837', 'High vegetation'),
+  (0.75, '#004529', 'Forest')
+])
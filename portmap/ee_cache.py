@@ -0,0 +1,65 @@
+# ########## Earth Engine map ids cache
+# getMapId results stored on disk (.cache/ee/<key>.json) under a key hashing the serialized
+# ee expression graph + the visual parameters: an unchanged image/AOI/vis_params reuses its
+# map id/tiles url until it expires, only new or expired entries hit Earth Engine.
+import hashlib
+import json
+import os
+import time
+
+from portmap import trace
+
+CACHE_DIR = os.path.join('.cache', 'ee')
+# Earth Engine map ids expire after 48h, refreshing them one hour before
+TTL = 47 * 3600
+
+# content address of an ee image + its visual parameters
+def cache_key(ee_image_object, vis_params):
+  import ee
+  graph = ee.Image(ee_image_object).serialize()
+  payload = json.dumps({'graph': graph, 'vis_params': vis_params}, sort_keys=True)
+  return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def _path(key, cache_dir):
+  return os.path.join(cache_dir, key + '.json')
+
+def read_entry(key, cache_dir=CACHE_DIR):
+  try:
+    with open(_path(key, cache_dir), encoding='utf-8') as f:
+      entry = json.load(f)
+  except (OSError, ValueError):
+    return None
+  if entry.get('expires', 0) <= time.time():
+    return None
+  return entry
+
+def write_entry(key, entry, cache_dir=CACHE_DIR):
+  os.makedirs(cache_dir, exist_ok=True)
+  path = _path(key, cache_dir)
+  # writing then renaming so concurrent builds never read a partial entry
+  temp = '{}.{}.tmp'.format(path, os.getpid())
+  with open(temp, 'w', encoding='utf-8') as f:
+    json.dump(entry, f)
+  os.replace(temp, path)
+
+def request_map_id(ee_image_object, vis_params, ttl=TTL):
+  import ee
+  with trace.span('ee.getMapId'):
+    trace.count('ee_requests')
+    map_id_dict = ee.Image(ee_image_object).getMapId(vis_params)
+  now = time.time()
+  return {
+    'mapid': map_id_dict.get('mapid'),
+    'url_format': map_id_dict['tile_fetcher'].url_format,
+    'created': now,
+    'expires': now + ttl
+  }
+
+# ##### map id of one image (cached)
+def get_map_id(ee_image_object, vis_params, cache_dir=CACHE_DIR, ttl=TTL):
+  key = cache_key(ee_image_object, vis_params)
+  entry = read_entry(key, cache_dir)
+  if entry is None:
+    entry = request_map_id(ee_image_object, vis_params, ttl)
+    write_entry(key, entry, cache_dir)
+  return entry
@@ -0,0 +1,234 @@
+# ########## Earth Engine tiles cache
+# Pre-rendering the tiles of an Earth Engine layer over the AOI for a zoom range into a
+# local XYZ directory (<root>/<layer>/{z}/{x}/{y}.png) or a MBTiles file (<root>/<layer>.mbtiles),
+# fetched concurrently with a bounded pool of workers. The map then points at the local
+# tiles: no Earth Engine round-trip on pan/zoom and no dependency on the 48h token.
+# A store is stamped with what its tiles were made from (e.g. the cache key of the Earth Engine
+# image and visual parameters): all its tiles are fetched again when the stamp changes.
+import json
+import os
+import sqlite3
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from portmap.mvt import tiles_for_bounds
+
+# number of concurrent tile requests
+WORKERS = 8
+RETRIES = 3
+TIMEOUT = 30
+
+def tile_coordinates(bounds, min_zoom, max_zoom):
+  return [(z, x, y) for z in range(min_zoom, max_zoom + 1) for x, y in tiles_for_bounds(bounds, z)]
+
+def tile_url(url_format, z, x, y):
+  return url_format.replace('{z}', str(z)).replace('{x}', str(x)).replace('{y}', str(y))
+
+# downloading one tile (retrying with backoff on network/server errors)
+def fetch_tile(url, retries=RETRIES, timeout=TIMEOUT):
+  for attempt in range(retries):
+    try:
+      with urllib.request.urlopen(url, timeout=timeout) as response:
+        return response.read()
+    except urllib.error.HTTPError as error:
+      if error.code < 500 or attempt == retries - 1:
+        raise
+    except (urllib.error.URLError, TimeoutError):
+      if attempt == retries - 1:
+        raise
+    time.sleep(0.5 * 2 ** attempt)
+
+#################### TILE STORES ####################
+
+# XYZ directory: <path>/{z}/{x}/{y}.png, stamp in <path>/stamp.json
+class DirectoryStore:
+
+  def __init__(self, path):
+    self.path = path
+
+  def _file(self, z, x, y):
+    return os.path.join(self.path, str(z), str(x), '%d.png' % y)
+
+  def has(self, z, x, y):
+    return os.path.exists(self._file(z, x, y))
+
+  # written then renamed: an interrupted build never leaves a truncated tile
+  def put(self, z, x, y, data):
+    path = self._file(z, x, y)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temp, 'wb') as f:
+      f.write(data)
+    os.replace(temp, path)
+
+  def stamp(self):
+    try:
+      with open(os.path.join(self.path, 'stamp.json'), encoding='utf-8') as f:
+        return json.load(f)
+    except (OSError, ValueError):
+      return None
+
+  def set_stamp(self, stamp):
+    os.makedirs(self.path, exist_ok=True)
+    with open(os.path.join(self.path, 'stamp.json'), 'w', encoding='utf-8') as f:
+      json.dump(stamp, f)
+
+  def close(self):
+    pass
+
+# MBTiles 1.3 file (tile_row in TMS order: y axis flipped)
+class MBTilesStore:
+
+  def __init__(self, path, name='', bounds=None, min_zoom=0, max_zoom=0):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    self.db = sqlite3.connect(path)
+    self.db.execute('CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT)')
+    self.db.execute('CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)')
+    self.db.execute('CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row)')
+    metadata = {'name': name, 'format': 'png', 'type': 'overlay', 'minzoom': min_zoom, 'maxzoom': max_zoom}
+    if bounds:
+      metadata['bounds'] = ','.join(str(b) for b in bounds)
+    self.db.execute("DELETE FROM metadata WHERE name != 'stamp'")
+    self.db.executemany('INSERT INTO metadata VALUES (?, ?)', [(k, str(v)) for k, v in metadata.items()])
+    self.db.commit()
+
+  def has(self, z, x, y):
+    row = self.db.execute('SELECT 1 FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?',
+                          (z, x, 2 ** z - 1 - y)).fetchone()
+    return row is not None
+
+  def put(self, z, x, y, data):
+    self.db.execute('INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)', (z, x, 2 ** z - 1 - y, sqlite3.Binary(data)))
+
+  # stamp kept in the metadata table
+  def stamp(self):
+    row = self.db.execute("SELECT value FROM metadata WHERE name = 'stamp'").fetchone()
+    return json.loads(row[0]) if row else None
+
+  def set_stamp(self, stamp):
+    self.db.execute("DELETE FROM metadata WHERE name = 'stamp'")
+    self.db.execute("INSERT INTO metadata VALUES ('stamp', ?)", (json.dumps(stamp),))
+
+  def close(self):
+    self.db.commit()
+    self.db.close()
+
+def read_mbtiles_tile(path, z, x, y):
+  db = sqlite3.connect(path)
+  try:
+    row = db.execute('SELECT tile_data FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?',
+                     (z, x, 2 ** z - 1 - y)).fetchone()
+  finally:
+    db.close()
+  return row[0] if row else None
+
+def open_store(root, name, tiles_format, bounds, min_zoom, max_zoom):
+  if tiles_format == 'mbtiles':
+    return MBTilesStore(os.path.join(root, name + '.mbtiles'), name, bounds, min_zoom, max_zoom)
+  return DirectoryStore(os.path.join(root, name))
+
+#################### CACHING ####################
+
+# tiles of the layer missing from the local store
+def missing_tiles(store, bounds, min_zoom, max_zoom):
+  return [t for t in tile_coordinates(bounds, min_zoom, max_zoom) if not store.has(*t)]
+
+# stamp: what the tiles have to be made from (None: any tiles)
+def is_cached(root, name, tiles_format, bounds, min_zoom, max_zoom, stamp=None):
+  if tiles_format == 'mbtiles' and not os.path.exists(os.path.join(root, name + '.mbtiles')):
+    return False
+  store = open_store(root, name, tiles_format, bounds, min_zoom, max_zoom)
+  try:
+    if stamp is not None and store.stamp() != stamp:
+      return False
+    return not missing_tiles(store, bounds, min_zoom, max_zoom)
+  finally:
+    store.close()
+
+# ##### downloading the missing tiles of a layer (url_format: {z}/{x}/{y} template, e.g. the
+# Earth Engine tile_fetcher.url_format), the store is only written from the calling thread
+# stamp: what the tiles are made from, all of them are fetched again (refresh) when the store
+# has another one, the store being stamped once every tile was fetched
+def cache_tiles(url_format, root, name, bounds, min_zoom, max_zoom, tiles_format='xyz', workers=WORKERS, refresh=False,
+                fetch=fetch_tile, stamp=None):
+  started = time.time()
+  store = open_store(root, name, tiles_format, bounds, min_zoom, max_zoom)
+  stats = {'layer': name, 'fetched': 0, 'cached': 0, 'failed': 0, 'bytes': 0}
+  try:
+    refresh = refresh or (stamp is not None and store.stamp() != stamp)
+    tiles = tile_coordinates(bounds, min_zoom, max_zoom)
+    todo = tiles if refresh else [t for t in tiles if not store.has(*t)]
+    stats['cached'] = len(tiles) - len(todo)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+      futures = {pool.submit(fetch, tile_url(url_format, *t)): t for t in todo}
+      for future in as_completed(futures):
+        try:
+          data = future.result()
+        except Exception as error:
+          stats['failed'] += 1
+          print('tile {}/{}/{} of {}: {}'.format(*futures[future], name, error), file=sys.stderr)
+          continue
+        store.put(*futures[future], data)
+        stats['fetched'] += 1
+        stats['bytes'] += len(data)
+    if stamp is not None and not stats['failed']:
+      store.set_stamp(stamp)
+  finally:
+    store.close()
+  stats['seconds'] = round(time.time() - started, 2)
+  return stats
+
+# url of the cached tiles as referenced from the map
+def local_url(root, name):
+  return '/'.join([root.replace(os.sep, '/'), name, '{z}/{x}/{y}.png'])
+
+#################### SERVING ####################
+
+# static files server also answering <root>/<layer>/{z}/{x}/{y}.png from <root>/<layer>.mbtiles
+def make_handler(directory):
+  class TilesHandler(SimpleHTTPRequestHandler):
+
+    def __init__(self, *args, **kwargs):
+      super().__init__(*args, directory=directory, **kwargs)
+
+    def do_GET(self):
+      path = self.path.split('?')[0].lstrip('/')
+      parts = path.split('/')
+      if len(parts) >= 4 and parts[-1].endswith('.png') and not os.path.exists(os.path.join(directory, path)):
+        mbtiles = os.path.join(directory, *parts[:-4], parts[-4] + '.mbtiles')
+        if os.path.exists(mbtiles):
+          try:
+            z, x, y = int(parts[-3]), int(parts[-2]), int(parts[-1][:-4])
+          except ValueError:
+            return super().do_GET()
+          data = read_mbtiles_tile(mbtiles, z, x, y)
+          if data is None:
+            self.send_error(404)
+            return
+          self.send_response(200)
+          self.send_header('Content-Type', 'image/png')
+          self.send_header('Content-Length', str(len(data)))
+          self.end_headers()
+          self.wfile.write(data)
+          return
+      return super().do_GET()
+
+  return TilesHandler
+
+def serve(directory='.', port=8000):
+  server = ThreadingHTTPServer(('', port), make_handler(os.path.abspath(directory)))
+  print('Serving {} on http://localhost:{}/webmap.html'.format(os.path.abspath(directory), port))
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+
+# serving the map with its MBTiles caches: python -m portmap.ee_tiles [port]
+if __name__ == '__main__':
+  serve('.', int(sys.argv[1]) if len(sys.argv) > 1 else 8000)
@@ -0,0 +1,239 @@
+# ########## Geometry helpers
+# Pure python helpers working on GeoJSON coordinates (lon/lat, WGS84) so the
+# build does not depend on a GIS library for simple vector processing.
+import math
+
+#################### COORDINATES ####################
+
+# walking through nested coordinates arrays and yielding each position
+def iter_positions(coordinates):
+  if not coordinates:
+    return
+  if isinstance(coordinates[0], (int, float)):
+    yield coordinates
+    return
+  for part in coordinates:
+    yield from iter_positions(part)
+
+# geometry vertex count (GeometryCollection members included)
+def count_vertices(geometry):
+  if not geometry:
+    return 0
+  if geometry['type'] == 'GeometryCollection':
+    return sum(count_vertices(g) for g in geometry['geometries'])
+  return sum(1 for _ in iter_positions(geometry['coordinates']))
+
+# [west, south, east, north] bounds of a geometry
+def geometry_bounds(geometry):
+  if geometry['type'] == 'GeometryCollection':
+    positions = [p for g in geometry['geometries'] for p in iter_positions(g['coordinates'])]
+  else:
+    positions = list(iter_positions(geometry['coordinates']))
+  xs = [p[0] for p in positions]
+  ys = [p[1] for p in positions]
+  return [min(xs), min(ys), max(xs), max(ys)]
+
+# [west, south, east, north] bounds of a circular buffer (radius in meters) around a lon/lat
+# point, e.g: the AOI ee.Geometry.Point([lon, lat]).buffer(radius)
+def buffer_bounds(lon, lat, radius):
+  dlat = radius / 111320.0
+  dlon = radius / (111320.0 * math.cos(math.radians(lat)))
+  return [lon - dlon, lat - dlat, lon + dlon, lat + dlat]
+
+# returning the lines/rings of a geometry as lists of positions, grouped by part:
+# Polygon -> [rings], MultiPolygon -> [[rings], ...], LineString -> [line]
+def geometry_parts(geometry):
+  kind = geometry['type']
+  coordinates = geometry['coordinates']
+  if kind == 'LineString':
+    return [[coordinates]]
+  if kind in ('MultiLineString', 'Polygon'):
+    return [coordinates]
+  if kind == 'MultiPolygon':
+    return coordinates
+  return []
+
+# rounding coordinates to a fixed number of decimals, dropping the repeated positions it creates
+def quantize_line(line, precision, closed=False):
+  rounded = []
+  for position in line:
+    point = [round(position[0], precision), round(position[1], precision)]
+    if not rounded or rounded[-1] != point:
+      rounded.append(point)
+  if closed and len(rounded) < 4:
+    # degenerate ring after rounding: keeping the plain rounded positions
+    return [[round(p[0], precision), round(p[1], precision)] for p in line]
+  return rounded
+
+#################### SIMPLIFICATION ####################
+
+# squared distance from point p to segment a-b
+def _segment_distance2(p, a, b):
+  x, y = a[0], a[1]
+  dx, dy = b[0] - x, b[1] - y
+  if dx or dy:
+    t = ((p[0] - x) * dx + (p[1] - y) * dy) / (dx * dx + dy * dy)
+    if t > 1:
+      x, y = b[0], b[1]
+    elif t > 0:
+      x += dx * t
+      y += dy * t
+  dx, dy = p[0] - x, p[1] - y
+  return dx * dx + dy * dy
+
+# Douglas-Peucker simplification of an open line (first and last positions are always kept)
+def simplify_line(line, tolerance):
+  if tolerance <= 0 or len(line) < 3:
+    return list(line)
+  tolerance2 = tolerance * tolerance
+  keep = [False] * len(line)
+  keep[0] = keep[-1] = True
+  stack = [(0, len(line) - 1)]
+  while stack:
+    first, last = stack.pop()
+    max_distance, index = 0, 0
+    for i in range(first + 1, last):
+      distance = _segment_distance2(line[i], line[first], line[last])
+      if distance > max_distance:
+        max_distance, index = distance, i
+    if max_distance > tolerance2:
+      keep[index] = True
+      stack.append((first, index))
+      stack.append((index, last))
+  return [p for p, k in zip(line, keep) if k]
+
+# Douglas-Peucker vertex importance: the squared distance at which each vertex stops
+# being kept (first and last positions: infinite), so a line can be simplified for any
+# tolerance afterwards by keeping the vertices where importance > tolerance ** 2
+def line_importance(line):
+  importance = [0.0] * len(line)
+  if not line:
+    return importance
+  importance[0] = importance[-1] = float('inf')
+  stack = [(0, len(line) - 1)]
+  while stack:
+    first, last = stack.pop()
+    max_distance, index = -1.0, 0
+    for i in range(first + 1, last):
+      distance = _segment_distance2(line[i], line[first], line[last])
+      if distance > max_distance:
+        max_distance, index = distance, i
+    if index:
+      importance[index] = max_distance
+      stack.append((first, index))
+      stack.append((index, last))
+  return importance
+
+def _key(position):
+  return (position[0], position[1])
+
+# Topology preserving simplification of a set of lines and rings:
+# vertices where several lines meet or split (junctions) are pinned, and the arcs between
+# junctions are simplified once in a canonical direction, so a border shared by two
+# neighbouring polygons (e.g. municipalities) is simplified the same way on both sides
+# and no gaps/overlaps appear between them.
+# junctions: the junctions known beforehand (e.g. read from the disk index of a streamed layer,
+# see portmap.stream), used instead of registering the lines
+class TopologySimplifier:
+
+  def __init__(self, tolerance, junctions=None):
+    self.tolerance = tolerance
+    self.neighbours = {}
+    self.endpoints = set()
+    self.arcs = {}
+    self.junctions = junctions
+
+  # first pass: registering every line/ring to find the junctions
+  def register(self, line, closed):
+    count = len(line) - 1 if closed else len(line)
+    for i in range(count):
+      key = _key(line[i])
+      neighbours = self.neighbours.setdefault(key, set())
+      if i > 0 or closed:
+        neighbours.add(_key(line[i - 1]))
+      if i < len(line) - 1:
+        neighbours.add(_key(line[i + 1]))
+    if not closed and line:
+      self.endpoints.add(_key(line[0]))
+      self.endpoints.add(_key(line[-1]))
+
+  def is_junction(self, position):
+    key = _key(position)
+    if self.junctions is not None:
+      return key in self.junctions
+    return key in self.endpoints or len(self.neighbours.get(key, ())) > 2
+
+  # simplifying an arc in a canonical direction so both sides of a shared border match
+  def _simplify_arc(self, arc):
+    forward = _key(arc[0]) < _key(arc[-1]) or (_key(arc[0]) == _key(arc[-1]) and _key(arc[1]) <= _key(arc[-2]))
+    canonical = arc if forward else arc[::-1]
+    key = tuple(_key(p) for p in canonical)
+    if key not in self.arcs:
+      simplified = simplify_line(canonical, self.tolerance)
+      if len(simplified) < 3 and len(canonical) > 2 and _key(canonical[0]) == _key(canonical[-1]):
+        # closed arc collapsing into a point: keeping its farthest vertex
+        far = max(canonical[1:-1], key=lambda p: _segment_distance2(p, canonical[0], canonical[0]))
+        simplified = [canonical[0], far, canonical[-1]]
+      self.arcs[key] = simplified
+    simplified = self.arcs[key]
+    return simplified if forward else simplified[::-1]
+
+  # second pass: simplifying a registered line/ring
+  def simplify(self, line, closed):
+    if self.tolerance <= 0 or len(line) < 3:
+      return list(line)
+    if not closed:
+      cuts = [i for i, p in enumerate(line) if i == 0 or i == len(line) - 1 or self.is_junction(p)]
+      return self._join(line, cuts)
+    ring = line[:-1]
+    cuts = [i for i, p in enumerate(ring) if self.is_junction(p)]
+    if not cuts:
+      # free ring (no shared vertex): starting from its smallest vertex so the result is deterministic
+      start = min(range(len(ring)), key=lambda i: _key(ring[i]))
+      cuts = [0]
+      ring = ring[start:] + ring[:start]
+    else:
+      ring = ring[cuts[0]:] + ring[:cuts[0]]
+      cuts = [c - cuts[0] for c in cuts]
+    ring = ring + [ring[0]]
+    simplified = self._join(ring, cuts + [len(ring) - 1])
+    if len(simplified) < 4:
+      # ring collapsed by the simplification: keeping it untouched
+      return list(line)
+    return simplified
+
+  # importance of each vertex of a registered line/ring (see line_importance), shared arcs
+  # getting the same values on both sides; rings may come back rotated to start on a junction
+  def importance(self, line, closed):
+    if len(line) < 3:
+      return list(line), [float('inf')] * len(line)
+    if not closed:
+      cuts = [i for i, p in enumerate(line) if i == 0 or i == len(line) - 1 or self.is_junction(p)]
+    else:
+      ring = line[:-1]
+      cuts = [i for i, p in enumerate(ring) if self.is_junction(p)]
+      start = cuts[0] if cuts else min(range(len(ring)), key=lambda i: _key(ring[i]))
+      cuts = [c - start for c in cuts] or [0]
+      line = ring[start:] + ring[:start] + [ring[start]]
+      cuts.append(len(line) - 1)
+    values = [float('inf')]
+    for start, end in zip(cuts, cuts[1:]):
+      if end > start:
+        values.extend(self._arc_importance(line[start:end + 1])[1:])
+    return line, values
+
+  def _arc_importance(self, arc):
+    forward = _key(arc[0]) < _key(arc[-1]) or (_key(arc[0]) == _key(arc[-1]) and _key(arc[1]) <= _key(arc[-2]))
+    canonical = arc if forward else arc[::-1]
+    key = ('importance',) + tuple(_key(p) for p in canonical)
+    if key not in self.arcs:
+      self.arcs[key] = line_importance(canonical)
+    values = self.arcs[key]
+    return values if forward else values[::-1]
+
+  def _join(self, line, cuts):
+    joined = [line[0]]
+    for start, end in zip(cuts, cuts[1:]):
+      if end > start:
+        joined.extend(self._simplify_arc(line[start:end + 1])[1:])
+    return joined
@@ -0,0 +1,179 @@
+# ########## Incremental build
+# Every map layer (and the legend) is fingerprinted from its inputs: the layer file contents,
+# its registry entry, the ee expression graph + vis_params, the build options and the portmap
+# code. Its rendered HTML/JS fragments are stored in .cache/build/<fingerprint>.json with
+# deterministic element ids, so an unchanged layer is put back in the page as is (no GeoJSON
+# parsing, preprocessing or Earth Engine call) and only the layers that changed are rendered.
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
+
+import folium
+from branca.element import Element, Figure
+from folium.map import Layer
+
+from portmap import trace
+
+CACHE_DIR = os.path.join('.cache', 'build')
+# bumped when the stored fragments format changes
+VERSION = 1
+
+def digest(*parts):
+  payload = json.dumps(parts, sort_keys=True, default=repr)
+  return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+_file_digests = {}
+
+# contents hash of a file, memoized on its size/mtime
+def file_digest(path):
+  stat = os.stat(path)
+  memo = (path, stat.st_size, stat.st_mtime_ns)
+  if memo not in _file_digests:
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+      for block in iter(lambda: f.read(1 << 20), b''):
+        sha.update(block)
+    _file_digests[memo] = sha.hexdigest()
+  return _file_digests[memo]
+
+# the portmap modules render the layers: changing them invalidates every fragment
+def code_digest():
+  directory = os.path.dirname(os.path.abspath(__file__))
+  files = sorted(f for f in os.listdir(directory) if f.endswith('.py'))
+  return digest(VERSION, folium.__version__, [file_digest(os.path.join(directory, f)) for f in files])
+
+# element ids (uuid4 hex in folium) derived from the fingerprint, for the element and its children
+def stable_ids(element, key):
+  element._id = digest(key, element._name)[:32]
+  for i, child in enumerate(element._children.values()):
+    stable_ids(child, '{}/{}'.format(key, i))
+
+# ##### pre-rendered element
+class _Raw(Element):
+
+  def __init__(self, text):
+    super(_Raw, self).__init__()
+    self.text = text
+
+  def render(self, **kwargs):
+    return self.text
+
+# the stored header/html/script parts of a layer, rendered in place of the layer; still a
+# Layer (same name, id and options) for the LayerControl
+class Fragment(Layer):
+
+  def __init__(self, entry):
+    super(Fragment, self).__init__(name=entry['layer_name'], overlay=entry['overlay'],
+                                   control=entry['control'], show=entry['show'])
+    self._name = entry['name']
+    self._id = entry['id']
+    self.parts = entry['parts']
+
+  def render(self, **kwargs):
+    figure = self.get_root()
+    for section, parts in self.parts.items():
+      for name, text in parts:
+        getattr(figure, section).add_child(_Raw(text), name=name)
+
+# rendering an element (and its children) into a scratch figure, collecting its parts
+def capture(element, parent):
+  scratch = Figure()
+  initial = {section: set(getattr(scratch, section)._children) for section in ('header', 'html', 'script')}
+  element._parent = parent
+  element.get_root = lambda: scratch
+  try:
+    element.render()
+  finally:
+    del element.get_root
+    element._parent = None
+  parts = {}
+  for section in ('header', 'html', 'script'):
+    children = getattr(scratch, section)._children
+    parts[section] = [[name, child.render()] for name, child in children.items() if name not in initial[section]]
+  return parts
+
+#################### CACHE ####################
+
+class BuildCache:
+
+  # enabled=False: every element is prepared and rendered as usual (nothing stored)
+  def __init__(self, cache_dir=CACHE_DIR, enabled=True):
+    self.cache_dir = cache_dir
+    self.enabled = enabled
+    self.code = code_digest() if enabled else None
+    self.reused = []
+    self.rebuilt = []
+    self.steps = []
+
+  def key(self, *parts):
+    return digest(self.code, *parts)
+
+  def _path(self, key):
+    return os.path.join(self.cache_dir, key + '.json')
+
+  # stored entry of a fingerprint, None if missing, expired or if one of its output files is gone
+  def read(self, key):
+    try:
+      with open(self._path(key), encoding='utf-8') as f:
+        entry = json.load(f)
+    except (OSError, ValueError):
+      return None
+    if entry.get('expires') and entry['expires'] <= time.time():
+      return None
+    if not all(os.path.exists(path) for path in entry.get('outputs', [])):
+      return None
+    return entry
+
+  def write(self, key, entry):
+    os.makedirs(self.cache_dir, exist_ok=True)
+    path = self._path(key)
+    temp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temp, 'w', encoding='utf-8') as f:
+      json.dump(entry, f)
+    os.replace(temp, path)
+
+  # ##### element of a fingerprint: the stored fragment, or prepare() rendered under 'parent'
+  # and stored. prepare returns (element, extra) where extra is kept in the entry:
+  # 'outputs' (files the element loads), 'expires' (timestamp) and any other value
+  def fragment(self, label, key, parent, prepare):
+    if not self.enabled:
+      return prepare()
+    entry = self.read(key)
+    if entry is not None:
+      self.reused.append(label)
+      return Fragment(entry), entry
+    element, extra = prepare()
+    stable_ids(element, key)
+    with trace.span('render', layer=label):
+      parts = capture(element, parent)
+    entry = dict(extra, **{
+      'name': element._name,
+      'id': element._id,
+      'layer_name': getattr(element, 'layer_name', None),
+      'overlay': getattr(element, 'overlay', False),
+      'control': getattr(element, 'control', False),
+      'show': getattr(element, 'show', True),
+      'parts': parts
+    })
+    self.write(key, entry)
+    self.rebuilt.append(label)
+    return Fragment(entry), entry
+
+  @contextmanager
+  def step(self, name):
+    started = time.perf_counter()
+    try:
+      with trace.span(name):
+        yield
+    finally:
+      self.steps.append((name, time.perf_counter() - started))
+
+  def report(self):
+    lines = ['{:<48} {:>7.2f}s'.format(name, seconds) for name, seconds in self.steps]
+    if not self.enabled:
+      return '\n'.join(lines)
+    lines.append('{} fragments reused: {}'.format(len(self.reused), ', '.join(self.reused) or '-'))
+    lines.append('{} fragments rebuilt: {}'.format(len(self.rebuilt), ', '.join(self.rebuilt) or '-'))
+    return '\n'.join(lines)
@@ -0,0 +1,56 @@
+# ########## Lazy GeoJSON layers
+# GeoJson layer whose data is written to a sidecar .json file next to webmap.html and only
+# fetched and parsed when the layer gets enabled in the LayerControl, instead of being
+# embedded in the page and materialized on load (styles written once, see portmap.styles).
+# (sidecar files are fetched over http: the map has to be served, e.g: python -m http.server)
+import json
+import os
+
+from folium.elements import JSCSSMixin
+from jinja2 import Template
+
+from portmap import trace
+from portmap.mvt import slugify
+from portmap.styles import GEOJSON_LAYER, StyledGeoJson
+from portmap.topojson import TopoGeoJson, topology
+
+class LazyGeoJson(JSCSSMixin, StyledGeoJson):
+  _template = Template(GEOJSON_LAYER + u"""
+    {% macro script(this, kwargs) %}
+    {{ geojson_layer(this) }}
+
+    // fetching the layer data the first time the layer is added to the map
+    {{ this.get_name() }}.on('add', function() {
+      if ({{ this.get_name() }}._requested) { return; }
+      {{ this.get_name() }}._requested = true;
+      fetch({{ this.data_url|tojson }})
+        .then(function(response) { return response.json(); })
+        {%- if this.topojson %}
+        .then(function(data) { {{ this.get_name() }}.addData(topojson.feature(data, data.objects.layer)); })
+        {%- else %}
+        .then(function(data) { {{ this.get_name() }}.addData(data); })
+        {%- endif %}
+        .catch(function() { {{ this.get_name() }}._requested = false; });
+    });
+    {%- if this.show %}
+    {# hidden layers are not added at all (the LayerControl would add then remove them, fetching their data on load) #}
+    {{ this.get_name() }}.addTo({{ this._parent.get_name() }});
+    {%- endif %}
+    {% endmacro %}
+    """)
+
+  # data: FeatureCollection dict, written to <data_dir>/<slug of name>.json and fetched from
+  # the same relative url; lazy layers are hidden on load unless show=True
+  # topojson: written as a topology (<slug of name>.topojson) decoded by topojson-client
+  def __init__(self, data, name=None, data_dir='data', show=False, topojson=False, **kwargs):
+    super(LazyGeoJson, self).__init__(data, name=name, show=show, **kwargs)
+    self._name = 'LazyGeoJson'
+    self.topojson = topojson
+    self.default_js = [TopoGeoJson.default_js[0]] if topojson else []
+    os.makedirs(data_dir, exist_ok=True)
+    filename = slugify(name or self.get_name()) + ('.topojson' if topojson else '.json')
+    with open(os.path.join(data_dir, filename), 'w', encoding='utf-8') as f:
+      json.dump(topology(self.data, 'layer') if topojson else self.data, f, separators=(',', ':'))
+      trace.count('bytes_written', f.tell())
+    self.data_url = '/'.join([data_dir.replace(os.sep, '/'), filename])
+
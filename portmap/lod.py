@@ -0,0 +1,144 @@
+# ########## Zoom dependent levels of detail
+# A layer with 'lod' zoom levels (e.g. [8, 10, 12, 14]) is simplified once per level with a
+# tolerance of about one screen pixel at that zoom, and the map draws the variant of the current
+# zoom, swapping it on zoomend: the vertices drawn per frame stay bounded at any zoom instead of
+# drawing the full resolution borders at zoom 8. A variant is only decoded into Leaflet layers
+# the first time its zoom is reached, the detailed one being used from the last level on. The
+# builder uses it in the 'lazy' vector mode, where every variant is a sidecar file only fetched
+# then (embedded variants would all be downloaded with the page).
+# Simplifying a variant keeps every feature (in the same order), so the tooltip fields and the
+# canvas hover index (portmap.canvas, built from the most detailed variant) apply to all of them.
+import json
+import math
+import os
+
+from folium.elements import JSCSSMixin
+from jinja2 import Template
+
+from portmap import trace
+from portmap.geometry import geometry_bounds
+from portmap.mvt import slugify
+from portmap.preprocess import PRECISION, layer_stats, preprocess
+from portmap.styles import GEOJSON_LAYER, StyledGeoJson
+from portmap.topojson import TopoGeoJson, topology
+
+# simplification tolerance of a level, in screen pixels
+PIXELS = 1.0
+
+# size of a screen pixel at a zoom level (degrees, web mercator 256px tiles) at a latitude
+def pixel_size(zoom, latitude=0.0):
+  return 360.0 / (256 * 2 ** zoom) * math.cos(math.radians(latitude))
+
+def _mean_latitude(data):
+  bounds = [geometry_bounds(feature['geometry']) for feature in data['features'] if feature.get('geometry')]
+  if not bounds:
+    return 0.0
+  return (min(b[1] for b in bounds) + max(b[3] for b in bounds)) / 2
+
+# ##### variants of an already preprocessed layer: [(min zoom, data, stats), ...], one per zoom
+# level simplified with a tolerance of 'pixels' at that zoom, down to the layer's own tolerance:
+# the layer data is used as is from the last level (or the first level whose pixel is smaller
+# than the layer tolerance) on
+def variants(data, zooms, tolerance=0, precision=PRECISION, pixels=PIXELS):
+  zooms = sorted(zooms)
+  latitude = _mean_latitude(data)
+  levels = []
+  for zoom in zooms[:-1]:
+    level_tolerance = pixels * pixel_size(zoom, latitude)
+    if level_tolerance <= tolerance:
+      break
+    levels.append((zoom, preprocess(data, tolerance=level_tolerance, precision=precision)))
+  levels.append((zooms[len(levels)], data))
+  return [(zoom, variant, layer_stats(variant)) for zoom, variant in levels]
+
+class LodGeoJson(JSCSSMixin, StyledGeoJson):
+  _template = Template(GEOJSON_LAYER + u"""
+    {% macro script(this, kwargs) %}
+    {{ geojson_layer(this) }}
+
+    // levels of detail: {zoom: min zoom, data: inline data or url: sidecar file}
+    var {{ this.get_name() }}_variants = {{ this.variants|tojson }};
+    (function(group, variants, map) {
+      var current = null, wanted = null;
+      function level(zoom) {
+        var index = 0;
+        for (var i = 0; i < variants.length; i++) {
+          if (zoom >= variants[i].zoom) { index = i; }
+        }
+        return index;
+      }
+      function decode(data) {
+        {%- if this.topojson %}
+        return topojson.feature(data, data.objects.layer);
+        {%- else %}
+        return data;
+        {%- endif %}
+      }
+      // Leaflet layers of a variant, built once with the group options (same style)
+      function load(variant) {
+        if (variant.layers) { return Promise.resolve(variant); }
+        if (!variant.loading) {
+          variant.loading = (variant.url ? fetch(variant.url).then(function(response) { return response.json(); }) : Promise.resolve(variant.data))
+            .then(function(data) {
+              variant.layers = L.geoJson(decode(data), group.options).getLayers();
+              variant.data = null;
+              return variant;
+            })
+            .catch(function(error) { variant.loading = null; throw error; });
+        }
+        return variant.loading;
+      }
+      function show(index) {
+        current = index;
+        group.clearLayers();
+        variants[index].layers.forEach(function(layer) { group.addLayer(layer); });
+      }
+      function update() {
+        wanted = level(map.getZoom());
+        if (wanted === current) { return; }
+        var index = wanted;
+        // the previous variant stays drawn while the new one loads
+        load(variants[index]).then(function() { if (wanted === index) { show(index); } });
+      }
+      group.on('add', function() { map.on('zoomend', update); update(); });
+      group.on('remove', function() { map.off('zoomend', update); });
+    })({{ this.get_name() }}, {{ this.get_name() }}_variants, {{ this._parent.get_name() }});
+    {%- if this.show or not this.data_dir %}
+    {{ this.get_name() }}.addTo({{ this._parent.get_name() }});
+    {%- endif %}
+    {% endmacro %}
+    """)
+
+  # data: the detailed FeatureCollection (tooltip fields, hover index), levels: variants() output
+  # data_dir: None (variants embedded in the page) or the directory the variants are written
+  # to (<slug of name>.z<zoom>.json), fetched when their zoom is reached ('lazy' vector mode,
+  # hidden on load unless show=True)
+  # topojson: variants sent as topologies (decoded by topojson-client)
+  def __init__(self, data, levels, name=None, data_dir=None, topojson=False, show=True, **kwargs):
+    super(LodGeoJson, self).__init__(data, name=name, show=show, **kwargs)
+    self._name = 'LodGeoJson'
+    self.data_dir = data_dir
+    self.topojson = topojson
+    self.default_js = [TopoGeoJson.default_js[0]] if topojson else []
+    self.variants = []
+    self.data_urls = []
+    for zoom, variant, _ in levels:
+      payload = topology(variant, 'layer') if topojson else variant
+      if data_dir is None:
+        self.variants.append({'zoom': zoom, 'data': payload})
+        continue
+      os.makedirs(data_dir, exist_ok=True)
+      filename = '{}.z{}{}'.format(slugify(name or self.get_name()), zoom, '.topojson' if topojson else '.json')
+      with open(os.path.join(data_dir, filename), 'w', encoding='utf-8') as f:
+        json.dump(payload, f, separators=(',', ':'))
+        trace.count('bytes_written', f.tell())
+      url = '/'.join([data_dir.replace(os.sep, '/'), filename])
+      self.data_urls.append(url)
+      self.variants.append({'zoom': zoom, 'url': url})
+
+# vertices per level of the layers variants: {layer: [(min zoom, vertices), ...]}
+def lod_report(levels):
+  lines = ['{:<48} {}'.format('layer', 'vertices per level (from zoom)')]
+  for layer, counts in levels.items():
+    lines.append('{:<48} {}'.format(layer, ', '.join('z{}: {}'.format(zoom, vertices) for zoom, vertices in counts)))
+  return '\n'.join(lines)
@@ -0,0 +1,640 @@
+# ########## Vector tiles (MVT) export
+# Tiling the vector layers into a z/x/y pyramid of Mapbox Vector Tiles written to disk
+# (pure python: own protobuf encoder, quadtree clipping and per zoom simplification),
+# then drawing them with Leaflet.VectorGrid instead of inlining the GeoJSON in the page.
+# Spec: https://github.com/mapbox/vector-tile-spec/tree/master/2.1
+import json
+import math
+import os
+import re
+import shutil
+import struct
+
+from branca.element import Element, Figure
+from folium.elements import JSCSSMixin
+from folium.map import Layer
+from jinja2 import Template
+
+from portmap.geometry import TopologySimplifier, geometry_parts
+
+EXTENT = 4096
+# clipping buffer around each tile (tile units) so strokes are not cut at tile edges
+BUFFER = 64
+# simplification tolerance (tile units, 4096 = 256 screen pixels)
+TOLERANCE = 4
+
+INF = float('inf')
+
+#################### PROTOBUF ENCODING ####################
+
+def _varint(value):
+  out = bytearray()
+  while True:
+    byte = value & 0x7f
+    value >>= 7
+    if value:
+      out.append(byte | 0x80)
+    else:
+      out.append(byte)
+      return bytes(out)
+
+def _zigzag(value):
+  return (value << 1) ^ (value >> 31)
+
+def _field(number, wire_type):
+  return _varint((number << 3) | wire_type)
+
+def _bytes_field(number, payload):
+  return _field(number, 2) + _varint(len(payload)) + payload
+
+def _varint_field(number, value):
+  return _field(number, 0) + _varint(value)
+
+def _packed_field(number, values):
+  return _bytes_field(number, b''.join(_varint(v) for v in values))
+
+# vector_tile.proto Value message
+def _encode_value(value):
+  if isinstance(value, bool):
+    return _varint_field(7, int(value))
+  if isinstance(value, int):
+    if value >= 0:
+      return _varint_field(5, value)
+    return _field(6, 0) + _varint((value << 1) ^ (value >> 63))
+  if isinstance(value, float):
+    return _field(3, 1) + struct.pack('<d', value)
+  if not isinstance(value, str):
+    value = json.dumps(value)
+  return _bytes_field(1, value.encode('utf-8'))
+
+#################### PROJECTION ####################
+
+# lon/lat to normalized web mercator coordinates ([0, 1] on both axis, y pointing south)
+def project(lon, lat):
+  x = lon / 360.0 + 0.5
+  sin = math.sin(math.radians(max(min(lat, 85.0511), -85.0511)))
+  y = 0.5 - 0.25 * math.log((1 + sin) / (1 - sin)) / math.pi
+  return (x, y)
+
+# tiles covering a [west, south, east, north] box at zoom z
+def tiles_for_bounds(bounds, z):
+  n = 2 ** z
+  x0, y0 = project(bounds[0], bounds[3])
+  x1, y1 = project(bounds[2], bounds[1])
+  for x in range(int(x0 * n), min(int(x1 * n), n - 1) + 1):
+    for y in range(int(y0 * n), min(int(y1 * n), n - 1) + 1):
+      yield x, y
+
+#################### CLIPPING ####################
+# features are kept as (id, type, parts) with type 1: points, 2: lines, 3: polygons,
+# parts as lists of rings/lines of (x, y, importance) vertices in normalized coordinates.
+
+def _intersect(a, b, k, axis):
+  t = (k - a[axis]) / (b[axis] - a[axis])
+  if axis == 0:
+    return (k, a[1] + (b[1] - a[1]) * t, INF)
+  return (a[0] + (b[0] - a[0]) * t, k, INF)
+
+# Sutherland-Hodgman clipping of a closed ring between k1 and k2 on one axis
+def _clip_ring(ring, k1, k2, axis):
+  out = []
+  for i in range(len(ring) - 1):
+    a, b = ring[i], ring[i + 1]
+    ak, bk = a[axis], b[axis]
+    if k1 <= ak <= k2:
+      out.append(a)
+    # range limits crossed by the segment, in travel order (a segment can cross both)
+    for k in ((k1, k2) if bk > ak else (k2, k1)):
+      if min(ak, bk) < k < max(ak, bk):
+        out.append(_intersect(a, b, k, axis))
+  if len(out) < 3:
+    return None
+  if out[0][:2] != out[-1][:2]:
+    out.append(out[0])
+  return out
+
+# clipping an open line between k1 and k2 on one axis, possibly splitting it in pieces
+def _clip_line(line, k1, k2, axis):
+  pieces, piece = [], []
+  for i in range(len(line) - 1):
+    a, b = line[i], line[i + 1]
+    ak, bk = a[axis], b[axis]
+    if k1 <= ak <= k2:
+      piece.append(a)
+    # range limits crossed by the segment, in travel order: entering or leaving the range
+    for k in ((k1, k2) if bk > ak else (k2, k1)):
+      if min(ak, bk) < k < max(ak, bk):
+        point = _intersect(a, b, k, axis)
+        if piece:
+          piece.append(point)
+          pieces.append(piece)
+          piece = []
+        else:
+          piece = [point]
+    if piece and not (k1 <= bk <= k2):
+      if len(piece) > 1:
+        pieces.append(piece)
+      piece = []
+  if k1 <= line[-1][axis] <= k2:
+    piece.append(line[-1])
+  if len(piece) > 1:
+    pieces.append(piece)
+  return pieces
+
+def _clip(features, k1, k2, axis):
+  clipped = []
+  for fid, kind, parts in features:
+    new_parts = []
+    for part in parts:
+      if kind == 1:
+        points = [p for p in part if k1 <= p[axis] <= k2]
+        if points:
+          new_parts.append(points)
+      elif kind == 2:
+        new_parts.extend([piece] for piece in _clip_line(part[0], k1, k2, axis))
+      else:
+        exterior = _clip_ring(part[0], k1, k2, axis)
+        if exterior is None:
+          continue
+        holes = [_clip_ring(ring, k1, k2, axis) for ring in part[1:]]
+        new_parts.append([exterior] + [h for h in holes if h])
+    if new_parts:
+      clipped.append((fid, kind, new_parts))
+  return clipped
+
+def _clip_to_tile(features, z, x, y, buffer):
+  n = 2 ** z
+  pad = buffer / EXTENT
+  features = _clip(features, (x - pad) / n, (x + 1 + pad) / n, 0)
+  return _clip(features, (y - pad) / n, (y + 1 + pad) / n, 1)
+
+#################### GEOMETRY ENCODING ####################
+
+def _ring_area(ring):
+  return sum(ring[i][0] * ring[i + 1][1] - ring[i + 1][0] * ring[i][1] for i in range(len(ring) - 1)) / 2.0
+
+# simplified integer tile coordinates of a line/ring
+def _to_tile(line, z, x, y, tolerance2, closed):
+  n = 2 ** z
+  out = []
+  for i, (px, py, importance) in enumerate(line):
+    if importance <= tolerance2 and 0 < i < len(line) - 1:
+      continue
+    point = (int(round((px * n - x) * EXTENT)), int(round((py * n - y) * EXTENT)))
+    if not out or out[-1] != point:
+      out.append(point)
+  if closed and (len(out) < 4 or _ring_area(out) == 0):
+    return None
+  return out
+
+#################### RINGS CLEANING ####################
+# Clipping joins the pieces of a ring cut several times by a tile limit with edges running back
+# and forth along that limit (also laid over the clipped holes and the other parts), and the
+# integer grid collapses close vertices into spikes and self-touching rings. The rings of a
+# feature are rebuilt before being encoded so the tiles only hold valid polygons: the edges
+# overlapping in opposite directions cancel out, the remaining ones are walked back into simple
+# rings (exteriors: positive area, holes: negative area) and each hole goes to the smallest
+# exterior holding it. Rings crossing themselves (simplification at low zooms) are dropped.
+# Rings are open lists of integer (x, y) tuples here.
+
+def _cross(o, a, b):
+  return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+def _area(points):
+  return sum(points[i - 1][0] * points[i][1] - points[i][0] * points[i - 1][1] for i in range(len(points))) / 2.0
+
+def _edges(points):
+  return [(points[i], points[(i + 1) % len(points)]) for i in range(len(points))]
+
+# inserting the vertices lying on an axis aligned edge (e.g. a tile limit) into that edge, so
+# overlapping edges share their vertices
+def _node(rings):
+  lines = {(axis, a[axis]) for ring in rings for a, b in _edges(ring) for axis in (0, 1) if a[axis] == b[axis] and a != b}
+  if not lines:
+    return rings
+  on_line = {}
+  for ring in rings:
+    for p in ring:
+      for axis in (0, 1):
+        if (axis, p[axis]) in lines:
+          on_line.setdefault((axis, p[axis]), set()).add(p[1 - axis])
+  noded = []
+  for ring in rings:
+    points = []
+    for a, b in _edges(ring):
+      points.append(a)
+      for axis in (0, 1):
+        if a[axis] == b[axis] and a != b:
+          low, high = sorted((a[1 - axis], b[1 - axis]))
+          between = sorted((c for c in on_line[(axis, a[axis])] if low < c < high), reverse=a[1 - axis] > b[1 - axis])
+          points.extend((a[0], c) if axis == 0 else (c, a[1]) for c in between)
+          break
+    noded.append(points)
+  return noded
+
+# closed walks through the edges left once the opposite ones cancelled out
+def _walk(rings):
+  count = {}
+  for ring in rings:
+    for a, b in _edges(ring):
+      if a == b:
+        continue
+      if count.get((b, a)):
+        count[(b, a)] -= 1
+      else:
+        count[(a, b)] = count.get((a, b), 0) + 1
+  outgoing = {}
+  for (a, b), n in count.items():
+    outgoing.setdefault(a, []).extend([b] * n)
+  walks = []
+  for start in list(outgoing):
+    while outgoing[start]:
+      walk, current = [start], outgoing[start].pop()
+      while current != start:
+        walk.append(current)
+        current = outgoing[current].pop()
+      walks.append(walk)
+  return walks
+
+# splitting a ring at its repeated vertices into loops of distinct vertices
+def _loops(points):
+  loops, stack, seen = [], [], {}
+  for p in points:
+    if p in seen:
+      start = seen[p]
+      loops.append(stack[start:])
+      for q in stack[start + 1:]:
+        del seen[q]
+      del stack[start + 1:]
+    else:
+      seen[p] = len(stack)
+      stack.append(p)
+  loops.append(stack)
+  return loops
+
+# dropping the vertices aligned with their neighbours (spikes included)
+def _drop_collinear(points):
+  changed = True
+  while changed and len(points) > 2:
+    changed = False
+    kept = []
+    for i, p in enumerate(points):
+      previous = kept[-1] if kept else points[i - 1]
+      if _cross(previous, p, points[(i + 1) % len(points)]) == 0:
+        changed = True
+        continue
+      kept.append(p)
+    points = kept
+  return points
+
+def _segments_cross(a, b, c, d):
+  d1, d2, d3, d4 = _cross(c, d, a), _cross(c, d, b), _cross(a, b, c), _cross(a, b, d)
+  return (d1 > 0) != (d2 > 0) and (d3 > 0) != (d4 > 0) and d1 != 0 and d2 != 0 and d3 != 0 and d4 != 0
+
+# edges of the rings crossing each other (binned on a grid, only the close ones are compared)
+def _crossing(rings, cell=64):
+  grid = {}
+  for r, ring in enumerate(rings):
+    n = len(ring)
+    for i, (a, b) in enumerate(_edges(ring)):
+      cells = [(cx, cy) for cx in range(min(a[0], b[0]) // cell, max(a[0], b[0]) // cell + 1)
+               for cy in range(min(a[1], b[1]) // cell, max(a[1], b[1]) // cell + 1)]
+      for key in cells:
+        for s, j in grid.get(key, ()):
+          if s == r and (abs(i - j) <= 1 or abs(i - j) == n - 1):
+            continue
+          if _segments_cross(a, b, rings[s][j], rings[s][(j + 1) % len(rings[s])]):
+            return True
+      for key in cells:
+        grid.setdefault(key, []).append((r, i))
+  return False
+
+def _inside(point, ring):
+  inside = False
+  for i in range(len(ring)):
+    a, b = ring[i - 1], ring[i]
+    if (a[1] > point[1]) != (b[1] > point[1]) and point[0] < a[0] + (point[1] - a[1]) * (b[0] - a[0]) / (b[1] - a[1]):
+      inside = not inside
+  return inside
+
+# a hole is held by an exterior when its vertices not shared with that exterior are inside it
+def _holds(exterior, hole):
+  vertices = set(exterior)
+  point = next((p for p in hole if p not in vertices), None)
+  return point is not None and _inside(point, exterior)
+
+# ##### valid polygons ([exterior, holes...], closed rings) of the rings of a feature:
+# exteriors with a positive area, holes with a negative one
+def _clean_polygons(rings):
+  exteriors, holes = [], []
+  for walk in _walk(_node(rings)):
+    for loop in _loops(walk):
+      ring = _drop_collinear(loop)
+      area = _area(ring) if len(ring) > 2 else 0
+      if area and not _crossing([ring]):
+        (exteriors if area > 0 else holes).append((abs(area), ring))
+  exteriors.sort()
+  polygons = [[ring] for _, ring in exteriors]
+  for _, hole in holes:
+    for polygon in polygons:
+      if _holds(polygon[0], hole):
+        if not _crossing([polygon[0], hole]):
+          polygon.append(hole)
+        break
+  return [[ring + [ring[0]] for ring in polygon] for polygon in polygons]
+
+def _encode_lines(lines, closed, cursor):
+  commands = []
+  for line in lines:
+    points = line[:-1] if closed else line
+    commands.append(1 | (1 << 3))
+    commands.extend((_zigzag(points[0][0] - cursor[0]), _zigzag(points[0][1] - cursor[1])))
+    cursor = points[0]
+    commands.append(2 | ((len(points) - 1) << 3))
+    for point in points[1:]:
+      commands.extend((_zigzag(point[0] - cursor[0]), _zigzag(point[1] - cursor[1])))
+      cursor = point
+    if closed:
+      commands.append(7 | (1 << 3))
+  return commands, cursor
+
+def _encode_geometry(kind, parts, z, x, y, tolerance2):
+  cursor = (0, 0)
+  if kind == 1:
+    points = [_to_tile(part, z, x, y, -1, False) for part in parts]
+    points = [p for point in points for p in point]
+    commands = [1 | (len(points) << 3)]
+    for point in points:
+      commands.extend((_zigzag(point[0] - cursor[0]), _zigzag(point[1] - cursor[1])))
+      cursor = point
+    return commands
+  if kind == 2:
+    lines = [_to_tile(part[0], z, x, y, tolerance2, False) for part in parts]
+    lines = [line for line in lines if len(line) > 1]
+    return _encode_lines(lines, False, cursor)[0]
+  rings = []
+  for part in parts:
+    for i, ring in enumerate(part):
+      ring = _to_tile(ring, z, x, y, tolerance2, True)
+      if ring is None:
+        if i == 0:
+          break
+        continue
+      # exterior rings: positive area (clockwise with y down), holes: negative area
+      if (_ring_area(ring) > 0) != (i == 0):
+        ring = ring[::-1]
+      rings.append(ring[:-1])
+  commands = []
+  for polygon in _clean_polygons(rings):
+    encoded, cursor = _encode_lines(polygon, True, cursor)
+    commands.extend(encoded)
+  return commands
+
+def encode_tile(layer_name, features, properties, z, x, y, tolerance=TOLERANCE):
+  tolerance2 = (tolerance / (EXTENT * 2 ** z)) ** 2
+  keys, values, encoded_features = {}, {}, []
+  for fid, kind, parts in features:
+    commands = _encode_geometry(kind, parts, z, x, y, tolerance2)
+    if not commands:
+      continue
+    tags = []
+    for key, value in properties[fid].items():
+      if value is None:
+        continue
+      value_key = (type(value).__name__, json.dumps(value, sort_keys=True))
+      tags.append(keys.setdefault(key, len(keys)))
+      tags.append(values.setdefault(value_key, (len(values), value))[0])
+    feature = _varint_field(1, fid) + _packed_field(2, tags) + _varint_field(3, kind) + _packed_field(4, commands)
+    encoded_features.append(_bytes_field(2, feature))
+  if not encoded_features:
+    return None
+  layer = _varint_field(15, 2) + _bytes_field(1, layer_name.encode('utf-8'))
+  layer += b''.join(encoded_features)
+  layer += b''.join(_bytes_field(3, key.encode('utf-8')) for key in keys)
+  layer += b''.join(_bytes_field(4, _encode_value(value)) for _, value in sorted(values.values(), key=lambda v: v[0]))
+  layer += _varint_field(5, EXTENT)
+  return _bytes_field(3, layer)
+
+#################### TILING ####################
+
+# projecting the features and computing the vertex importance used for simplification
+# (topology preserving, see portmap.geometry.TopologySimplifier)
+def prepare_features(data):
+  simplifier = TopologySimplifier(tolerance=1)
+  projected = []
+  for fid, feature in enumerate(data['features'], start=1):
+    geometry = feature['geometry']
+    if not geometry:
+      continue
+    geometries = geometry['geometries'] if geometry['type'] == 'GeometryCollection' else [geometry]
+    for geometry in geometries:
+      kind = geometry['type']
+      if kind in ('Point', 'MultiPoint'):
+        points = [geometry['coordinates']] if kind == 'Point' else geometry['coordinates']
+        projected.append((fid, 1, [[project(*p[:2]) for p in points]], False))
+        continue
+      closed = kind in ('Polygon', 'MultiPolygon')
+      parts = [[[project(*p[:2]) for p in line] for line in part] for part in geometry_parts(geometry)]
+      if not closed:
+        parts = [[line] for part in parts for line in part]
+      for part in parts:
+        for line in part:
+          simplifier.register(line, closed)
+      projected.append((fid, 3 if closed else 2, parts, closed))
+  features = []
+  for fid, kind, parts, closed in projected:
+    if kind == 1:
+      features.append((fid, kind, [[(x, y, INF) for x, y in parts[0]]]))
+      continue
+    new_parts = []
+    for part in parts:
+      rings = []
+      for line in part:
+        line, importance = simplifier.importance(line, closed)
+        rings.append([(p[0], p[1], v) for p, v in zip(line, importance)])
+      new_parts.append(rings)
+    features.append((fid, kind, new_parts))
+  return features
+
+def _features_bounds(features):
+  xs, ys = [], []
+  for _, _, parts in features:
+    for part in parts:
+      for line in part:
+        for p in line:
+          xs.append(p[0])
+          ys.append(p[1])
+  return min(xs), min(ys), max(xs), max(ys)
+
+# writing the z/x/y.pbf pyramid of a FeatureCollection:
+# properties: list of the per feature properties to encode (feature ids start at 1)
+# returns the tiling stats
+def write_tiles(data, directory, layer_name, min_zoom=8, max_zoom=14, properties=None, buffer=BUFFER, tolerance=TOLERANCE):
+  if properties is None:
+    properties = [f.get('properties') or {} for f in data['features']]
+  properties = dict(enumerate(properties, start=1))
+  features = prepare_features(data)
+  stats = {'tiles': 0, 'bytes': 0}
+  # the tiles of the previous build (an emptied layer must not keep them)
+  if os.path.isdir(directory):
+    shutil.rmtree(directory)
+  if not features:
+    return stats
+  west, north, east, south = _features_bounds(features)
+  # quadtree descent: each tile only clips what its parent kept
+  stack = [(0, 0, 0, features)]
+  while stack:
+    z, x, y, tile_features = stack.pop()
+    if z >= min_zoom:
+      tile = encode_tile(layer_name, tile_features, properties, z, x, y, tolerance)
+      if tile:
+        path = os.path.join(directory, str(z), str(x))
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, '%d.pbf' % y), 'wb') as f:
+          f.write(tile)
+        stats['tiles'] += 1
+        stats['bytes'] += len(tile)
+    if z == max_zoom:
+      continue
+    n = 2 ** (z + 1)
+    for cx in (2 * x, 2 * x + 1):
+      for cy in (2 * y, 2 * y + 1):
+        # skipping the children outside the layer bounds before clipping anything
+        if (cx + 1) / n < west or cx / n > east or (cy + 1) / n < north or cy / n > south:
+          continue
+        child = _clip_to_tile(tile_features, z + 1, cx, cy, buffer)
+        if child:
+          stack.append((z + 1, cx, cy, child))
+  return stats
+
+#################### MAP LAYER ####################
+
+def slugify(name):
+  return re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-')
+
+# folium tooltip arguments (GeoJsonTooltip or plain text) as plain data for the template
+def tooltip_options(tooltip):
+  if tooltip is None:
+    return None
+  if isinstance(tooltip, str):
+    return {'text': tooltip, 'fields': [], 'aliases': [], 'style': ''}
+  fields = list(tooltip.fields)
+  return {
+    'text': None,
+    'fields': fields,
+    'aliases': list(tooltip.aliases) if tooltip.aliases else fields,
+    'style': getattr(tooltip, 'style', None) or ''
+  }
+
+# Evaluating the layer's style/highlight functions once per feature at tiling time; the distinct
+# styles are written in the page and features only carry their style index ('_style', '_highlight').
+# '_fid' identifies the feature for the highlight (VectorGrid.setFeatureStyle).
+def _style_table(features, function):
+  table, index = [], []
+  for feature in features:
+    style = function(feature) if function else {}
+    style = dict(style)
+    if style.get('fillColor') == 'none':
+      style.pop('fillColor')
+      style['fill'] = False
+    key = json.dumps(style, sort_keys=True)
+    if key not in table:
+      table.append(key)
+    index.append(table.index(key))
+  return [json.loads(style) for style in table], index
+
+class VectorTileLayer(JSCSSMixin, Layer):
+  _template = Template(u"""
+    {% macro script(this, kwargs) %}
+    var {{ this.get_name() }}_styles = {{ this.styles|tojson }};
+    var {{ this.get_name() }}_highlights = {{ this.highlights|tojson }};
+    var {{ this.get_name() }} = L.vectorGrid.protobuf({{ this.url|tojson }}, {
+      rendererFactory: L.svg.tile,
+      interactive: true,
+      maxNativeZoom: {{ this.max_zoom }},
+      getFeatureId: function(feature) { return feature.properties._fid; },
+      vectorTileLayerStyles: {
+        {{ this.layer_name|tojson }}: function(properties) {
+          return {{ this.get_name() }}_styles[properties._style];
+        }
+      }
+    });
+    {%- if this.tooltip %}
+    var {{ this.get_name() }}_tooltip = L.tooltip({sticky: true, className: {{ (this.get_name() + '_tooltip')|tojson }}});
+    function {{ this.get_name() }}_tooltip_content(properties) {
+      function escape(value) {
+        return String(value).replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;');
+      }
+      {%- if this.tooltip.text %}
+      return escape({{ this.tooltip.text|tojson }});
+      {%- else %}
+      var fields = {{ this.tooltip.fields|tojson }};
+      var aliases = {{ this.tooltip.aliases|tojson }};
+      return '<table>' + fields.map(function(field, i) {
+        var value = properties[field];
+        return '<tr><th>' + escape(aliases[i]) + '</th><td>' + (value === undefined || value === null ? '' : escape(value)) + '</td></tr>';
+      }).join('') + '</table>';
+      {%- endif %}
+    }
+    {%- endif %}
+    {{ this.get_name() }}.on('mouseover', function(e) {
+      {%- if this.highlights %}
+      {{ this.get_name() }}.setFeatureStyle(e.layer.properties._fid, {{ this.get_name() }}_highlights[e.layer.properties._highlight]);
+      {%- endif %}
+      {%- if this.tooltip %}
+      {{ this.get_name() }}_tooltip.setContent({{ this.get_name() }}_tooltip_content(e.layer.properties));
+      {{ this._parent.get_name() }}.openTooltip({{ this.get_name() }}_tooltip, e.latlng);
+      {%- endif %}
+    });
+    {{ this.get_name() }}.on('mouseout', function(e) {
+      {%- if this.highlights %}
+      {{ this.get_name() }}.resetFeatureStyle(e.layer.properties._fid);
+      {%- endif %}
+      {%- if this.tooltip %}
+      {{ this._parent.get_name() }}.closeTooltip({{ this.get_name() }}_tooltip);
+      {%- endif %}
+    });
+    {%- if this.tooltip %}
+    {{ this._parent.get_name() }}.on('mousemove', function(e) {
+      {{ this.get_name() }}_tooltip.setLatLng(e.latlng);
+    });
+    {%- endif %}
+    {{ this.get_name() }}.addTo({{ this._parent.get_name() }});
+    {% endmacro %}
+    """)
+
+  default_js = [
+    ('leaflet_vectorgrid', 'https://unpkg.com/leaflet.vectorgrid@1.3.0/dist/Leaflet.VectorGrid.bundled.min.js')
+  ]
+
+  # data: FeatureCollection dict, tiles are written in <tiles_root>/<slug of name>/{z}/{x}/{y}.pbf
+  # and fetched from the same relative url (the map has to be served over http)
+  def __init__(self, data, name=None, style_function=None, highlight_function=None, tooltip=None,
+               tiles_root='tiles/vector', min_zoom=8, max_zoom=14, overlay=True, control=True, show=True):
+    super(VectorTileLayer, self).__init__(name=name, overlay=overlay, control=control, show=show)
+    self._name = 'VectorTileLayer'
+    self.layer_name = slugify(name or self.get_name())
+    self.max_zoom = max_zoom
+    self.tooltip = tooltip_options(tooltip)
+    features = data['features']
+    self.styles, style_index = _style_table(features, style_function)
+    self.highlights, highlight_index = _style_table(features, highlight_function) if highlight_function else ([], None)
+    fields = set(self.tooltip['fields']) if self.tooltip else set()
+    properties = []
+    for i, feature in enumerate(features):
+      props = {k: v for k, v in (feature.get('properties') or {}).items() if k in fields}
+      props.update({'_fid': i + 1, '_style': style_index[i]})
+      if highlight_index:
+        props['_highlight'] = highlight_index[i]
+      properties.append(props)
+    directory = os.path.join(tiles_root, self.layer_name)
+    self.stats = write_tiles(data, directory, self.layer_name, min_zoom, max_zoom, properties)
+    self.url = '/'.join([tiles_root.replace(os.sep, '/'), self.layer_name, '{z}/{x}/{y}.pbf'])
+
+  def render(self, **kwargs):
+    super(VectorTileLayer, self).render(**kwargs)
+    if self.tooltip and self.tooltip['style']:
+      figure = self.get_root()
+      assert isinstance(figure, Figure), 'You cannot render this Element if it is not in a Figure.'
+      figure.header.add_child(Element('<style>.{}_tooltip {{ {} }}</style>'.format(
+        self.get_name(), self.tooltip['style'])), name=self.get_name() + '_tooltip_style')
@@ -0,0 +1,281 @@
+# ########## Overlay analysis
+# Intersections between the project layers (port infrastructure, construction/logistic zones,
+# roads) and the natural layers (forests, farmlands, waterways): affected hectares and lengths
+# per pair of features, e.g. hectares of each forest section/ilot under a construction zone or
+# the length of a waterway inside a zone and its crossings with the roads.
+# The geometries are projected to UTM (transverse Mercator formulas, WGS84) so areas/lengths
+# are in meters. The target features are loaded into a STR-tree spatial index queried once
+# with all the source features (bulk query on the bounding boxes then the exact intersects
+# predicate), so only the candidate pairs are intersected instead of every pair of features.
+# Results: CSV (one row per intersecting pair) and GeoJSON (intersections geometries, lon/lat).
+# Needs shapely >= 2.0: pip install shapely
+# The build reads the layers from the map's vector layers files (see from_vector_layers), so a
+# site of a batch build intersects its own layers, or the shared ones filtered to its extent.
+# Command line: python -m portmap.overlay (layers of OVERLAY_SOURCES/OVERLAY_TARGETS below)
+import csv
+import json
+import math
+import os
+from dataclasses import replace
+
+import numpy as np
+
+try:
+  import shapely
+  from shapely.geometry import mapping, shape
+  from shapely.strtree import STRtree
+except ImportError:
+  shapely = None
+
+from portmap.geometry import geometry_bounds
+from portmap.incremental import digest, file_digest
+from portmap.preprocess import load_geojson
+from portmap.registry import OverlayLayer
+
+OUTPUT_DIR = 'analysis'
+
+# project layers (sources) and the natural layers they affect (targets)
+OVERLAY_SOURCES = [
+  OverlayLayer('Port Main Infrastructure', 'layers/port_main_infrastructure.geojson', ['name']),
+  OverlayLayer('Construction Zones', 'layers/construction_zones.geojson', ['name']),
+  OverlayLayer('Logistic industrial zones', 'layers/logistic_zones.geojson', ['name']),
+  # roads right of way: 15m each side of the axis
+  OverlayLayer('Roads', 'layers/roads.geojson', ['Name', 'Type'], buffer=15)
+]
+OVERLAY_TARGETS = [
+  OverlayLayer('Forests - Affected Zones', 'layers/forests_affected_zones.geojson', ['name', 'section', 'ilot']),
+  OverlayLayer('Forests - Preserved Natural Zones', 'layers/forest_preserved_natural_area.geojson', ['name']),
+  OverlayLayer('Agricultural and Farm lands', 'layers/agro_farm_land.geojson', ['designation', 'status']),
+  OverlayLayer('Waterways', 'layers/waterways.geojson', ['name', 'type'])
+]
+
+# overlay layers read from the files of the vector layers with the same file names (path and
+# bbox), e.g. a site's own layer files or the shared ones filtered to its extent (portmap.sites)
+def from_vector_layers(layers, vector_layers):
+  files = {os.path.basename(layer.path): layer for layer in vector_layers}
+  configured = []
+  for layer in layers:
+    vector_layer = files.get(os.path.basename(layer.path))
+    if vector_layer is not None:
+      layer = replace(layer, path=vector_layer.path, bbox=vector_layer.bbox)
+    configured.append(layer)
+  return configured
+
+FIELDS = ['source_layer', 'source', 'target_layer', 'target', 'area_ha', 'target_share', 'length_m', 'crossings']
+
+def _require():
+  if shapely is None:
+    raise ImportError('the overlay analysis needs shapely: pip install shapely')
+
+#################### PROJECTION ####################
+
+# WGS84 ellipsoid, UTM scale factor
+_A = 6378137.0
+_F = 1 / 298.257223563
+_E2 = _F * (2 - _F)
+_EP2 = _E2 / (1 - _E2)
+_K0 = 0.9996
+
+def utm_zone(lon, lat):
+  return int((lon + 180) // 6) + 1, lat >= 0
+
+def _meridian_arc(phi):
+  e4, e6 = _E2 * _E2, _E2 * _E2 * _E2
+  return _A * ((1 - _E2 / 4 - 3 * e4 / 64 - 5 * e6 / 256) * phi
+               - (3 * _E2 / 8 + 3 * e4 / 32 + 45 * e6 / 1024) * np.sin(2 * phi)
+               + (15 * e4 / 256 + 45 * e6 / 1024) * np.sin(4 * phi)
+               - (35 * e6 / 3072) * np.sin(6 * phi))
+
+# (N, 2) lon/lat array -> UTM easting/northing (meters) of a zone
+def to_utm(coordinates, zone):
+  number, north = zone
+  lon0 = math.radians((number - 1) * 6 - 180 + 3)
+  phi, lam = np.radians(coordinates[:, 1]), np.radians(coordinates[:, 0])
+  n = _A / np.sqrt(1 - _E2 * np.sin(phi) ** 2)
+  t = np.tan(phi) ** 2
+  c = _EP2 * np.cos(phi) ** 2
+  a = (lam - lon0) * np.cos(phi)
+  x = _K0 * n * (a + (1 - t + c) * a ** 3 / 6 + (5 - 18 * t + t * t + 72 * c - 58 * _EP2) * a ** 5 / 120) + 500000
+  y = _K0 * (_meridian_arc(phi) + n * np.tan(phi) * (a * a / 2 + (5 - t + 9 * c + 4 * c * c) * a ** 4 / 24
+                                                     + (61 - 58 * t + t * t + 600 * c - 330 * _EP2) * a ** 6 / 720))
+  return np.column_stack([x, y if north else y + 10000000])
+
+# UTM easting/northing of a zone -> (N, 2) lon/lat array
+def from_utm(coordinates, zone):
+  number, north = zone
+  lon0 = math.radians((number - 1) * 6 - 180 + 3)
+  x = coordinates[:, 0] - 500000
+  y = coordinates[:, 1] if north else coordinates[:, 1] - 10000000
+  e4, e6 = _E2 * _E2, _E2 * _E2 * _E2
+  mu = y / _K0 / (_A * (1 - _E2 / 4 - 3 * e4 / 64 - 5 * e6 / 256))
+  e1 = (1 - math.sqrt(1 - _E2)) / (1 + math.sqrt(1 - _E2))
+  phi1 = (mu + (3 * e1 / 2 - 27 * e1 ** 3 / 32) * np.sin(2 * mu) + (21 * e1 ** 2 / 16 - 55 * e1 ** 4 / 32) * np.sin(4 * mu)
+          + (151 * e1 ** 3 / 96) * np.sin(6 * mu) + (1097 * e1 ** 4 / 512) * np.sin(8 * mu))
+  c1 = _EP2 * np.cos(phi1) ** 2
+  t1 = np.tan(phi1) ** 2
+  n1 = _A / np.sqrt(1 - _E2 * np.sin(phi1) ** 2)
+  r1 = _A * (1 - _E2) / (1 - _E2 * np.sin(phi1) ** 2) ** 1.5
+  d = x / (n1 * _K0)
+  phi = phi1 - (n1 * np.tan(phi1) / r1) * (d * d / 2 - (5 + 3 * t1 + 10 * c1 - 4 * c1 * c1 - 9 * _EP2) * d ** 4 / 24
+                                           + (61 + 90 * t1 + 298 * c1 + 45 * t1 * t1 - 252 * _EP2 - 3 * c1 * c1) * d ** 6 / 720)
+  lam = lon0 + (d - (1 + 2 * t1 + c1) * d ** 3 / 6
+                + (5 - 2 * c1 + 28 * t1 - 3 * c1 * c1 + 8 * _EP2 + 24 * t1 * t1) * d ** 5 / 120) / np.cos(phi1)
+  return np.column_stack([np.degrees(lam), np.degrees(phi)])
+
+#################### LOADING ####################
+
+def _label(properties, keys):
+  values = [str(properties[key]) for key in keys if properties.get(key) not in (None, '')]
+  return ' / '.join(values)
+
+# features of a layer with a geometry (intersecting its bbox)
+def layer_features(layer):
+  features = [f for f in load_geojson(layer.path)['features'] if f.get('geometry')]
+  if layer.bbox is None:
+    return features
+  west, south, east, north = layer.bbox
+  kept = []
+  for f in features:
+    bounds = geometry_bounds(f['geometry'])
+    if bounds[0] <= east and bounds[2] >= west and bounds[1] <= north and bounds[3] >= south:
+      kept.append(f)
+  return kept
+
+# projected shapely geometries of a layer features (as drawn and buffered) + their labels and properties
+def load_layer(layer, zone):
+  features = layer_features(layer)
+  axes = shapely.transform(np.array([shape(f['geometry']) for f in features], dtype=object),
+                           lambda coordinates: to_utm(coordinates, zone))
+  axes = shapely.make_valid(axes)
+  geometries = shapely.buffer(axes, layer.buffer) if layer.buffer else axes
+  labels = [_label(f.get('properties') or {}, layer.keys) for f in features]
+  properties = [{key: (f.get('properties') or {}).get(key) for key in layer.keys} for f in features]
+  return axes, geometries, labels, properties
+
+# UTM zone of the layers center (None: no feature)
+def layers_zone(layers):
+  bounds = [geometry_bounds(f['geometry']) for layer in layers for f in layer_features(layer)]
+  if not bounds:
+    return None
+  west, south = min(b[0] for b in bounds), min(b[1] for b in bounds)
+  east, north = max(b[2] for b in bounds), max(b[3] for b in bounds)
+  return utm_zone((west + east) / 2, (south + north) / 2)
+
+#################### ANALYSIS ####################
+
+def _polygonal(geometries):
+  return np.isin(shapely.get_type_id(geometries), (3, 6))
+
+def _measures(geometries):
+  parts = shapely.get_parts(geometries, return_index=True)
+  kinds = shapely.get_type_id(parts[0])
+  area = np.bincount(parts[1], weights=np.where(np.isin(kinds, (3, 6)), shapely.area(parts[0]), 0), minlength=len(geometries))
+  length = np.bincount(parts[1], weights=np.where(np.isin(kinds, (1, 2, 5)), shapely.length(parts[0]), 0), minlength=len(geometries))
+  points = np.bincount(parts[1], weights=np.isin(kinds, (0, 4)).astype(float), minlength=len(geometries))
+  return area, length, points
+
+# ##### intersections of every source feature with every target feature it intersects:
+# (rows for the CSV, GeoJSON FeatureCollection of the intersections in lon/lat)
+def overlay(sources, targets, zone=None):
+  _require()
+  zone = zone or layers_zone(sources + targets)
+  rows, features = [], []
+  if zone is None:
+    return rows, {'type': 'FeatureCollection', 'features': features}
+  # one spatial index per target layer
+  loaded = []
+  for target in targets:
+    _, geometries, labels, properties = load_layer(target, zone)
+    if len(geometries):
+      loaded.append((target, STRtree(geometries), geometries, labels, properties))
+  for source in sources:
+    source_axes, source_geometries, source_labels, _ = load_layer(source, zone)
+    if not len(source_geometries):
+      continue
+    for target, tree, target_geometries, target_labels, target_properties in loaded:
+      # bulk query: candidate pairs from the bounding boxes, filtered by the exact predicate
+      source_index, target_index = tree.query(source_geometries, predicate='intersects')
+      if not len(source_index):
+        continue
+      intersections = shapely.intersection(source_geometries[source_index], target_geometries[target_index])
+      area, _, _ = _measures(intersections)
+      # lengths inside the target and crossings with the target lines measured on the source
+      # features as drawn (e.g. the roads axes, not their right of way)
+      if source.buffer:
+        _, length, points = _measures(shapely.intersection(source_axes[source_index], target_geometries[target_index]))
+      else:
+        _, length, points = _measures(intersections)
+      # (a border shared by two polygons is neither a length nor a crossing)
+      linear = ~(_polygonal(source_axes[source_index]) & _polygonal(target_geometries[target_index]))
+      length, points = length * linear, points * linear
+      target_area = shapely.area(target_geometries[target_index])
+      for k, (i, j) in enumerate(zip(source_index, target_index)):
+        if not area[k] and not length[k] and not points[k]:
+          continue
+        row = {
+          'source_layer': source.name,
+          'source': source_labels[i],
+          'target_layer': target.name,
+          'target': target_labels[j],
+          'area_ha': round(area[k] / 10000, 4),
+          'target_share': round(100 * area[k] / target_area[k], 2) if target_area[k] else None,
+          'length_m': round(length[k], 1),
+          'crossings': int(points[k])
+        }
+        rows.append(row)
+        geometry = shapely.transform(intersections[k], lambda coordinates: from_utm(coordinates, zone))
+        features.append({'type': 'Feature', 'geometry': mapping(geometry),
+                         'properties': dict(row, **{'target_' + key: value for key, value in target_properties[j].items()})})
+  return rows, {'type': 'FeatureCollection', 'features': features}
+
+# affected hectares/meters per pair of layers
+def summary(rows):
+  totals = {}
+  for row in rows:
+    total = totals.setdefault((row['source_layer'], row['target_layer']), {'area_ha': 0, 'length_m': 0, 'crossings': 0, 'pairs': 0})
+    total['area_ha'] += row['area_ha']
+    total['length_m'] += row['length_m']
+    total['crossings'] += row['crossings']
+    total['pairs'] += 1
+  lines = ['{:<28} {:<36} {:>6} {:>10} {:>10} {:>9}'.format('source', 'target', 'pairs', 'hectares', 'meters', 'crossings')]
+  for (source, target), total in totals.items():
+    lines.append('{:<28} {:<36} {:>6} {:>10.2f} {:>10.1f} {:>9}'.format(
+      source, target, total['pairs'], total['area_ha'], total['length_m'], total['crossings']))
+  return '\n'.join(lines)
+
+#################### EXPORT ####################
+
+def write_csv(rows, path):
+  with open(path, 'w', newline='', encoding='utf-8') as f:
+    writer = csv.DictWriter(f, fieldnames=FIELDS)
+    writer.writeheader()
+    writer.writerows(rows)
+
+def write_geojson(data, path):
+  with open(path, 'w', encoding='utf-8') as f:
+    json.dump(data, f)
+
+def output_paths(output_dir=OUTPUT_DIR):
+  return os.path.join(output_dir, 'overlay.csv'), os.path.join(output_dir, 'overlay.geojson')
+
+# ##### analysis written to <output_dir>/overlay.csv and overlay.geojson, skipped while the
+# layers files and settings don't change (cache: portmap.incremental.BuildCache)
+def run(sources=OVERLAY_SOURCES, targets=OVERLAY_TARGETS, output_dir=OUTPUT_DIR, cache=None, report=True):
+  csv_path, geojson_path = output_paths(output_dir)
+  key = (cache.key if cache is not None else digest)('overlay', [[layer.name, layer.path, layer.keys, layer.buffer, layer.bbox, file_digest(layer.path)]
+                           for layer in sources + targets], output_dir)
+  entry = cache.read(key) if cache is not None and cache.enabled else None
+  if entry is None:
+    rows, data = overlay(sources, targets)
+    os.makedirs(output_dir, exist_ok=True)
+    write_csv(rows, csv_path)
+    write_geojson(data, geojson_path)
+    entry = {'rows': rows, 'outputs': [csv_path, geojson_path]}
+    if cache is not None and cache.enabled:
+      cache.write(key, entry)
+  if report:
+    print(summary(entry['rows']))
+  return geojson_path
+
+if __name__ == '__main__':
+  run()
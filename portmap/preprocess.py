@@ -0,0 +1,144 @@
+# ########## Vector layers preprocessing
+# Shrinking the layers/*.geojson payload before it gets embedded in webmap.html:
+# - topology preserving simplification (per layer tolerance, in degrees)
+# - coordinates precision truncation (5 decimals ~ 1m)
+# - dropping the properties not used by the layer's tooltip/style functions
+import json
+
+from portmap.geometry import TopologySimplifier, count_vertices, geometry_parts, quantize_line
+
+# default coordinates precision: 5 decimals ~ 1.1m at the equator
+PRECISION = 5
+
+def load_geojson(path):
+  with open(path, encoding='utf-8') as f:
+    return json.load(f)
+
+# serialized size of a layer as embedded in the html page: compact FeatureCollection of its
+# features (also summed feature by feature by the streamed ingestion, see portmap.stream)
+def payload_size(data):
+  return collection_size(sum(feature_size(f) for f in data['features']), len(data['features']))
+
+def feature_size(feature):
+  return len(json.dumps(feature).encode('utf-8'))
+
+# {"type": "FeatureCollection", "features": [...]} size from its features total size and count
+def collection_size(features_bytes, count):
+  return len('{"type": "FeatureCollection", "features": []}') + features_bytes + 2 * max(count - 1, 0)
+
+def _rebuild(geometry, parts):
+  kind = geometry['type']
+  if kind == 'LineString':
+    return {'type': kind, 'coordinates': parts[0][0]}
+  if kind == 'MultiPolygon':
+    return {'type': kind, 'coordinates': parts}
+  return {'type': kind, 'coordinates': parts[0]}
+
+def _is_closed(geometry):
+  return geometry['type'] in ('Polygon', 'MultiPolygon')
+
+# simplifying + quantizing one geometry (points and collections are only quantized)
+def _process_geometry(geometry, simplifier, precision):
+  if not geometry:
+    return geometry
+  kind = geometry['type']
+  if kind == 'GeometryCollection':
+    return {'type': kind, 'geometries': [_process_geometry(g, simplifier, precision) for g in geometry['geometries']]}
+  if kind in ('Point', 'MultiPoint'):
+    if precision is None:
+      return geometry
+    coordinates = geometry['coordinates']
+    if kind == 'Point':
+      return {'type': kind, 'coordinates': [round(c, precision) for c in coordinates[:2]]}
+    return {'type': kind, 'coordinates': [[round(c, precision) for c in p[:2]] for p in coordinates]}
+  closed = _is_closed(geometry)
+  parts = []
+  for part in geometry_parts(geometry):
+    lines = []
+    for line in part:
+      line = simplifier.simplify(line, closed)
+      if precision is not None:
+        line = quantize_line(line, precision, closed)
+      lines.append(line)
+    parts.append(lines)
+  return _rebuild(geometry, parts)
+
+def _walk_lines(geometry):
+  if not geometry:
+    return
+  if geometry['type'] == 'GeometryCollection':
+    for g in geometry['geometries']:
+      yield from _walk_lines(g)
+    return
+  closed = _is_closed(geometry)
+  for part in geometry_parts(geometry):
+    for line in part:
+      yield line, closed
+
+# keeping only the listed properties (None: keeping all of them)
+def project_properties(properties, keep):
+  if keep is None or properties is None:
+    return properties
+  return {k: v for k, v in properties.items() if k in keep}
+
+# one feature with its properties projected and its geometry simplified/quantized
+def preprocess_feature(feature, simplifier, precision=PRECISION, keep=None):
+  new_feature = {
+    'type': 'Feature',
+    'properties': project_properties(feature.get('properties'), keep),
+    'geometry': _process_geometry(feature['geometry'], simplifier, precision)
+  }
+  if 'id' in feature:
+    new_feature['id'] = feature['id']
+  return new_feature
+
+# registering the lines of a feature into a simplifier (first pass)
+def register_feature(feature, simplifier):
+  for line, closed in _walk_lines(feature['geometry']):
+    simplifier.register(line, closed)
+
+# ##### main preprocessing function
+# data: FeatureCollection dict, returns a new FeatureCollection dict
+def preprocess(data, tolerance=0, precision=PRECISION, keep=None):
+  features = data['features']
+  simplifier = TopologySimplifier(tolerance)
+  if tolerance > 0:
+    for feature in features:
+      register_feature(feature, simplifier)
+  processed = [preprocess_feature(feature, simplifier, precision, keep) for feature in features]
+  return {'type': 'FeatureCollection', 'features': processed}
+
+def layer_stats(data):
+  return {
+    'bytes': payload_size(data),
+    'vertices': sum(count_vertices(f['geometry']) for f in data['features'])
+  }
+
+# ##### preprocessing a layer file, returning the processed data and the before/after stats
+def preprocess_layer(path, tolerance=0, precision=PRECISION, keep=None):
+  raw = load_geojson(path)
+  data = preprocess(raw, tolerance=tolerance, precision=precision, keep=keep)
+  stats = {'layer': path, 'before': layer_stats(raw), 'after': layer_stats(data)}
+  return data, stats
+
+def _percent(before, after):
+  return 100.0 * (before - after) / before if before else 0.0
+
+# payload budget report: before/after embedded bytes and vertex count per layer
+def payload_report(stats):
+  lines = ['{:<48} {:>10} {:>10} {:>7} {:>9} {:>9} {:>7}'.format(
+    'layer', 'KB before', 'KB after', 'saved', 'vtx before', 'vtx after', 'saved')]
+  total = {'before': {'bytes': 0, 'vertices': 0}, 'after': {'bytes': 0, 'vertices': 0}}
+  rows = stats + [dict(total, layer='TOTAL')]
+  for row in stats:
+    for stage in ('before', 'after'):
+      for key in ('bytes', 'vertices'):
+        total[stage][key] += row[stage][key]
+  for row in rows:
+    before, after = row['before'], row['after']
+    lines.append('{:<48} {:>10.1f} {:>10.1f} {:>6.1f}% {:>9} {:>9} {:>6.1f}%'.format(
+      row['layer'],
+      before['bytes'] / 1024, after['bytes'] / 1024, _percent(before['bytes'], after['bytes']),
+      before['vertices'], after['vertices'], _percent(before['vertices'], after['vertices'])
+    ))
+  return '\n'.join(lines)
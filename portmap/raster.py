@@ -0,0 +1,362 @@
+# ########## Local raster engine
+# Offline equivalent of the Earth Engine analysis (webmap.py IMAGERY ANALYSIS) computed with
+# NumPy from Sentinel-2 band files and a SRTM DEM on disk: normalized differences (NDVI/NDWI),
+# slopes from the DEM gradients and the circular AOI mask of ee.Geometry.Point(...).buffer(...).
+# Rasters are read by strips of rows restricted to the AOI window (float32), so a full
+# 10980x10980 Sentinel-2 tile is never loaded in memory. Products are written as Cloud
+# Optimized GeoTIFFs (rasters/local/<product>.tif) and rendered into XYZ png tiles for the map.
+# Needs rasterio (GDAL): pip install rasterio
+import io
+import json
+import math
+import os
+import threading
+
+import numpy as np
+from PIL import Image
+
+try:
+  import rasterio
+  from affine import Affine
+  from rasterio.enums import Resampling
+  from rasterio.shutil import copy as copy_raster
+  from rasterio.vrt import WarpedVRT
+  from rasterio.warp import reproject, transform as warp_transform
+  from rasterio.windows import Window, from_bounds
+except ImportError:
+  rasterio = None
+
+from portmap.classify import NDVI_CLASSES
+from portmap.ee_tiles import DirectoryStore, local_url, tile_coordinates
+
+OUTPUT_DIR = os.path.join('rasters', 'local')
+# rows read/computed at once
+BLOCK_ROWS = 512
+# Sentinel-2 L2A reflectance scale (image.divide(10000) in the ee analysis)
+S2_SCALE = 10000.0
+TILE_SIZE = 256
+
+def _require():
+  if rasterio is None:
+    raise ImportError('the local raster engine needs rasterio: pip install rasterio')
+
+#################### COMPUTATIONS ####################
+
+# (a - b) / (a + b), NaN where a + b = 0 (ee.Image.normalizedDifference)
+def normalized_difference(a, b):
+  a = a.astype(np.float32, copy=False)
+  b = b.astype(np.float32, copy=False)
+  total = a + b
+  with np.errstate(divide='ignore', invalid='ignore'):
+    nd = (a - b) / total
+  nd[total == 0] = np.nan
+  return nd
+
+# slope in degrees (ee.Terrain.slope), dx/dy: pixel size in meters (dx may vary per row)
+def slope(dem, dx, dy):
+  dz_dy, dz_dx = np.gradient(dem.astype(np.float32, copy=False))
+  dz_dx /= np.asarray(dx, dtype=np.float32).reshape(-1, 1)
+  dz_dy /= np.float32(dy)
+  return np.degrees(np.arctan(np.hypot(dz_dx, dz_dy))).astype(np.float32)
+
+def mask_below(values, threshold):
+  values = values.copy()
+  values[~(values >= threshold)] = np.nan
+  return values
+
+#################### GRID ####################
+
+# AOI grid of a dataset: its pixels covering the AOI square around center (lon, lat)
+class Grid:
+
+  def __init__(self, crs, transform, width, height):
+    self.crs = crs
+    self.transform = transform
+    self.width = width
+    self.height = height
+
+  # pixel centers coordinates of rows [start, stop)
+  def coordinates(self, start, stop):
+    cols, rows = np.meshgrid(np.arange(self.width) + 0.5, np.arange(start, stop) + 0.5)
+    xs, ys = self.transform * (cols, rows)
+    return xs, ys
+
+  # sub grid of the pixels window [col, col + width) x [row, row + height)
+  def window(self, col, row, width, height):
+    return Grid(self.crs, self.transform * Affine.translation(col, row), width, height)
+
+  def row_bounds(self, start, stop):
+    west, north = self.transform * (0, start)
+    east, south = self.transform * (self.width, stop)
+    return min(west, east), min(south, north), max(west, east), max(south, north)
+
+def _project(lon, lat, crs):
+  xs, ys = warp_transform('EPSG:4326', crs, [lon], [lat])
+  return xs[0], ys[0]
+
+def aoi_grid(dataset, center, radius):
+  x, y = _project(center[0], center[1], dataset.crs)
+  if dataset.crs.is_geographic:
+    dx, dy = radius / (111320.0 * math.cos(math.radians(center[1]))), radius / 111320.0
+  else:
+    dx = dy = radius
+  window = from_bounds(x - dx, y - dy, x + dx, y + dy, dataset.transform)
+  window = window.round_offsets().round_lengths()
+  window = window.intersection(Window(0, 0, dataset.width, dataset.height))
+  return Grid(dataset.crs, dataset.window_transform(window), int(window.width), int(window.height))
+
+# pixels of rows [start, stop) inside the circular AOI (geodesic radius approximated on the
+# local tangent plane: within a few meters of the ee buffer at this scale)
+def circle_mask(grid, start, stop, center, radius):
+  xs, ys = grid.coordinates(start, stop)
+  if grid.crs.is_geographic:
+    dx = (xs - center[0]) * 111320.0 * math.cos(math.radians(center[1]))
+    dy = (ys - center[1]) * 111320.0
+  else:
+    cx, cy = _project(center[0], center[1], grid.crs)
+    dx, dy = xs - cx, ys - cy
+  return dx * dx + dy * dy <= radius * radius
+
+# pixel size in meters of rows [start, stop): (dx per row, dy)
+def pixel_size(grid, start, stop):
+  a, e = grid.transform.a, abs(grid.transform.e)
+  if not grid.crs.is_geographic:
+    return np.full(stop - start, a, dtype=np.float32), e
+  _, ys = grid.transform * (np.zeros(stop - start), np.arange(start, stop) + 0.5)
+  return (a * 111320.0 * np.cos(np.radians(ys))).astype(np.float32), e * 111320.0
+
+#################### READING ####################
+
+# band of a source resampled on the grid rows [start, stop) as float32 (nodata -> NaN)
+def read_rows(source, grid, start, stop, band=1):
+  west, south, east, north = grid.row_bounds(start, stop)
+  window = from_bounds(west, south, east, north, source.transform)
+  values = source.read(band, window=window, out_shape=(stop - start, grid.width), boundless=True,
+                       resampling=Resampling.bilinear, masked=True)
+  return values.astype(np.float32).filled(np.nan)
+
+def _open(path, crs):
+  dataset = rasterio.open(path)
+  if dataset.crs == crs:
+    return dataset
+  # different projection (e.g. a DEM in EPSG:4326 read on a UTM grid): warped on the fly
+  return WarpedVRT(dataset, crs=crs, resampling=Resampling.bilinear)
+
+#################### PRODUCTS ####################
+
+# product: (input bands, reference band for the grid, rows halo, function(arrays, grid, start, stop))
+def _true_colors(arrays, grid, start, stop):
+  return np.stack(arrays) / np.float32(S2_SCALE)
+
+def _slopes(arrays, grid, start, stop):
+  dx, dy = pixel_size(grid, start, stop)
+  return slope(arrays[0], dx, dy)
+
+PRODUCTS = {
+  'true_colors': (['B4', 'B3', 'B2'], 'B4', 0, _true_colors),
+  'elevation': (['dem'], 'dem', 0, lambda arrays, *grid: arrays[0]),
+  'slopes': (['dem'], 'dem', 1, _slopes),
+  'ndvi': (['B8', 'B4'], 'B4', 0, lambda arrays, *grid: normalized_difference(*arrays)),
+  # NDVI >= 0 (ndvi_masked), NDWI >= 0.1 (ndwi_masked)
+  'ndvi_masked': (['B8', 'B4'], 'B4', 0, lambda arrays, *grid: mask_below(normalized_difference(*arrays), 0)),
+  'ndwi': (['B3', 'B11'], 'B3', 0, lambda arrays, *grid: normalized_difference(*arrays)),
+  'ndwi_masked': (['B3', 'B11'], 'B3', 0, lambda arrays, *grid: mask_below(normalized_difference(*arrays), 0.1)),
+  # NDVI classes (portmap.classify.NDVI_CLASSES)
+  'ndvi_classified': (['B8', 'B4'], 'B4', 0, lambda arrays, *grid: NDVI_CLASSES.classify(normalized_difference(*arrays)))
+}
+
+# parameters of a product besides its inputs: a product computed with other parameters is rebuilt
+PRODUCT_PARAMS = {
+  'ndvi_classified': NDVI_CLASSES
+}
+
+class LocalEngine:
+
+  # sources: {'B2': path, 'B3': path, 'B4': path, 'B8': path, 'B11': path, 'dem': path}
+  # (Sentinel-2 L2A band files, any resolution: resampled on the reference band grid)
+  def __init__(self, sources, center, radius, output_dir=OUTPUT_DIR, block_rows=BLOCK_ROWS):
+    _require()
+    self.sources = sources
+    self.center = center
+    self.radius = radius
+    self.output_dir = output_dir
+    self.block_rows = block_rows
+    # products are computed once when several layers need them concurrently
+    self._locks = {}
+    self._lock = threading.Lock()
+
+  def path(self, product):
+    return os.path.join(self.output_dir, product + '.tif')
+
+  # inputs state of a product (for the build cache)
+  def fingerprint(self, product):
+    bands, reference, _, _ = PRODUCTS[product]
+    state = []
+    for band in bands:
+      stat = os.stat(self.sources[band])
+      state.append([self.sources[band], stat.st_size, stat.st_mtime_ns])
+    return [product, repr(PRODUCT_PARAMS.get(product)), self.center, self.radius, state]
+
+  def _up_to_date(self, product):
+    path = self.path(product)
+    if not os.path.exists(path):
+      return False
+    built = os.path.getmtime(path)
+    if not all(os.path.getmtime(self.sources[band]) < built for band in PRODUCTS[product][0]):
+      return False
+    with rasterio.open(path) as dataset:
+      return dataset.tags().get('params') == repr(PRODUCT_PARAMS.get(product))
+
+  # ##### computing a product over the AOI strip by strip into a COG (reused while up to date)
+  def product(self, product, refresh=False):
+    with self._lock:
+      lock = self._locks.setdefault(product, threading.Lock())
+    with lock:
+      if not refresh and self._up_to_date(product):
+        return self.path(product)
+      return self._compute(product)
+
+  def _compute(self, product):
+    bands, reference, halo, function = PRODUCTS[product]
+    with rasterio.open(self.sources[reference]) as dataset:
+      grid = aoi_grid(dataset, self.center, self.radius)
+    os.makedirs(self.output_dir, exist_ok=True)
+    temp = self.path(product) + '.strips.tif'
+    sources = [_open(self.sources[band], grid.crs) for band in bands]
+    profile = {
+      'driver': 'GTiff', 'width': grid.width, 'height': grid.height, 'crs': grid.crs, 'transform': grid.transform,
+      'count': 3 if product == 'true_colors' else 1, 'dtype': 'float32', 'nodata': float('nan'),
+      'tiled': True, 'blockxsize': 256, 'blockysize': 256, 'compress': 'deflate'
+    }
+    try:
+      with rasterio.open(temp, 'w', **profile) as output:
+        output.update_tags(params=repr(PRODUCT_PARAMS.get(product)))
+        for start in range(0, grid.height, self.block_rows):
+          stop = min(start + self.block_rows, grid.height)
+          first, last = max(0, start - halo), min(grid.height, stop + halo)
+          arrays = [read_rows(source, grid, first, last) for source in sources]
+          values = function(arrays, grid, first, last)[..., start - first:stop - first, :]
+          values = np.where(circle_mask(grid, start, stop, self.center, self.radius), values, np.nan).astype(np.float32)
+          window = Window(0, start, grid.width, stop - start)
+          if values.ndim == 2:
+            output.write(values, 1, window=window)
+          else:
+            output.write(values, window=window)
+    finally:
+      for source in sources:
+        source.close()
+    # tiled GeoTIFF -> Cloud Optimized GeoTIFF (internal overviews, deflate)
+    copy_raster(temp, self.path(product), driver='COG', compress='DEFLATE', predictor='YES', overview_resampling='average')
+    os.remove(temp)
+    return self.path(product)
+
+  # ##### pixel counts and areas (square meters) of the values of a single band product
+  # (e.g. classes), read by strips: {value: (pixels, area)}
+  def value_areas(self, product):
+    path = self.product(product)
+    pixels, areas = {}, {}
+    with rasterio.open(path) as dataset:
+      grid = Grid(dataset.crs, dataset.transform, dataset.width, dataset.height)
+      for start in range(0, grid.height, self.block_rows):
+        stop = min(start + self.block_rows, grid.height)
+        values = dataset.read(1, window=Window(0, start, grid.width, stop - start))
+        dx, dy = pixel_size(grid, start, stop)
+        rows = np.broadcast_to((dx * dy).reshape(-1, 1), values.shape)
+        valid = ~np.isnan(values)
+        values = values[valid].astype(np.int64)
+        counts = np.bincount(values)
+        sums = np.bincount(values, weights=rows[valid])
+        for value in np.flatnonzero(counts):
+          pixels[value] = pixels.get(value, 0) + int(counts[value])
+          areas[value] = areas.get(value, 0.0) + float(sums[value])
+    return {int(value): (pixels[value], areas[value]) for value in pixels}
+
+  # ##### rendering a product into <root>/<name>/{z}/{x}/{y}.png, returning the tiles url
+  def tiles(self, product, vis_params, root, name, bounds, min_zoom, max_zoom):
+    path = self.product(product)
+    directory = os.path.join(root, name)
+    store = DirectoryStore(directory)
+    # stamped with the visual parameters (as stored in json): rendered again when they change
+    stamp = json.loads(json.dumps(vis_params))
+    if store.stamp() != stamp or os.path.getmtime(directory) < os.path.getmtime(path):
+      render_tiles(path, vis_params, store, bounds, min_zoom, max_zoom)
+      # marking the tiles as up to date (also when the product has no pixel to draw)
+      store.set_stamp(stamp)
+      os.utime(directory)
+    return local_url(root, name)
+
+  # ##### value tiles of a single band product (see portmap.values) into <root>/<name>
+  def value_tiles(self, product, low, high, root, name, bounds, min_zoom, max_zoom):
+    from portmap.values import encode_values
+    path = self.product(product)
+    directory = os.path.join(root, name)
+    # value range of the tiles: rendered again when it changes
+    encoding = os.path.join(directory, 'encoding.json')
+    try:
+      with open(encoding, encoding='utf-8') as f:
+        current = json.load(f)
+    except (OSError, ValueError):
+      current = None
+    if current != [low, high] or os.path.getmtime(directory) < os.path.getmtime(path):
+      render_tiles(path, None, DirectoryStore(directory), bounds, min_zoom, max_zoom,
+                   encode=lambda values: encode_values(values, low, high))
+      os.makedirs(directory, exist_ok=True)
+      with open(encoding, 'w', encoding='utf-8') as f:
+        json.dump([low, high], f)
+      os.utime(directory)
+    return local_url(root, name)
+
+#################### RENDERING ####################
+
+def _hex(color):
+  color = color.lstrip('#')
+  return [int(color[i:i + 2], 16) for i in (0, 2, 4)]
+
+# Earth Engine visual parameters (min, max, palette / bands, gamma) applied to (bands, n) values
+def colorize(values, vis_params):
+  low, high = vis_params.get('min', 0), vis_params.get('max', 1)
+  scaled = np.clip((values - low) / float(high - low), 0, 1)
+  alpha = np.all(np.isfinite(values), axis=0)
+  scaled = np.nan_to_num(scaled)
+  if values.shape[0] == 3:
+    gamma = vis_params.get('gamma', 1)
+    rgb = (scaled ** (1.0 / gamma) * 255).T
+  else:
+    # palette colors linearly interpolated like Earth Engine does
+    palette = np.array([_hex(c) for c in vis_params.get('palette', ['000000', 'ffffff'])], dtype=np.float32)
+    position = scaled[0] * (len(palette) - 1)
+    index = np.minimum(position.astype(int), len(palette) - 2) if len(palette) > 1 else np.zeros(position.shape, int)
+    fraction = (position - index)[:, None] if len(palette) > 1 else 0
+    following = palette[np.minimum(index + 1, len(palette) - 1)]
+    rgb = palette[index] * (1 - fraction) + following * fraction
+  rgba = np.zeros((values.shape[1], 4), dtype=np.uint8)
+  rgba[:, :3] = np.round(rgb)
+  rgba[:, 3] = alpha * 255
+  return rgba
+
+# web mercator (EPSG:3857) affine transform of a tile
+def tile_transform(z, x, y, size=TILE_SIZE):
+  extent = 20037508.342789244
+  tile = 2 * extent / 2 ** z
+  return Affine(tile / size, 0, -extent + x * tile, 0, -tile / size, extent - y * tile)
+
+# encode: (bands, n) values -> (n, 4) RGBA bytes, colorize() with vis_params by default
+def render_tiles(path, vis_params, store, bounds, min_zoom, max_zoom, encode=None):
+  with rasterio.open(path) as dataset:
+    bands = list(range(1, dataset.count + 1))
+    tile = np.empty((len(bands), TILE_SIZE, TILE_SIZE), dtype=np.float32)
+    for z, x, y in tile_coordinates(bounds, min_zoom, max_zoom):
+      tile.fill(np.nan)
+      # warped from the COG blocks/overviews covering the tile (GDAL approximate transformer)
+      reproject(rasterio.band(dataset, bands), tile, src_nodata=np.nan,
+                dst_transform=tile_transform(z, x, y), dst_crs='EPSG:3857', dst_nodata=np.nan,
+                resampling=Resampling.nearest)
+      values = tile.reshape(len(bands), -1)
+      rgba = encode(values) if encode is not None else colorize(values, vis_params)
+      if not rgba[:, 3].any():
+        continue
+      image = Image.fromarray(rgba.reshape(TILE_SIZE, TILE_SIZE, 4), 'RGBA')
+      buffer = io.BytesIO()
+      image.save(buffer, 'PNG')
+      store.put(z, x, y, buffer.getvalue())
+  store.close()
@@ -0,0 +1,120 @@
+# ########## Layers registry
+# Declarative description of the map layers: one VectorLayer entry per layers/*.geojson file
+# (style, highlight, tooltip, preprocessing and loading options) and one RasterLayer entry per
+# Earth Engine image. The map is built from these tables by portmap.build.LayerBuilder.
+# ZonalRaster entries are the rasters summarized over the vector layers features (portmap.zonal),
+# OverlayLayer entries the layers intersected by the overlay analysis (portmap.overlay).
+from dataclasses import dataclass, field
+from typing import Optional
+
+# inline style of the tooltip box shared by all the vector layers
+TOOLTIP_STYLE = 'background-color: white; color: #333333; font-family: arial; font-size: 12px; padding: 10px;'
+
+@dataclass
+class VectorLayer:
+  # name displayed in the layer control
+  name: str
+  # GeoJSON file
+  path: str
+  # constant Leaflet path style, e.g: {'color': '#145B27', 'weight': 2}
+  style: dict
+  # style on hover (None: no highlight)
+  highlight: Optional[dict] = None
+  # data driven style keys, mapping a style key to the feature property holding its value,
+  # e.g: {'color': 'stroke'} (merged over the constant style)
+  style_properties: dict = field(default_factory=dict)
+  highlight_properties: dict = field(default_factory=dict)
+  # tooltip: feature properties and their labels, or a plain text
+  tooltip_fields: list = field(default_factory=list)
+  tooltip_aliases: list = field(default_factory=list)
+  tooltip_text: Optional[str] = None
+  # preprocessing simplification tolerance (degrees, 0.0001 ~ 10m)
+  tolerance: float = 0
+  # [west, south, east, north]: only the features intersecting it are kept (streamed
+  # ingestion, see portmap.stream), None: all the features
+  bbox: Optional[list] = None
+  # embedded and shown on load in the 'lazy' vector mode
+  eager: bool = False
+  # data sent to the browser as 'geojson' or 'topojson' (shared arcs, delta-encoded integer
+  # coordinates, see portmap.topojson), in the 'inline' and 'lazy' vector modes
+  transport: str = 'geojson'
+  # zoom dependent levels of detail ('lazy' vector mode, the layer not being eager): zoom levels
+  # from which a variant simplified to about a pixel of that zoom is fetched and drawn, the layer
+  # data itself being drawn from the last one, e.g: [8, 10, 12, 14] (see portmap.lod), empty: a
+  # single variant
+  lod: list = field(default_factory=list)
+  # zonal statistics written into the features properties and shown in the tooltip: names of
+  # ZonalRaster entries, e.g: ['ndvi', 'slopes'] (see portmap.zonal)
+  zonal: list = field(default_factory=list)
+
+  # feature properties used by the layer (everything else is dropped by the preprocessing)
+  def used_properties(self):
+    used = list(self.tooltip_fields)
+    for properties in (self.style_properties, self.highlight_properties):
+      used.extend(p for p in properties.values() if p not in used)
+    return used
+
+  def style_function(self):
+    return _style_function(self.style, self.style_properties)
+
+  def highlight_function(self):
+    if self.highlight is None:
+      return None
+    return _style_function(self.highlight, self.highlight_properties)
+
+  # fields/aliases: properties added to the tooltip (e.g. the zonal statistics)
+  def tooltip(self, fields=(), aliases=()):
+    if self.tooltip_fields or fields:
+      from folium.features import GeoJsonTooltip
+      return GeoJsonTooltip(fields=list(self.tooltip_fields) + list(fields),
+                            aliases=list(self.tooltip_aliases or self.tooltip_fields) + list(aliases), style=TOOLTIP_STYLE)
+    return self.tooltip_text
+
+@dataclass
+class RasterLayer:
+  # name displayed in the layer control
+  name: str
+  # ee.Image to draw
+  image: object
+  # Earth Engine visual parameters
+  vis_params: dict
+  # product of the local raster engine computing the same image offline (see portmap.raster)
+  local: Optional[str] = None
+  # value tiles encoding (single band layers, see portmap.values): range of the encoded values,
+  # unit and decimals of the readout, e.g: {'min': -1, 'max': 1, 'decimals': 3}
+  values: Optional[dict] = None
+
+@dataclass
+class ZonalRaster:
+  # label in the tooltips
+  label: str
+  # ee.Image summarized (first band)
+  image: object
+  # local raster engine product (see portmap.raster)
+  local: Optional[str] = None
+  # Earth Engine reduction scale (meters)
+  scale: float = 10
+  # portmap.classify.Classification of a classified raster (class areas instead of statistics)
+  classes: Optional[object] = None
+  # pixel counts of a continuous raster in equal bins: [min, max, bins], e.g: [-1, 1, 10] (values
+  # outside [min, max) left out), None: no histogram
+  histogram: Optional[list] = None
+
+@dataclass
+class OverlayLayer:
+  # name in the overlay results
+  name: str
+  # GeoJSON file
+  path: str
+  # feature properties identifying a feature in the results, e.g: ['name', 'section', 'ilot']
+  keys: list = field(default_factory=list)
+  # buffer (meters) around the features, e.g. a road right of way
+  buffer: float = 0
+  # [west, south, east, north]: only the features intersecting it are intersected, None: all
+  bbox: Optional[list] = None
+
+# folium style function: constant style + per feature values read from the feature properties
+def _style_function(style, properties):
+  if not properties:
+    return lambda feature: dict(style)
+  return lambda feature: dict(style, **{key: feature['properties'][p] for key, p in properties.items()})
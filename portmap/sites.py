@@ -0,0 +1,147 @@
+# ########## Batch builds of several sites
+# The same study is run for several coastal projects from one configuration file, a JSON list
+# of sites:
+#   [{"name": "Cherchell", "aoi": [2.310362, 36.577489], "radius": 10500,
+#     "scene": "COPERNICUS/S2_SR/20211019T104051_20211019T104645_T31SDA"},
+#    {"name": "...", "aoi": [...], "dates": {"start": "2021-06-01", "end": "2021-09-01"}, "layers": "sites/..."}]
+# Every site is built by the webmap script with its AOI, scene (or date range composite) and map
+# view, into its own outputs: webmap-<site>.html, data/<site>, tiles/<site>, analysis/<site>,
+# rasters/local/<site> (the pages stay next to src/ and the shared caches). A registry layer is
+# read from the site's own layers directory (if it has one) when the file is there, the shared
+# file is otherwise filtered to the features intersecting the site extent (streamed ingestion,
+# see portmap.stream).
+# Sites are built in parallel worker processes sharing the on disk caches: Earth Engine map ids
+# and reductions (.cache/ee, .cache/build), ingested layers (.cache/layers) and rendered layer
+# fragments (.cache/build), so rebuilding the sites only redoes what changed.
+import contextlib
+import importlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
+from typing import Optional
+
+from portmap.geometry import buffer_bounds
+from portmap.mvt import slugify
+
+WORKERS = min(4, os.cpu_count() or 1)
+
+@dataclass
+class Site:
+  name: str
+  # AOI center [lon, lat] and radius (meters)
+  aoi: list
+  radius: float = 10500
+  # Sentinel-2 scene id, or dates: {'start': ..., 'end': ...} for the median composite of the
+  # cloud masked scenes of a date range (None for both: the webmap script scene)
+  scene: Optional[str] = None
+  dates: Optional[dict] = None
+  # directory of the site's own layer files (same file names as the registry), None: the shared
+  # files filtered to the site extent
+  layers: Optional[str] = None
+  # map view: [lat, lon] (None: the AOI center) and zoom
+  center: Optional[list] = None
+  zoom: int = 14
+  # extent of the shared layers kept around the AOI (meters past its radius)
+  margin: float = 0
+  # LOCAL_RASTERS files of the site (local raster backend), None: the webmap script ones
+  local_rasters: Optional[dict] = None
+  # TIME_SERIES of the site, None: the webmap script one
+  time_series: Optional[dict] = None
+
+  @property
+  def slug(self):
+    return slugify(self.name)
+
+  # [west, south, east, north] the shared layers are filtered to
+  def extent(self):
+    return buffer_bounds(self.aoi[0], self.aoi[1], self.radius + self.margin)
+
+def load_sites(path):
+  with open(path, encoding='utf-8') as f:
+    sites = [Site(**entry) for entry in json.load(f)]
+  slugs = [site.slug for site in sites]
+  duplicates = sorted(set(slug for slug in slugs if slugs.count(slug) > 1))
+  if duplicates:
+    raise ValueError('{}: several sites named {}'.format(path, ', '.join(duplicates)))
+  return sites
+
+# registry layer of a site: its own file, or the shared file filtered to the site extent
+def site_layer(layer, site):
+  if site.layers:
+    own = os.path.join(site.layers, os.path.basename(layer.path))
+    if os.path.exists(own):
+      return replace(layer, path=own)
+  return replace(layer, bbox=layer.bbox or site.extent())
+
+# ##### pointing the webmap script module settings at a site (on a freshly loaded module:
+# the outputs directories are derived from the script ones)
+def configure(webmap, site):
+  webmap.aoi_center = list(site.aoi)
+  webmap.aoi_radius = site.radius
+  webmap.aoi_bounds = buffer_bounds(site.aoi[0], site.aoi[1], site.radius)
+  if site.scene or site.dates:
+    webmap.SCENE = site.scene
+    webmap.SCENE_DATES = site.dates
+  if site.local_rasters is not None:
+    webmap.LOCAL_RASTERS = site.local_rasters
+  if site.time_series is not None:
+    webmap.TIME_SERIES = site.time_series
+  webmap.MAP_FILE = '{}-{}.html'.format(os.path.splitext(webmap.MAP_FILE)[0], site.slug)
+  webmap.MAP_LOCATION = site.center or [site.aoi[1], site.aoi[0]]
+  webmap.MAP_ZOOM = site.zoom
+  for setting in ('DATA_DIR', 'TILES_ROOT', 'ANALYSIS_DIR', 'LOCAL_DIR'):
+    setattr(webmap, setting, os.path.join(getattr(webmap, setting), site.slug))
+  if webmap.BUNDLE:
+    webmap.BUNDLE = os.path.join(webmap.BUNDLE, site.slug)
+  webmap.VECTOR_LAYERS = [site_layer(layer, site) for layer in webmap.VECTOR_LAYERS]
+
+# one site build in a worker process, its output written to <analysis dir>/build.log
+def build_site(script, site, vector_only=False, offline=False):
+  # a worker building several sites starts each of them from the script settings
+  webmap = importlib.reload(sys.modules[script]) if script in sys.modules else importlib.import_module(script)
+  configure(webmap, site)
+  os.makedirs(webmap.ANALYSIS_DIR, exist_ok=True)
+  log = os.path.join(webmap.ANALYSIS_DIR, 'build.log')
+  started = time.perf_counter()
+  with open(log, 'w', encoding='utf-8') as f, contextlib.redirect_stdout(f):
+    _, cache = webmap.build(vector_only=vector_only, offline=offline, open_browser=False)
+  return {
+    'site': site.name,
+    'map': webmap.MAP_FILE,
+    'log': log,
+    'seconds': time.perf_counter() - started,
+    'reused': len(cache.reused),
+    'rebuilt': len(cache.rebuilt)
+  }
+
+# ##### building all the sites, 'workers' at a time (script: module name of the webmap script)
+# returns the result of every site build (or its error), in the sites order
+def build_sites(sites, script='webmap', workers=WORKERS, vector_only=False, offline=False, report=True):
+  started = time.perf_counter()
+  results = []
+  with ProcessPoolExecutor(max_workers=min(workers, len(sites)) or 1) as pool:
+    futures = [pool.submit(build_site, script, site, vector_only, offline) for site in sites]
+    for site, future in zip(sites, futures):
+      try:
+        results.append(future.result())
+      except Exception as error:
+        results.append({'site': site.name, 'error': '{}: {}'.format(type(error).__name__, error)})
+  if report:
+    print(sites_report(results, time.perf_counter() - started, workers))
+  return results
+
+def sites_report(results, seconds, workers):
+  lines = ['{:<32} {:>8} {:>7} {:>8}  {}'.format('site', 'seconds', 'reused', 'rebuilt', 'map')]
+  for result in results:
+    if 'error' in result:
+      lines.append('{:<32} failed: {}'.format(result['site'], result['error']))
+      continue
+    lines.append('{:<32} {:>8.2f} {:>7} {:>8}  {}'.format(result['site'], result['seconds'], result['reused'],
+                                                         result['rebuilt'], result['map']))
+  total = sum(result.get('seconds', 0) for result in results)
+  lines.append('{} sites built in {:.2f}s with {} workers (sum of the site builds: {:.2f}s)'.format(
+    len(results), seconds, workers, total))
+  return '\n'.join(lines)
@@ -0,0 +1,233 @@
+# ########## Streaming GeoJSON ingestion
+# Large layers (hundreds of MB FeatureCollections) are read feature by feature with an
+# incremental parser instead of json.load: the file is read by chunks and each feature is
+# decoded with json.JSONDecoder.raw_decode as soon as it is complete, so only the current
+# feature is held in memory. Each feature is filtered on a bounding box, its properties
+# projected and its geometry simplified/quantized on the fly, then written to the output file
+# right away. Peak memory is proportional to the largest single feature, not to the file.
+# Simplification is topology preserving within each feature only, unless topology=True: a first
+# streaming pass then finds the junctions of the whole layer (vertices where borders shared
+# between features meet or split) in a sqlite index on disk next to the output, and each feature
+# is simplified with the junctions of its bounding box read back from it. The arcs between
+# junctions are simplified the same way on both sides of a shared border, so memory stays
+# bounded by the largest feature in both modes.
+# Command line:
+#   python -m portmap.stream input.geojson output.geojson --bbox 2.1,36.4,2.5,36.7 --keep name,area --tolerance 0.00002
+import argparse
+import json
+import os
+import sqlite3
+
+from portmap.geometry import TopologySimplifier, count_vertices, geometry_bounds
+from portmap.preprocess import PRECISION, collection_size, feature_size, preprocess_feature, register_feature
+
+# characters read at once
+CHUNK_SIZE = 1 << 16
+_WHITESPACE = ' \t\r\n'
+
+class _Reader:
+
+  def __init__(self, f, chunk_size=CHUNK_SIZE):
+    self.f = f
+    self.chunk_size = chunk_size
+    self.buffer = ''
+    self.pos = 0
+    self.eof = False
+    self.decoder = json.JSONDecoder()
+    # largest buffer held (characters)
+    self.peak = 0
+
+  # appending the next chunk, dropping what was already decoded
+  def fill(self):
+    data = self.f.read(self.chunk_size)
+    if not data:
+      self.eof = True
+      return False
+    self.buffer = self.buffer[self.pos:] + data
+    self.pos = 0
+    self.peak = max(self.peak, len(self.buffer))
+    return True
+
+  # next non blank character (not consumed), '' at the end of the file
+  def peek(self):
+    while True:
+      while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+        self.pos += 1
+      if self.pos < len(self.buffer):
+        return self.buffer[self.pos]
+      if not self.fill():
+        return ''
+
+  def expect(self, char):
+    if self.peek() != char:
+      raise ValueError('expected {!r} at character {!r} of the stream'.format(char, self.peek()))
+    self.pos += 1
+
+  # next JSON value: decoded once complete, reading at least as much again as what is
+  # buffered after each incomplete attempt (linear time for large values)
+  def value(self):
+    self.peek()
+    while True:
+      try:
+        value, end = self.decoder.raw_decode(self.buffer, self.pos)
+        # a number at the end of the buffer may continue in the next chunk
+        if end < len(self.buffer) or self.eof:
+          self.pos = end
+          return value
+      except json.JSONDecodeError:
+        if self.eof:
+          raise
+      target = 2 * (len(self.buffer) - self.pos)
+      while len(self.buffer) - self.pos < target and self.fill():
+        pass
+
+# ##### features of a GeoJSON FeatureCollection file, one at a time (the other top level
+# members like 'type', 'name' or 'crs' are skipped)
+def iter_features(path, chunk_size=CHUNK_SIZE, reader=None):
+  with open(path, encoding='utf-8-sig') as f:
+    reader = reader or _Reader(f, chunk_size)
+    reader.f = f
+    reader.expect('{')
+    while True:
+      char = reader.peek()
+      if char == '}':
+        return
+      if char == ',':
+        reader.pos += 1
+        continue
+      key = reader.value()
+      reader.expect(':')
+      if key != 'features':
+        reader.value()
+        continue
+      reader.expect('[')
+      while True:
+        char = reader.peek()
+        if char == ']':
+          reader.pos += 1
+          break
+        if char == ',':
+          reader.pos += 1
+          continue
+        yield reader.value()
+
+def _intersects(bounds, bbox):
+  return bounds[0] <= bbox[2] and bounds[2] >= bbox[0] and bounds[1] <= bbox[3] and bounds[3] >= bbox[1]
+
+def _selected(feature, bbox):
+  if bbox is None:
+    return True
+  return bool(feature.get('geometry')) and _intersects(geometry_bounds(feature['geometry']), bbox)
+
+# ##### junctions of the lines of a whole layer (line ends and vertices with more than two
+# distinct neighbours, see portmap.geometry.TopologySimplifier) in a sqlite file
+class JunctionIndex:
+
+  def __init__(self, path):
+    self.path = path
+    self.db = sqlite3.connect(path)
+    self.db.execute('PRAGMA journal_mode = OFF')
+    self.db.execute('PRAGMA synchronous = OFF')
+    self.db.execute('CREATE TABLE edges (x REAL, y REAL, nx REAL, ny REAL)')
+    self.db.execute('CREATE TABLE junctions (x REAL, y REAL)')
+
+  # first pass: the vertices of a feature with their neighbours in the feature (a vertex with more
+  # than two of them is already a junction)
+  def register(self, feature):
+    local = TopologySimplifier(0)
+    register_feature(feature, local)
+    junctions = list(local.endpoints)
+    edges = []
+    for (x, y), neighbours in local.neighbours.items():
+      if len(neighbours) > 2:
+        junctions.append((x, y))
+      else:
+        edges.extend((x, y, nx, ny) for nx, ny in neighbours)
+    self.db.executemany('INSERT INTO junctions VALUES (?, ?)', junctions)
+    self.db.executemany('INSERT INTO edges VALUES (?, ?, ?, ?)', edges)
+
+  # vertices with more than two distinct neighbours across the features
+  def finish(self):
+    self.db.execute('INSERT INTO junctions SELECT x, y FROM (SELECT DISTINCT x, y, nx, ny FROM edges) '
+                    'GROUP BY x, y HAVING COUNT(*) > 2')
+    self.db.execute('DROP TABLE edges')
+    self.db.execute('CREATE INDEX junctions_position ON junctions (x, y)')
+    self.db.commit()
+
+  # junctions within [west, south, east, north]
+  def within(self, bounds):
+    rows = self.db.execute('SELECT x, y FROM junctions WHERE x BETWEEN ? AND ? AND y BETWEEN ? AND ?',
+                           (bounds[0], bounds[2], bounds[1], bounds[3]))
+    return set(rows)
+
+  def close(self):
+    self.db.close()
+    os.remove(self.path)
+
+# ##### streaming a layer file into a processed GeoJSON file:
+# bbox: [west, south, east, north] features kept (None: all), keep: properties kept (None: all),
+# tolerance: simplification (degrees), precision: coordinates decimals (None: untouched)
+# returns the before/after stats (same format as portmap.preprocess.preprocess_layer)
+def ingest(source, destination, bbox=None, keep=None, tolerance=0, precision=PRECISION, topology=False,
+           chunk_size=CHUNK_SIZE):
+  os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+  temp = '{}.{}.tmp'.format(destination, os.getpid())
+  index = None
+  if tolerance > 0 and topology:
+    index = JunctionIndex(temp + '.junctions')
+    for feature in iter_features(source, chunk_size):
+      if _selected(feature, bbox) and feature.get('geometry'):
+        index.register(feature)
+    index.finish()
+  reader = _Reader(None, chunk_size)
+  # sizes as embedded in the page, the same as the layers preprocessed at once (payload_size)
+  stats = {'layer': source, 'features': [0, 0], 'before': {'bytes': 0, 'vertices': 0},
+           'after': {'bytes': 0, 'vertices': 0}}
+  try:
+    with open(temp, 'w', encoding='utf-8') as out:
+      out.write('{"type": "FeatureCollection", "features": [')
+      written = 0
+      for feature in iter_features(source, chunk_size, reader):
+        stats['features'][0] += 1
+        stats['before']['bytes'] += feature_size(feature)
+        stats['before']['vertices'] += count_vertices(feature.get('geometry'))
+        if not _selected(feature, bbox):
+          continue
+        if index is not None and feature.get('geometry'):
+          simplifier = TopologySimplifier(tolerance, junctions=index.within(geometry_bounds(feature['geometry'])))
+        else:
+          simplifier = TopologySimplifier(tolerance)
+          if tolerance > 0:
+            register_feature(feature, simplifier)
+        processed = preprocess_feature(feature, simplifier, precision, keep)
+        stats['after']['vertices'] += count_vertices(processed.get('geometry'))
+        out.write((', ' if written else '') + json.dumps(processed))
+        written += 1
+      out.write(']}')
+  finally:
+    if index is not None:
+      index.close()
+  os.replace(temp, destination)
+  stats['features'][1] = written
+  stats['before']['bytes'] = collection_size(stats['before']['bytes'], stats['features'][0])
+  stats['after']['bytes'] = os.path.getsize(destination)
+  stats['peak_buffer'] = reader.peak
+  return stats
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Streaming GeoJSON ingestion (bounded memory)')
+  parser.add_argument('source')
+  parser.add_argument('destination')
+  parser.add_argument('--bbox', help='west,south,east,north')
+  parser.add_argument('--keep', help='comma separated properties kept (default: all)')
+  parser.add_argument('--tolerance', type=float, default=0)
+  parser.add_argument('--precision', type=int, default=PRECISION)
+  parser.add_argument('--topology', action='store_true', help='topology preserving simplification across features')
+  args = parser.parse_args()
+  stats = ingest(args.source, args.destination,
+                 bbox=[float(v) for v in args.bbox.split(',')] if args.bbox else None,
+                 keep=args.keep.split(',') if args.keep else None,
+                 tolerance=args.tolerance, precision=args.precision, topology=args.topology)
+  print('{} -> {}: {} of {} features, {:.1f} KB -> {:.1f} KB, {} -> {} vertices, largest buffer {:.1f} KB'.format(
+    args.source, args.destination, stats['features'][1], stats['features'][0], stats['before']['bytes'] / 1024,
+    stats['after']['bytes'] / 1024, stats['before']['vertices'], stats['after']['vertices'], stats['peak_buffer'] / 1024))
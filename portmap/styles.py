@@ -0,0 +1,82 @@
+# ########## Static layer styles
+# The layers styles are written once in the page as a Leaflet style (constant styles) or as a
+# small JS function reading the data driven keys from the feature properties, e.g. the roads:
+#   function(feature) { var p = feature.properties; return {"opacity": 0.5, "color": p["stroke"], ...}; }
+# instead of calling a Python style function per feature and embedding a switch over the
+# features ids (plus an 'id' added to every feature) like folium's GeoJson does.
+import json
+
+from folium.features import GeoJson
+from jinja2 import Template
+
+# style: constant Leaflet path style, properties: {style key: feature property}
+def style_expression(style, properties=None):
+  if not properties:
+    return json.dumps(style)
+  entries = ['{}: {}'.format(json.dumps(key), json.dumps(value)) for key, value in style.items() if key not in properties]
+  entries += ['{}: p[{}]'.format(json.dumps(key), json.dumps(prop)) for key, prop in properties.items()]
+  return 'function(feature) { var p = feature.properties; return {' + ', '.join(entries) + '}; }'
+
+# shared part of the styled layers scripts: the style/highlight functions and the empty L.geoJson
+# layer holding the options, each template then adds its data (see the subclasses)
+GEOJSON_LAYER = u"""
+    {% macro geojson_layer(this) %}
+    {%- if this.style_js %}
+    var {{ this.get_name() }}_style = {{ this.style_js }};
+    {%- endif %}
+    {%- if this.highlight_js %}
+    var {{ this.get_name() }}_highlight = {{ this.highlight_js }};
+    {%- endif %}
+    function {{ this.get_name() }}_onEachFeature(feature, layer) {
+      layer.on({
+        {%- if this.highlight_js %}
+        mouseout: function(e) {
+          if(typeof e.target.setStyle === "function"){
+            {{ this.get_name() }}.resetStyle(e.target);
+          }
+        },
+        mouseover: function(e) {
+          if(typeof e.target.setStyle === "function"){
+            e.target.setStyle({{ this.get_name() }}_highlight{% if this.highlight_properties %}(e.target.feature){% endif %});
+          }
+        },
+        {%- endif %}
+      });
+    };
+    var {{ this.get_name() }} = L.geoJson(null, {
+      {%- if this.smooth_factor is not none %}
+        smoothFactor: {{ this.smooth_factor|tojson }},
+      {%- endif %}
+        onEachFeature: {{ this.get_name() }}_onEachFeature,
+      {%- if this.style_js %}
+        style: {{ this.get_name() }}_style,
+      {%- endif %}
+      {%- if this.renderer == 'canvas' %}
+        renderer: portmapHover.renderer({{ this._parent.get_name() }}),
+        interactive: false,
+      {%- endif %}
+    });
+    {%- endmacro %}
+"""
+
+class StyledGeoJson(GeoJson):
+  _template = Template(GEOJSON_LAYER + u"""
+    {% macro script(this, kwargs) %}
+    {{ geojson_layer(this) }}
+    {{ this.get_name() }}.addData({{ this.data|tojson }}).addTo({{ this._parent.get_name() }});
+    {% endmacro %}
+    """)
+
+  # style/highlight: constant Leaflet path styles, style_properties/highlight_properties:
+  # style keys read from the features properties ({style key: property})
+  # renderer: None (Leaflet's default SVG) or 'canvas': non interactive paths on the map canvas
+  # renderer, the hover being resolved by a portmap.canvas.HoverIndex child
+  def __init__(self, data, style=None, style_properties=None, highlight=None, highlight_properties=None,
+               renderer=None, **kwargs):
+    super(StyledGeoJson, self).__init__(data, **kwargs)
+    self._name = 'GeoJson'
+    self.renderer = renderer
+    self.style_properties = style_properties or {}
+    self.highlight_properties = highlight_properties or {}
+    self.style_js = style_expression(style, self.style_properties) if style is not None else None
+    self.highlight_js = style_expression(highlight, self.highlight_properties) if highlight is not None else None
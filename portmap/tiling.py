@@ -0,0 +1,260 @@
+# ########## Tiled raster processing
+# Running the local raster products (portmap.raster PRODUCTS: NDVI/NDWI, slopes, NDVI classes...)
+# over a large AOI (e.g. all of Tipaza and the neighbouring wilayas) instead of the 10.5km
+# buffer around the port:
+# - the AOI grid (reference band pixels covering the AOI bounds) is split into tiles of
+#   TILE_SIZE pixels, each one read with an overlap of the product halo on every side (the
+#   slopes need the neighbouring pixels) and cropped back after the computation
+# - tiles are processed in a ProcessPoolExecutor (one process per core, each worker opens its
+#   own datasets) and written to <run>/tiles/<row>_<col>.tif
+# - a manifest (<run>/manifest.json) records the finished tiles as they complete: a crashed or
+#   interrupted run started again only processes the missing tiles
+# - the tiles are mosaicked into <run>/<product>.tif (Cloud Optimized GeoTIFF), window by window
+# On Earth Engine the same tiles are batched export tasks (ee_export), their task ids kept in
+# the manifest so a restart doesn't start the tasks already running or done; the exported
+# GeoTIFFs are mosaicked with mosaic().
+# Command line:
+#   python -m portmap.tiling ndvi --aoi layers/tipaza_admin_borders.geojson --source B8=... --source B4=...
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from portmap.geometry import geometry_bounds
+from portmap.preprocess import load_geojson
+from portmap.raster import PRODUCT_PARAMS, PRODUCTS, Grid, _open, _require, read_rows
+
+try:
+  import rasterio
+  from rasterio.features import geometry_mask
+  from rasterio.shutil import copy as copy_raster
+  from rasterio.transform import from_origin
+  from rasterio.warp import transform_bounds, transform_geom
+  from rasterio.windows import Window, from_bounds
+except ImportError:
+  rasterio = None
+
+# tile size (pixels, before the overlap)
+TILE_SIZE = 2048
+WORKERS = os.cpu_count() or 1
+
+#################### GRID ####################
+
+# reference dataset pixels covering lon/lat bounds [west, south, east, north]
+def bounds_grid(dataset, bounds):
+  west, south, east, north = transform_bounds('EPSG:4326', dataset.crs, *bounds, densify_pts=21)
+  window = from_bounds(west, south, east, north, dataset.transform)
+  window = window.round_offsets().round_lengths()
+  window = window.intersection(Window(0, 0, dataset.width, dataset.height))
+  return Grid(dataset.crs, dataset.window_transform(window), int(window.width), int(window.height))
+
+# tiles of a grid: [(row, col, height, width), ...] (pixel offsets)
+def split(grid, tile_size=TILE_SIZE):
+  return [(row, col, min(tile_size, grid.height - row), min(tile_size, grid.width - col))
+          for row in range(0, grid.height, tile_size) for col in range(0, grid.width, tile_size)]
+
+def _tile_name(tile):
+  return '{}_{}'.format(tile[0], tile[1])
+
+#################### WORKER ####################
+
+# ##### computing one tile of a product (runs in a worker process): read with the halo,
+# computed, cropped, masked outside the AOI geometry and written to path
+def process_tile(sources, product, grid, tile, aoi, path):
+  bands, _, halo, function = PRODUCTS[product]
+  row, col, height, width = tile
+  top, left = min(halo, row), min(halo, col)
+  bottom, right = min(halo, grid.height - row - height), min(halo, grid.width - col - width)
+  window = grid.window(col - left, row - top, width + left + right, height + top + bottom)
+  datasets = [_open(sources[band], grid.crs) for band in bands]
+  try:
+    arrays = [read_rows(dataset, window, 0, window.height) for dataset in datasets]
+  finally:
+    for dataset in datasets:
+      dataset.close()
+  values = function(arrays, window, 0, window.height)[..., top:top + height, left:left + width]
+  values = np.asarray(values, dtype=np.float32)
+  tile_grid = grid.window(col, row, width, height)
+  if aoi is not None:
+    outside = geometry_mask([transform_geom('EPSG:4326', grid.crs, aoi)], out_shape=(height, width),
+                            transform=tile_grid.transform)
+    values = np.where(outside, np.nan, values).astype(np.float32)
+  if values.ndim == 2:
+    values = values[np.newaxis]
+  profile = {
+    'driver': 'GTiff', 'width': width, 'height': height, 'count': values.shape[0], 'dtype': 'float32',
+    'crs': grid.crs, 'transform': tile_grid.transform, 'nodata': float('nan'), 'compress': 'deflate'
+  }
+  temp = '{}.{}.tmp'.format(path, os.getpid())
+  with rasterio.open(temp, 'w', **profile) as output:
+    output.write(values)
+  os.replace(temp, path)
+  return tile
+
+#################### MANIFEST ####################
+
+def _read_manifest(path):
+  try:
+    with open(path, encoding='utf-8') as f:
+      return json.load(f)
+  except (OSError, ValueError):
+    return None
+
+def _write_manifest(path, manifest):
+  temp = path + '.tmp'
+  with open(temp, 'w', encoding='utf-8') as f:
+    json.dump(manifest, f)
+  os.replace(temp, path)
+
+#################### MOSAIC ####################
+
+# ##### tiles GeoTIFFs (same grid and bands) -> one Cloud Optimized GeoTIFF, tile by tile
+def mosaic(paths, destination, tags=None):
+  _require()
+  with rasterio.open(paths[0]) as first:
+    crs, count, (xres, yres) = first.crs, first.count, first.res
+  bounds = []
+  for path in paths:
+    with rasterio.open(path) as dataset:
+      bounds.append(dataset.bounds)
+  west, south = min(b.left for b in bounds), min(b.bottom for b in bounds)
+  east, north = max(b.right for b in bounds), max(b.top for b in bounds)
+  transform = from_origin(west, north, xres, yres)
+  width, height = int(round((east - west) / xres)), int(round((north - south) / yres))
+  temp = destination + '.mosaic.tif'
+  profile = {
+    'driver': 'GTiff', 'width': width, 'height': height, 'count': count, 'dtype': 'float32', 'crs': crs,
+    'transform': transform, 'nodata': float('nan'), 'tiled': True, 'blockxsize': 256, 'blockysize': 256,
+    'compress': 'deflate', 'BIGTIFF': 'IF_SAFER'
+  }
+  with rasterio.open(temp, 'w', **profile) as output:
+    if tags:
+      output.update_tags(**tags)
+    for path in paths:
+      with rasterio.open(path) as dataset:
+        window = from_bounds(*dataset.bounds, transform=transform).round_offsets().round_lengths()
+        output.write(dataset.read(), window=window)
+  copy_raster(temp, destination, driver='COG', compress='DEFLATE', predictor='YES', overview_resampling='average',
+              BIGTIFF='IF_SAFER')
+  os.remove(temp)
+  return destination
+
+#################### RUN ####################
+
+# ##### product over a large AOI: aoi is a GeoJSON geometry (pixels outside masked) or None with
+# bounds [west, south, east, north]; restartable from <run_dir>/manifest.json
+def run(sources, product, run_dir, aoi=None, bounds=None, tile_size=TILE_SIZE, workers=WORKERS, report=True):
+  _require()
+  bounds = bounds or geometry_bounds(aoi)
+  with rasterio.open(sources[PRODUCTS[product][1]]) as dataset:
+    grid = bounds_grid(dataset, bounds)
+  tiles = split(grid, tile_size)
+  # (a source file changed since the manifest was written: starting over as well)
+  inputs = [[sources[band], os.stat(sources[band]).st_size, os.stat(sources[band]).st_mtime_ns]
+            for band in PRODUCTS[product][0]]
+  settings = {'product': product, 'params': repr(PRODUCT_PARAMS.get(product)), 'inputs': inputs,
+              'bounds': bounds, 'aoi': aoi, 'tile_size': tile_size}
+  manifest_path = os.path.join(run_dir, 'manifest.json')
+  manifest = _read_manifest(manifest_path)
+  if manifest is None or manifest['settings'] != json.loads(json.dumps(settings)):
+    # new run (or other settings): starting over
+    manifest = {'settings': settings, 'done': []}
+  tiles_dir = os.path.join(run_dir, 'tiles')
+  os.makedirs(tiles_dir, exist_ok=True)
+  done = {name for name in manifest['done'] if os.path.exists(os.path.join(tiles_dir, name + '.tif'))}
+  todo = [tile for tile in tiles if _tile_name(tile) not in done]
+  started = time.perf_counter()
+  if todo:
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+      futures = [pool.submit(process_tile, sources, product, grid, tile, aoi,
+                             os.path.join(tiles_dir, _tile_name(tile) + '.tif')) for tile in todo]
+      for future in as_completed(futures):
+        done.add(_tile_name(future.result()))
+        manifest['done'] = sorted(done)
+        _write_manifest(manifest_path, manifest)
+  seconds = time.perf_counter() - started
+  paths = [os.path.join(tiles_dir, _tile_name(tile) + '.tif') for tile in tiles]
+  destination = mosaic(paths, os.path.join(run_dir, product + '.tif'), tags={'params': settings['params']})
+  if report:
+    pixels = sum(tile[2] * tile[3] for tile in todo)
+    print('{}: {} tiles ({} reused), {}x{} pixels, {:.2f}s ({:.1f} Mpx/s, {} workers)'.format(
+      product, len(tiles), len(tiles) - len(todo), grid.width, grid.height, seconds,
+      pixels / 1e6 / seconds if seconds and pixels else 0, workers))
+  return destination
+
+#################### EARTH ENGINE ####################
+
+# {task id: state} of tasks, in a single getTaskStatus request
+def _task_states(task_ids):
+  import ee
+  task_ids = list(task_ids)
+  if not task_ids:
+    return {}
+  return {status['id']: status['state'] for status in ee.data.getTaskStatus(task_ids)}
+
+def _active(states):
+  return sum(1 for state in states.values() if state in ('RUNNING', 'READY'))
+
+# ##### Earth Engine version: one export task per tile (Google Drive folder), started by batches
+# of 'batch' running tasks at most; restartable from <run_dir>/ee_manifest.json (tasks already
+# started or completed are not started again). The tasks states are polled with one request
+# for all the tasks. Returns the tasks states.
+def ee_export(image, bounds, run_dir, description, folder, scale=10, crs='EPSG:32631', tile_degrees=0.2,
+              batch=50, poll=30):
+  import ee
+  os.makedirs(run_dir, exist_ok=True)
+  manifest_path = os.path.join(run_dir, 'ee_manifest.json')
+  manifest = _read_manifest(manifest_path) or {'tasks': {}}
+  west, south, east, north = bounds
+  regions = []
+  y = south
+  while y < north:
+    x = west
+    while x < east:
+      regions.append([x, y, min(x + tile_degrees, east), min(y + tile_degrees, north)])
+      x += tile_degrees
+    y += tile_degrees
+  states = _task_states(manifest['tasks'].values())
+  pending = []
+  for i, region in enumerate(regions):
+    name = '{}_{:04d}'.format(description, i)
+    task_id = manifest['tasks'].get(name)
+    if task_id and states.get(task_id) in ('COMPLETED', 'RUNNING', 'READY'):
+      continue
+    pending.append((name, region))
+  for name, region in pending:
+    while _active(states) >= batch:
+      time.sleep(poll)
+      states = _task_states(manifest['tasks'].values())
+    task = ee.batch.Export.image.toDrive(image=image, description=name, folder=folder, fileNamePrefix=name,
+                                         region=ee.Geometry.Rectangle(region), scale=scale, crs=crs,
+                                         maxPixels=1e10)
+    task.start()
+    manifest['tasks'][name] = task.id
+    states[task.id] = 'READY'
+    _write_manifest(manifest_path, manifest)
+  states = _task_states(manifest['tasks'].values())
+  return {name: states.get(task_id) for name, task_id in manifest['tasks'].items()}
+
+# AOI geometry of a GeoJSON layer file (its features merged as one GeometryCollection)
+def layer_geometry(path):
+  geometries = [f['geometry'] for f in load_geojson(path)['features'] if f.get('geometry')]
+  return geometries[0] if len(geometries) == 1 else {'type': 'GeometryCollection', 'geometries': geometries}
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Tiled local raster product over a large AOI')
+  parser.add_argument('product', choices=sorted(PRODUCTS))
+  parser.add_argument('--source', action='append', default=[], help='band=path (e.g. B4=rasters/..._B04_10m.jp2)')
+  parser.add_argument('--aoi', help='GeoJSON file of the AOI (e.g. layers/tipaza_admin_borders.geojson)')
+  parser.add_argument('--bounds', help='west,south,east,north (instead of --aoi)')
+  parser.add_argument('--output', default=os.path.join('rasters', 'tiled'))
+  parser.add_argument('--tile-size', type=int, default=TILE_SIZE)
+  parser.add_argument('--workers', type=int, default=WORKERS)
+  args = parser.parse_args()
+  run(dict(source.split('=', 1) for source in args.source), args.product, os.path.join(args.output, args.product),
+      aoi=layer_geometry(args.aoi) if args.aoi else None,
+      bounds=[float(v) for v in args.bounds.split(',')] if args.bounds else None,
+      tile_size=args.tile_size, workers=args.workers)
@@ -0,0 +1,139 @@
+# ########## Sentinel-2 time series
+# Monitoring mode of the Earth Engine analysis: instead of one hard-coded scene, the Sentinel-2
+# L2A collection is filtered on the AOI and a date range, cloud masked with the scene
+# classification band (SCL) and reduced server-side into one median composite per period
+# (months). NDVI/NDWI are computed per period, plus the NDVI change of a period since the
+# baseline (first period). A period without any scene under the cloud cover limit gets fully
+# masked bands: its indices have no pixel and its zone means are missing (empty in the CSV).
+# Per zone time series (mean NDVI/NDWI of every feature of the given layers for every period)
+# come from a single batched reduction: the indices of all the periods are stacked as bands of
+# one image reduced over the zones (portmap.zonal.ee_reduce_regions) instead of one request per
+# date. The values of the past periods are stored in the build cache, so extending the date
+# range only reduces the new periods.
+import csv
+import datetime
+
+from portmap.incremental import file_digest
+from portmap.preprocess import load_geojson
+from portmap.zonal import ee_reduce_regions
+
+COLLECTION = 'COPERNICUS/S2_SR'
+# scenes over this cloud cover (%) are left out
+MAX_CLOUD = 30
+# SCL classes masked: saturated/defective (1), cloud shadows (3), clouds medium/high
+# probability (8, 9), thin cirrus (10), snow (11)
+MASKED_SCL = [1, 3, 8, 9, 10, 11]
+# zones reduction scale (meters)
+SCALE = 10
+# composite bands (true colors and indices)
+BANDS = ['B2', 'B3', 'B4', 'B8', 'B11']
+
+# [(start, end, label), ...] periods of 'months' months from start to end (ISO dates, end excluded)
+def periods(start, end, months=1):
+  start, end = datetime.date.fromisoformat(start), datetime.date.fromisoformat(end)
+  result = []
+  while start < end:
+    month = start.month - 1 + months
+    stop = min(datetime.date(start.year + month // 12, month % 12 + 1, 1), end)
+    result.append((start.isoformat(), stop.isoformat(), start.strftime('%Y-%m')))
+    start = stop
+  return result
+
+def mask_clouds(image):
+  clear = image.select('SCL').remap(MASKED_SCL, [0] * len(MASKED_SCL), 1)
+  return image.updateMask(clear).divide(10000)
+
+def _band(index, period):
+  return '{}_{}'.format(index, period[2].replace('-', '_'))
+
+class TimeSeries:
+
+  # aoi: ee.Geometry, periods: see periods(), cache: portmap.incremental.BuildCache
+  def __init__(self, aoi, periods, collection=COLLECTION, max_cloud=MAX_CLOUD, cache=None, scale=SCALE):
+    self.aoi = aoi
+    self.periods = periods
+    self.collection = collection
+    self.max_cloud = max_cloud
+    self.cache = cache
+    self.scale = scale
+
+  # ##### median composite of the cloud masked scenes of a period (masked bands: no scene)
+  def composite(self, period):
+    import ee
+    start, end, _ = period
+    scenes = ee.ImageCollection(self.collection) \
+      .filterBounds(self.aoi) \
+      .filterDate(start, end) \
+      .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', self.max_cloud)) \
+      .map(mask_clouds)
+    # (the median of an empty collection has no band to compute the indices from)
+    empty = ee.Image.constant([0] * len(BANDS)).rename(BANDS).toFloat().updateMask(0)
+    return ee.Image(ee.Algorithms.If(scenes.size().gt(0), scenes.median().select(BANDS), empty)) \
+      .clip(self.aoi)
+
+  def ndvi(self, period):
+    return self.composite(period).normalizedDifference(['B8', 'B4']).rename(_band('ndvi', period))
+
+  def ndwi(self, period):
+    return self.composite(period).normalizedDifference(['B3', 'B11']).rename(_band('ndwi', period))
+
+  # NDVI difference of a period since the baseline (negative: vegetation loss)
+  def ndvi_change(self, period, baseline=None):
+    baseline = baseline or self.periods[0]
+    return self.ndvi(period).subtract(self.ndvi(baseline)).rename('ndvi_change')
+
+  # ########## Per zone time series
+  def _key(self, period, zones):
+    return self.cache.key('timeseries', self.collection, self.max_cloud, MASKED_SCL, self.scale,
+                          self.aoi.serialize(), period, [[name, file_digest(path)] for name, path in zones.items()])
+
+  # periods over: still getting new scenes, never cached
+  @staticmethod
+  def _complete(period):
+    return datetime.date.fromisoformat(period[1]) <= datetime.date.today()
+
+  # values of the periods not in the cache: one reduction of all their bands over every zone
+  def _reduce(self, periods, zones):
+    import ee
+    image = ee.Image.cat([band for period in periods for band in (self.ndvi(period), self.ndwi(period))])
+    values = {period: {} for period in periods}
+    for name, path in zones.items():
+      features = load_geojson(path)['features']
+      for period in periods:
+        values[period][name] = [[None, None] for _ in features]
+      for i, properties in ee_reduce_regions(features, image, ee.Reducer.mean(), self.scale):
+        for period in periods:
+          values[period][name][i] = [properties.get(_band('ndvi', period)), properties.get(_band('ndwi', period))]
+    return values
+
+  # ##### zones: {layer name: GeoJSON file}, returns rows of (layer, zone, period, ndvi, ndwi)
+  def zone_series(self, zones):
+    cached, missing = {}, []
+    for period in self.periods:
+      entry = self.cache.read(self._key(period, zones)) if self.cache is not None and self.cache.enabled else None
+      if entry is None:
+        missing.append(period)
+      else:
+        cached[tuple(period)] = entry['values']
+    if missing:
+      for period, values in self._reduce(missing, zones).items():
+        cached[tuple(period)] = values
+        if self.cache is not None and self.cache.enabled and self._complete(period):
+          self.cache.write(self._key(period, zones), {'values': values})
+    rows = []
+    for name, path in zones.items():
+      features = load_geojson(path)['features']
+      for i, feature in enumerate(features):
+        zone = (feature.get('properties') or {}).get('name') or str(i)
+        for period in self.periods:
+          ndvi, ndwi = cached[tuple(period)][name][i]
+          rows.append({'layer': name, 'zone': zone, 'period': period[2],
+                       'ndvi': None if ndvi is None else round(ndvi, 3),
+                       'ndwi': None if ndwi is None else round(ndwi, 3)})
+    return rows, len(missing)
+
+def write_csv(rows, path):
+  with open(path, 'w', newline='', encoding='utf-8') as f:
+    writer = csv.DictWriter(f, fieldnames=['layer', 'zone', 'period', 'ndvi', 'ndwi'])
+    writer.writeheader()
+    writer.writerows(rows)
@@ -0,0 +1,291 @@
+# ########## TopoJSON output
+# Encoding a (preprocessed) GeoJSON FeatureCollection as a TopoJSON topology: coordinates
+# quantized on an integer grid, lines/rings cut into arcs at their junctions, each shared arc
+# (e.g. the border between two municipalities) stored once and referenced by both polygons,
+# and arcs delta-encoded. The layer is decoded back to GeoJSON in the browser by topojson-client.
+# Comparison with the inline GeoJSON for every layer: python -m portmap.topojson
+import gzip
+import json
+import time
+
+from folium.elements import JSCSSMixin
+from jinja2 import Template
+
+from portmap.geometry import TopologySimplifier, geometry_parts
+from portmap.styles import GEOJSON_LAYER, StyledGeoJson
+
+# quantization grid size: 1e5 steps over the layer extent (~0.3m over the AOI)
+QUANTIZATION = 100000
+
+_LINEAR = ('LineString', 'MultiLineString', 'Polygon', 'MultiPolygon')
+
+# geometries of a geometry: the members of a GeometryCollection (nested ones included), itself otherwise
+def _members(geometry):
+  if geometry['type'] == 'GeometryCollection':
+    return [member for g in geometry['geometries'] for member in _members(g)]
+  if geometry['type'] not in _LINEAR + ('Point', 'MultiPoint'):
+    raise ValueError('unsupported geometry type: {}'.format(geometry['type']))
+  return [geometry]
+
+# quantization grid over the extent of the layer (identity: a layer without any position)
+def _transform(features, quantization):
+  xs, ys = [], []
+  for feature in features:
+    geometry = feature.get('geometry')
+    if not geometry:
+      continue
+    for member in _members(geometry):
+      if member['type'] in ('Point', 'MultiPoint'):
+        lines = [[member['coordinates']] if member['type'] == 'Point' else member['coordinates']]
+      else:
+        lines = [line for part in geometry_parts(member) for line in part]
+      for line in lines:
+        xs.extend(p[0] for p in line)
+        ys.extend(p[1] for p in line)
+  if not xs:
+    return {'scale': [1, 1], 'translate': [0, 0]}
+  x0, y0, x1, y1 = min(xs), min(ys), max(xs), max(ys)
+  kx = (x1 - x0) / (quantization - 1) or 1
+  ky = (y1 - y0) / (quantization - 1) or 1
+  return {'scale': [kx, ky], 'translate': [x0, y0]}
+
+def _quantize(line, transform, closed):
+  (kx, ky), (x0, y0) = transform['scale'], transform['translate']
+  points = []
+  for p in line:
+    point = (int(round((p[0] - x0) / kx)), int(round((p[1] - y0) / ky)))
+    if not points or points[-1] != point:
+      points.append(point)
+  if closed and len(points) < 4:
+    # ring collapsing on the grid: keeping it as is (repeated positions included)
+    return [(int(round((p[0] - x0) / kx)), int(round((p[1] - y0) / ky))) for p in line]
+  return points
+
+class _ArcIndex:
+
+  def __init__(self):
+    self.junctions = TopologySimplifier(0)
+    self.arcs = []
+    self.index = {}
+
+  # arc id of a run of positions: a reversed shared arc is referenced as ~id (-id - 1)
+  def arc(self, points):
+    key = tuple(points)
+    if key in self.index:
+      return self.index[key]
+    reverse = key[::-1]
+    if reverse in self.index:
+      return ~self.index[reverse]
+    self.index[key] = len(self.arcs)
+    self.arcs.append(points)
+    return self.index[key]
+
+  def cut(self, line, closed):
+    if not closed:
+      cuts = [i for i, p in enumerate(line) if i == 0 or i == len(line) - 1 or self.junctions.is_junction(p)]
+    else:
+      ring = line[:-1]
+      cuts = [i for i, p in enumerate(ring) if self.junctions.is_junction(p)]
+      # free ring: starting from its smallest vertex so both sides of an identical ring match
+      start = cuts[0] if cuts else min(range(len(ring)), key=lambda i: ring[i])
+      cuts = [c - start for c in cuts] or [0]
+      line = ring[start:] + ring[:start] + [ring[start]]
+      cuts.append(len(line) - 1)
+    return [self.arc(line[start:end + 1]) for start, end in zip(cuts, cuts[1:]) if end > start]
+
+def _delta(arc):
+  encoded, x, y = [], 0, 0
+  for px, py in arc:
+    encoded.append([px - x, py - y])
+    x, y = px, py
+  return encoded
+
+# first pass: quantized lines/rings of a geometry, grouped by part (one list per member of a
+# GeometryCollection, None for points), registered to find the junctions
+def _register(geometry, transform, index):
+  kind = geometry['type']
+  if kind == 'GeometryCollection':
+    return [_register(g, transform, index) for g in geometry['geometries']]
+  if kind not in _LINEAR:
+    return None
+  closed = kind in ('Polygon', 'MultiPolygon')
+  parts = [[_quantize(line, transform, closed) for line in part] for part in geometry_parts(geometry)]
+  for part in parts:
+    for line in part:
+      index.junctions.register(line, closed)
+  return parts
+
+# second pass: topology geometry, lines/rings cut into shared arcs (a GeometryCollection holds
+# its encoded members, as read by topojson-client)
+def _encode(geometry, quantized, transform, index):
+  kind = geometry['type']
+  if kind == 'GeometryCollection':
+    return {'type': kind, 'geometries': [_encode(g, parts, transform, index)
+                                         for g, parts in zip(geometry['geometries'], quantized)]}
+  if kind in _LINEAR:
+    return _encode_geometry(geometry, quantized, index)
+  # points stay quantized (not delta-encoded)
+  points = [geometry['coordinates']] if kind == 'Point' else geometry['coordinates']
+  points = [list(_quantize([p], transform, False)[0]) for p in points]
+  return {'type': kind, 'coordinates': points[0] if kind == 'Point' else points}
+
+def _encode_geometry(geometry, quantized, index):
+  kind = geometry['type']
+  if kind == 'LineString':
+    arcs = index.cut(quantized[0][0], False)
+  elif kind == 'MultiLineString':
+    arcs = [index.cut(line, False) for line in quantized[0]]
+  elif kind == 'Polygon':
+    arcs = [index.cut(ring, True) for ring in quantized[0]]
+  else:
+    arcs = [[index.cut(ring, True) for ring in part] for part in quantized]
+  return {'type': kind, 'arcs': arcs}
+
+# ##### data: FeatureCollection dict, name: object name in the topology
+def topology(data, name, quantization=QUANTIZATION):
+  features = data['features']
+  transform = _transform(features, quantization)
+  index = _ArcIndex()
+  quantized = []
+  # first pass: quantizing every line/ring and registering it to find the junctions
+  for feature in features:
+    geometry = feature.get('geometry')
+    quantized.append(_register(geometry, transform, index) if geometry else None)
+  # second pass: cutting the lines/rings into shared arcs
+  geometries = []
+  for feature, parts in zip(features, quantized):
+    geometry = feature.get('geometry')
+    encoded = _encode(geometry, parts, transform, index) if geometry else {'type': None}
+    if feature.get('properties') is not None:
+      encoded['properties'] = feature['properties']
+    if 'id' in feature:
+      encoded['id'] = feature['id']
+    geometries.append(encoded)
+  return {
+    'type': 'Topology',
+    'transform': transform,
+    'objects': {name: {'type': 'GeometryCollection', 'geometries': geometries}},
+    'arcs': [_delta(arc) for arc in index.arcs]
+  }
+
+#################### DECODING ####################
+
+def _decode_arcs(topology):
+  (kx, ky), (x0, y0) = topology['transform']['scale'], topology['transform']['translate']
+  arcs = []
+  for arc in topology['arcs']:
+    x = y = 0
+    positions = []
+    for dx, dy in arc:
+      x += dx
+      y += dy
+      positions.append([x * kx + x0, y * ky + y0])
+    arcs.append(positions)
+  return arcs
+
+def _line(arcs, ids):
+  line = []
+  for i in ids:
+    arc = arcs[i] if i >= 0 else arcs[~i][::-1]
+    line.extend(arc if not line else arc[1:])
+  return line
+
+def _decode_geometry(geometry, arcs, transform):
+  (kx, ky), (x0, y0) = transform['scale'], transform['translate']
+  kind = geometry['type']
+  if kind == 'GeometryCollection':
+    return {'type': kind, 'geometries': [_decode_geometry(g, arcs, transform) for g in geometry['geometries']]}
+  if kind == 'LineString':
+    coordinates = _line(arcs, geometry['arcs'])
+  elif kind in ('MultiLineString', 'Polygon'):
+    coordinates = [_line(arcs, ids) for ids in geometry['arcs']]
+  elif kind == 'MultiPolygon':
+    coordinates = [[_line(arcs, ids) for ids in part] for part in geometry['arcs']]
+  elif kind == 'Point':
+    coordinates = [geometry['coordinates'][0] * kx + x0, geometry['coordinates'][1] * ky + y0]
+  else:
+    coordinates = [[p[0] * kx + x0, p[1] * ky + y0] for p in geometry['coordinates']]
+  return {'type': kind, 'coordinates': coordinates}
+
+# ##### topology object back to a GeoJSON FeatureCollection (same as topojson-client's feature())
+def to_geojson(topology, name):
+  arcs = _decode_arcs(topology)
+  features = []
+  for geometry in topology['objects'][name]['geometries']:
+    feature = {'type': 'Feature', 'properties': geometry.get('properties', {}),
+               'geometry': _decode_geometry(geometry, arcs, topology['transform']) if geometry['type'] else None}
+    if 'id' in geometry:
+      feature['id'] = geometry['id']
+    features.append(feature)
+  return {'type': 'FeatureCollection', 'features': features}
+
+#################### MAP LAYER ####################
+
+class TopoGeoJson(JSCSSMixin, StyledGeoJson):
+  _template = Template(GEOJSON_LAYER + u"""
+    {% macro script(this, kwargs) %}
+    {{ geojson_layer(this) }}
+    var {{ this.get_name() }}_topology = {{ this.topology|tojson }};
+    {{ this.get_name() }}
+      .addData(topojson.feature({{ this.get_name() }}_topology, {{ this.get_name() }}_topology.objects[{{ this.object_name|tojson }}]))
+      .addTo({{ this._parent.get_name() }});
+    {% endmacro %}
+    """)
+
+  default_js = [
+    ('topojson_client', 'https://unpkg.com/topojson-client@3.1.0/dist/topojson-client.min.js')
+  ]
+
+  # data: FeatureCollection dict (kept for the tooltip fields), embedded in the page as a topology
+  def __init__(self, data, name=None, quantization=QUANTIZATION, **kwargs):
+    super(TopoGeoJson, self).__init__(data, name=name, **kwargs)
+    self._name = 'TopoGeoJson'
+    self.object_name = 'layer'
+    self.topology = topology(self.data, self.object_name, quantization)
+
+#################### COMPARISON ####################
+
+def _dumps(data):
+  return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+def _parse_time(payload, decode=None, repeat=5):
+  started = time.perf_counter()
+  for _ in range(repeat):
+    data = json.loads(payload)
+    if decode:
+      decode(data)
+  return (time.perf_counter() - started) / repeat
+
+# size (raw and gzip) and parse time (json + topology decoding) of a layer in both formats
+def compare(data, layer):
+  geojson = _dumps(data)
+  topo = _dumps(topology(data, 'layer'))
+  return {
+    'layer': layer,
+    'geojson': {'bytes': len(geojson), 'gzip': len(gzip.compress(geojson)), 'parse': _parse_time(geojson)},
+    'topojson': {'bytes': len(topo), 'gzip': len(gzip.compress(topo)),
+                 'parse': _parse_time(topo, lambda t: to_geojson(t, 'layer'))}
+  }
+
+def comparison_report(rows):
+  lines = ['{:<48} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9}'.format(
+    'layer', 'geo KB', 'topo KB', 'geo gz', 'topo gz', 'geo ms', 'topo ms')]
+  for row in rows:
+    geo, topo = row['geojson'], row['topojson']
+    lines.append('{:<48} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.2f} {:>9.2f}'.format(
+      row['layer'], geo['bytes'] / 1024, topo['bytes'] / 1024, geo['gzip'] / 1024, topo['gzip'] / 1024,
+      geo['parse'] * 1000, topo['parse'] * 1000))
+  return '\n'.join(lines)
+
+# comparing the preprocessed layers of the registry (parse times measured in python: relative only)
+if __name__ == '__main__':
+  import glob
+  import sys
+  from portmap.preprocess import preprocess_layer
+
+  paths = sys.argv[1:] or sorted(glob.glob('layers/*.geojson'))
+  rows = []
+  for path in paths:
+    data, _ = preprocess_layer(path, tolerance=0.00002)
+    rows.append(compare(data, path))
+  print(comparison_report(rows))
@@ -0,0 +1,212 @@
+# ########## Build tracing
+# Spans around the build stages and layers (ee initialization, map id requests, layer file
+# reads, folium rendering, saving...) with their duration and counters (bytes read/written,
+# features, ee requests). Spans are written as they end to a structured log (one JSON object per
+# line) and optionally as a Chrome trace (chrome://tracing, https://ui.perfetto.dev) showing the
+# layers prepared concurrently on their threads.
+# Disabled by default: span() then returns a shared no-op object and count() returns right away,
+# so the instrumented code costs a function call and a flag check per span.
+#   with trace.span('read', path=layer.path):
+#     ...
+#     trace.count('bytes_read', size)
+# The whole build can also be profiled (Profiler, profiling(): cProfile and/or tracemalloc).
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+TRACE_DIR = os.path.join('.cache', 'trace')
+
+class _NoSpan:
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    return False
+
+_NO_SPAN = _NoSpan()
+
+class _Span:
+
+  def __init__(self, tracer, name, args):
+    self.tracer = tracer
+    self.name = name
+    self.args = args
+    self.counters = {}
+
+  def __enter__(self):
+    self.tracer._stack().append(self)
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, *exc):
+    end = time.perf_counter()
+    self.tracer._stack().pop()
+    self.tracer._end(self, end, exc[0])
+    return False
+
+class Tracer:
+
+  def __init__(self):
+    self.enabled = False
+    self.events = []
+    self.totals = {}
+    self.log = None
+    self.chrome = None
+    self._local = threading.local()
+    self._lock = threading.Lock()
+    self._origin = time.perf_counter()
+
+  # log: structured log path (JSON lines), chrome: Chrome trace path written by stop() (None: none)
+  def start(self, log=os.path.join(TRACE_DIR, 'build.jsonl'), chrome=None):
+    for path in (log, chrome):
+      if path:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    self.log = open(log, 'w', encoding='utf-8') if log else None
+    self.chrome = chrome
+    self.events = []
+    self.totals = {}
+    self._origin = time.perf_counter()
+    self.enabled = True
+
+  def _stack(self):
+    stack = getattr(self._local, 'stack', None)
+    if stack is None:
+      stack = self._local.stack = []
+    return stack
+
+  def _end(self, span, end, error):
+    event = {
+      'name': span.name,
+      'start': round(span.start - self._origin, 6),
+      'seconds': round(end - span.start, 6),
+      'thread': threading.current_thread().name,
+      'depth': len(self._stack())
+    }
+    event.update(span.args)
+    event.update(span.counters)
+    if error is not None:
+      event['error'] = error.__name__
+    with self._lock:
+      self.events.append(event)
+      for name, value in span.counters.items():
+        self.totals[name] = self.totals.get(name, 0) + value
+      if self.log is not None:
+        self.log.write(json.dumps(event, default=str) + '\n')
+        self.log.flush()
+
+  def span(self, name, args):
+    return _Span(self, name, args)
+
+  # adding to a counter of the innermost open span of the thread (or to the totals)
+  def count(self, name, value):
+    stack = self._stack()
+    if stack:
+      stack[-1].counters[name] = stack[-1].counters.get(name, 0) + value
+    else:
+      with self._lock:
+        self.totals[name] = self.totals.get(name, 0) + value
+
+  def chrome_trace(self):
+    threads = {}
+    events = []
+    for event in self.events:
+      tid = threads.setdefault(event['thread'], len(threads) + 1)
+      args = {key: value for key, value in event.items() if key not in ('name', 'start', 'seconds', 'thread', 'depth')}
+      events.append({'name': event['name'], 'cat': 'build', 'ph': 'X', 'pid': 1, 'tid': tid,
+                     'ts': round(event['start'] * 1e6, 1), 'dur': round(event['seconds'] * 1e6, 1), 'args': args})
+    for thread, tid in threads.items():
+      events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': {'name': thread}})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+  # closing the log, writing the Chrome trace, returns the summary
+  def stop(self):
+    if not self.enabled:
+      return ''
+    self.enabled = False
+    if self.log is not None:
+      self.log.close()
+      self.log = None
+    if self.chrome:
+      with open(self.chrome, 'w', encoding='utf-8') as f:
+        json.dump(self.chrome_trace(), f, default=str)
+    return self.report()
+
+  # slowest top level spans and the counters totals
+  def report(self, top=15):
+    events = sorted([event for event in self.events if event['depth'] == 0], key=lambda event: -event['seconds'])
+    lines = ['{:<56} {:>7.2f}s'.format('{} {}'.format(event['name'], event.get('layer') or event.get('path') or ''),
+                                       event['seconds']) for event in events[:top]]
+    lines.append(', '.join('{}: {}'.format(name, value) for name, value in sorted(self.totals.items())))
+    return '\n'.join(lines)
+
+TRACER = Tracer()
+
+# ##### span context manager (no-op when tracing is off), args: values written with the span
+def span(name, **args):
+  if not TRACER.enabled:
+    return _NO_SPAN
+  return TRACER.span(name, args)
+
+def count(name, value=1):
+  if TRACER.enabled:
+    TRACER.count(name, value)
+
+def start(log=os.path.join(TRACE_DIR, 'build.jsonl'), chrome=None):
+  TRACER.start(log, chrome)
+
+def stop():
+  return TRACER.stop()
+
+# ##### whole build profiling: cpu (cProfile, stats written to <output_dir>/build.prof and the
+# top functions printed) and/or memory (tracemalloc, peak and top allocation lines printed)
+# cProfile only sees the main thread: the layers prepared in the pool threads are timed by
+# their trace spans
+class Profiler:
+
+  def __init__(self, cpu=False, memory=False, output_dir=TRACE_DIR, top=20):
+    self.cpu = cpu
+    self.memory = memory
+    self.output_dir = output_dir
+    self.top = top
+    self.profiler = None
+
+  def start(self):
+    if self.memory:
+      import tracemalloc
+      tracemalloc.start()
+    if self.cpu:
+      import cProfile
+      self.profiler = cProfile.Profile()
+      self.profiler.enable()
+
+  def stop(self):
+    if self.profiler is not None:
+      import pstats
+      self.profiler.disable()
+      os.makedirs(self.output_dir, exist_ok=True)
+      path = os.path.join(self.output_dir, 'build.prof')
+      self.profiler.dump_stats(path)
+      print('cProfile stats written to {} (python -m pstats {})'.format(path, path))
+      pstats.Stats(self.profiler).sort_stats('cumulative').print_stats(self.top)
+      self.profiler = None
+    if self.memory:
+      import tracemalloc
+      if tracemalloc.is_tracing():
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print('tracemalloc: {:.1f} MB allocated, {:.1f} MB peak'.format(current / 1048576, peak / 1048576))
+        for stat in snapshot.statistics('lineno')[:self.top]:
+          print(stat)
+
+@contextmanager
+def profiling(cpu=False, memory=False, output_dir=TRACE_DIR, top=20):
+  profiler = Profiler(cpu, memory, output_dir, top)
+  profiler.start()
+  try:
+    yield profiler
+  finally:
+    profiler.stop()
@@ -0,0 +1,199 @@
+# ########## Encoded value tiles
+# The raster layers are colorized PNG tiles: the NDVI, NDWI, elevation or slope value under the
+# cursor can't be read from them. With value tiles, a raster layer is exported as PNG tiles
+# holding the values themselves, quantized to 16 bits over a fixed range and packed into the red
+# (high byte) and green (low byte) channels, alpha 0 where there is no data:
+#   value = min + (red * 256 + green) * (max - min) / 65535
+# The browser decodes each tile once into a Float32Array, colors it with the layer palette
+# (Earth Engine vis_params: min, max, palette) on a canvas, and reads the value under the cursor
+# from the decoded tiles: the readout needs no request and changing the palette only repaints
+# the tiles already loaded:
+#   portmapValues.layers['NDVI'].setPalette({min: 0.2, max: 0.8, palette: ['#ffffe5', '#005a32']})
+# Tiles are rendered from the local raster products (portmap.raster) or fetched from an encoded
+# Earth Engine image over the AOI (portmap.ee_tiles cache); they are read back from a canvas, so
+# the map has to be served over http (python webmap.py serve).
+import numpy as np
+from branca.element import Element, Figure
+from folium.map import Layer
+from jinja2 import Template
+
+from portmap.registry import TOOLTIP_STYLE
+
+LEVELS = 65535
+# visual parameters of the encoded Earth Engine image (bytes drawn as they are)
+ENCODED_VIS = {'bands': ['r', 'g', 'b'], 'min': 0, 'max': 255}
+
+# ##### (1, n) float values (NaN: no data) -> (n, 4) RGBA bytes
+def encode_values(values, low, high):
+  values = values[0]
+  valid = np.isfinite(values)
+  scaled = np.clip((np.nan_to_num(values) - low) / float(high - low), 0, 1)
+  quantized = np.where(valid, np.round(scaled * LEVELS), 0).astype(np.uint16)
+  rgba = np.zeros((values.shape[0], 4), dtype=np.uint8)
+  rgba[:, 0] = quantized >> 8
+  rgba[:, 1] = quantized & 255
+  rgba[:, 3] = valid * 255
+  return rgba
+
+# (n, 4) RGBA bytes -> n values (NaN: no data), as decoded in the browser
+def decode_values(rgba, low, high):
+  quantized = rgba[:, 0].astype(np.float64) * 256 + rgba[:, 1]
+  return np.where(rgba[:, 3] > 0, low + quantized * (high - low) / LEVELS, np.nan)
+
+# same encoding computed by Earth Engine (first band of the image, masked pixels left out)
+def ee_encoded(image, low, high):
+  import ee
+  value = image.select(0)
+  quantized = value.unitScale(low, high).clamp(0, 1).multiply(LEVELS).round().toUint16()
+  return ee.Image.cat([quantized.rightShift(8), quantized.bitwiseAnd(255), quantized.multiply(0)]) \
+    .rename(['r', 'g', 'b']) \
+    .updateMask(value.mask())
+
+# ##### value tiles decoder (one per page): value layers, palette lookup tables, readout control
+_ENGINE = u"""
+<style>.portmap-values { {{ style }} min-width: 120px; } .portmap-values:empty { display: none; }</style>
+<script>
+var portmapValues = (function() {
+  function hex(color) {
+    color = color.replace('#', '');
+    return [0, 2, 4].map(function(i) { return parseInt(color.substr(i, 2), 16); });
+  }
+  // 256 colors interpolated along the palette (like Earth Engine)
+  function lookup(palette) {
+    var colors = (palette || ['000000', 'ffffff']).map(hex), table = new Uint8Array(256 * 3);
+    for (var i = 0; i < 256; i++) {
+      var position = i / 255 * (colors.length - 1), index = Math.min(Math.floor(position), Math.max(colors.length - 2, 0));
+      var fraction = colors.length > 1 ? position - index : 0, next = colors[Math.min(index + 1, colors.length - 1)];
+      for (var c = 0; c < 3; c++) { table[i * 3 + c] = Math.round(colors[index][c] * (1 - fraction) + next[c] * fraction); }
+    }
+    return table;
+  }
+  var ValueLayer = L.GridLayer.extend({
+    initialize: function(url, options) {
+      this._url = url;
+      L.GridLayer.prototype.initialize.call(this, options);
+      this.setPalette(options.vis);
+    },
+    createTile: function(coords, done) {
+      var tile = L.DomUtil.create('canvas', 'leaflet-tile'), size = this.getTileSize(), layer = this;
+      tile.width = size.x;
+      tile.height = size.y;
+      var image = new Image();
+      image.crossOrigin = 'anonymous';
+      image.onload = function() {
+        var context = tile.getContext('2d');
+        context.drawImage(image, 0, 0);
+        var pixels = context.getImageData(0, 0, size.x, size.y).data, values = new Float32Array(size.x * size.y);
+        var low = layer.options.encoding.min, step = (layer.options.encoding.max - low) / 65535;
+        for (var i = 0; i < values.length; i++) {
+          values[i] = pixels[i * 4 + 3] ? low + (pixels[i * 4] * 256 + pixels[i * 4 + 1]) * step : NaN;
+        }
+        tile._values = values;
+        layer._paint(tile);
+        done(null, tile);
+      };
+      // tiles without data are not written
+      image.onerror = function() { done(null, tile); };
+      image.src = L.Util.template(this._url, coords);
+      return tile;
+    },
+    _paint: function(tile) {
+      if (!tile._values) { return; }
+      var context = tile.getContext('2d'), output = context.createImageData(tile.width, tile.height), data = output.data;
+      var vis = this.options.vis, low = vis.min, range = (vis.max - vis.min) || 1, table = this._table;
+      for (var i = 0; i < tile._values.length; i++) {
+        var value = tile._values[i];
+        if (value !== value) { continue; }
+        var index = Math.round(Math.min(Math.max((value - low) / range, 0), 1) * 255) * 3;
+        data[i * 4] = table[index];
+        data[i * 4 + 1] = table[index + 1];
+        data[i * 4 + 2] = table[index + 2];
+        data[i * 4 + 3] = 255;
+      }
+      context.putImageData(output, 0, 0);
+    },
+    // new min/max/palette: repainting the loaded tiles, nothing fetched
+    setPalette: function(vis) {
+      this.options.vis = L.extend({}, this.options.vis, vis);
+      this._table = lookup(this.options.vis.palette);
+      for (var key in this._tiles || {}) { this._paint(this._tiles[key].el); }
+      return this;
+    },
+    // decoded value at a position (undefined: no tile loaded there, NaN: no data)
+    valueAt: function(latlng) {
+      if (!this._map || this._tileZoom === undefined) { return undefined; }
+      var size = this.getTileSize(), point = this._map.project(latlng, this._tileZoom);
+      var coords = point.unscaleBy(size).floor();
+      coords.z = this._tileZoom;
+      var tile = this._tiles[this._tileCoordsToKey(coords)];
+      if (!tile || !tile.el._values) { return undefined; }
+      var x = Math.floor(point.x - coords.x * size.x), y = Math.floor(point.y - coords.y * size.y);
+      return tile.el._values[y * size.x + x];
+    }
+  });
+  var layers = {}, readouts = {};
+  // value of the topmost value layer shown under the cursor
+  function readout(map) {
+    var id = L.stamp(map);
+    if (readouts[id]) { return readouts[id]; }
+    var control = readouts[id] = L.control({position: 'bottomleft'});
+    control.layers = [];
+    control.onAdd = function() { return L.DomUtil.create('div', 'portmap-values'); };
+    control.addTo(map);
+    map.on('mousemove', function(e) {
+      var text = '';
+      for (var i = control.layers.length - 1; i >= 0 && !text; i--) {
+        var layer = control.layers[i], value = layer.valueAt(e.latlng);
+        if (map.hasLayer(layer) && value !== undefined && value === value) {
+          text = layer.options.label + ': ' + value.toFixed(layer.options.encoding.decimals) + (layer.options.encoding.unit || '');
+        }
+      }
+      control.getContainer().textContent = text;
+    });
+    map.on('mouseout', function() { control.getContainer().textContent = ''; });
+    return control;
+  }
+  return {
+    layers: layers,
+    layer: function(map, url, options) {
+      var layer = new ValueLayer(url, options);
+      layers[options.label] = layer;
+      readout(map).layers.push(layer);
+      return layer;
+    }
+  };
+})();
+</script>
+"""
+
+# ##### raster layer drawn from its value tiles (url: {z}/{x}/{y}.png template)
+# encoding: {'min': ..., 'max': ..., 'unit': ..., 'decimals': ...} (see RasterLayer.values),
+# vis_params: Earth Engine visual parameters of the layer (initial palette)
+class ValueTileLayer(Layer):
+  _template = Template(u"""
+    {% macro script(this, kwargs) %}
+    var {{ this.get_name() }} = portmapValues.layer({{ this._parent.get_name() }}, {{ this.url|tojson }}, {{ this.options|tojson }});
+    {{ this.get_name() }}.addTo({{ this._parent.get_name() }});
+    {% endmacro %}
+    """)
+
+  def __init__(self, url, encoding, vis_params, name=None, overlay=True, control=True, show=True, min_native_zoom=None,
+               max_native_zoom=None, bounds=None):
+    super(ValueTileLayer, self).__init__(name=name, overlay=overlay, control=control, show=show)
+    self._name = 'ValueTileLayer'
+    self.url = url
+    self.options = {
+      'label': name,
+      'encoding': dict({'unit': '', 'decimals': 2}, **encoding),
+      'vis': {'min': vis_params.get('min', 0), 'max': vis_params.get('max', 1), 'palette': vis_params.get('palette')}
+    }
+    for key, value in (('minNativeZoom', min_native_zoom), ('maxNativeZoom', max_native_zoom), ('bounds', bounds)):
+      if value is not None:
+        self.options[key] = value
+
+  def render(self, **kwargs):
+    figure = self.get_root()
+    assert isinstance(figure, Figure), 'You cannot render this Element if it is not in a Figure.'
+    engine = Template(_ENGINE).render(style=TOOLTIP_STYLE)
+    figure.header.add_child(Element(engine), name='portmap_values')
+    super(ValueTileLayer, self).render(**kwargs)
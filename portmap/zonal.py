@@ -0,0 +1,242 @@
+# ########## Zonal statistics
+# Statistics of the raster indices (NDVI, NDWI, slopes, elevation, classified NDVI...) over
+# every feature of a vector layer, written into the features properties (and so available to
+# the layer tooltip): count/mean/min/max/std of the pixels inside the feature, plus the pixel
+# counts in fixed bins when the raster has a histogram, and, for the classified rasters, the
+# hectares of each class.
+# - Earth Engine: one reduceRegions call per raster and batch of BATCH features (no per
+#   feature request, see ee_reduce_regions).
+# - local backend: the features are rasterized once on the product grid (one zone id per
+#   pixel, the last feature wins where features overlap) then every statistic is accumulated
+#   for all the zones at once with np.bincount, reading the product by strips of rows.
+import math
+
+import numpy as np
+
+try:
+  import rasterio
+  from rasterio.features import rasterize
+  from rasterio.warp import transform_geom
+  from rasterio.windows import Window
+except ImportError:
+  rasterio = None
+
+from portmap import trace
+from portmap.raster import BLOCK_ROWS, Grid, pixel_size
+
+# features per reduceRegions request
+BATCH = 2000
+# decimals of the statistics written in the properties
+DECIMALS = 3
+
+#################### EARTH ENGINE ####################
+
+def _ee_reducer(classes, histogram=None):
+  import ee
+  if classes is not None:
+    return ee.Reducer.frequencyHistogram().unweighted()
+  reducer = ee.Reducer.mean() \
+    .combine(ee.Reducer.minMax(), sharedInputs=True) \
+    .combine(ee.Reducer.stdDev(), sharedInputs=True) \
+    .combine(ee.Reducer.count(), sharedInputs=True)
+  if histogram is not None:
+    low, high, bins = histogram
+    reducer = reducer.combine(ee.Reducer.fixedHistogram(low, high, bins).unweighted(), sharedInputs=True)
+  return reducer
+
+# reduceRegions of an image over features (list of GeoJSON features) by batches of BATCH
+# features: yields (feature index, reduced properties) of every feature with a geometry
+def ee_reduce_regions(features, image, reducer, scale):
+  import ee
+  indices = [i for i, feature in enumerate(features) if feature.get('geometry')]
+  for start in range(0, len(indices), BATCH):
+    batch = indices[start:start + BATCH]
+    collection = ee.FeatureCollection([ee.Feature(ee.Geometry(features[i]['geometry'], 'EPSG:4326', False), {'zone': i})
+                                       for i in batch])
+    with trace.span('ee.reduceRegions', features=len(batch)):
+      trace.count('ee_requests')
+      reduced = image.reduceRegions(collection=collection, reducer=reducer, scale=scale).getInfo()
+    for feature in reduced['features']:
+      yield feature['properties']['zone'], feature['properties']
+
+# raw statistics of an ee.Image over features (list of GeoJSON features), None when no pixel:
+# {'count', 'mean', 'min', 'max', 'std'} (+ 'histogram': [pixels per bin] for a histogram
+# [min, max, bins]) or {'count', 'areas': {class value: square meters}}
+def ee_stats(features, image, scale, classes=None, histogram=None):
+  import ee
+  image = ee.Image(image).select([0], ['value'])
+  results = [None] * len(features)
+  for i, properties in ee_reduce_regions(features, image, _ee_reducer(classes, histogram), scale):
+    if classes is not None:
+      histogram = properties.get('histogram') or {}
+      if histogram:
+        counts = {int(float(value)): count for value, count in histogram.items()}
+        results[i] = {'count': int(sum(counts.values())),
+                      'areas': {value: count * scale * scale for value, count in counts.items()}}
+    elif properties.get('count'):
+      results[i] = {'count': int(properties['count']), 'mean': properties['mean'], 'min': properties['min'],
+                    'max': properties['max'], 'std': properties['stdDev']}
+      if histogram is not None:
+        # [[bin start, pixels], ...]
+        results[i]['histogram'] = [int(pixels) for _, pixels in properties.get('histogram') or []]
+  return results
+
+#################### LOCAL ####################
+
+def _require():
+  if rasterio is None:
+    raise ImportError('the local zonal statistics need rasterio: pip install rasterio')
+
+# zone id (feature index + 1, 0: outside every feature) of each pixel of a dataset grid
+def zones_raster(features, dataset):
+  shapes = [(transform_geom('EPSG:4326', dataset.crs, feature['geometry']), i + 1)
+            for i, feature in enumerate(features) if feature.get('geometry')]
+  if not shapes:
+    return np.zeros((dataset.height, dataset.width), dtype=np.int32)
+  return rasterize(shapes, out_shape=(dataset.height, dataset.width), transform=dataset.transform,
+                   fill=0, dtype='int32')
+
+# same raw statistics as ee_stats from a single band GeoTIFF (NaN: no data); zones rasters
+# are reused between the products sharing a grid through the 'zones' dict
+def local_stats(features, path, classes=None, zones=None, block_rows=BLOCK_ROWS, histogram=None):
+  _require()
+  zones = {} if zones is None else zones
+  n = len(features) + 1
+  count = np.zeros(n, dtype=np.int64)
+  total = np.zeros(n)
+  squares = np.zeros(n)
+  low = np.full(n, np.inf)
+  high = np.full(n, -np.inf)
+  areas = {}
+  if histogram is not None:
+    bin_low, bin_high, bins = histogram
+    pixels = np.zeros(n * bins, dtype=np.int64)
+  with rasterio.open(path) as dataset:
+    key = (str(dataset.crs), tuple(dataset.transform), dataset.width, dataset.height)
+    if key not in zones:
+      zones[key] = zones_raster(features, dataset)
+    grid = Grid(dataset.crs, dataset.transform, dataset.width, dataset.height)
+    for start in range(0, grid.height, block_rows):
+      stop = min(start + block_rows, grid.height)
+      values = dataset.read(1, window=Window(0, start, grid.width, stop - start)).astype(np.float64)
+      strip = zones[key][start:stop]
+      valid = (strip > 0) & ~np.isnan(values)
+      ids, values = strip[valid], values[valid]
+      count += np.bincount(ids, minlength=n)
+      if classes is not None:
+        dx, dy = pixel_size(grid, start, stop)
+        weights = np.broadcast_to((dx * dy).reshape(-1, 1), strip.shape)[valid]
+        codes = ids.astype(np.int64) * (len(classes.classes) + 1) + values.astype(np.int64)
+        sums = np.bincount(codes, weights=weights)
+        for code in np.flatnonzero(sums):
+          zone, value = divmod(int(code), len(classes.classes) + 1)
+          areas.setdefault(zone, {})
+          areas[zone][value] = areas[zone].get(value, 0.0) + float(sums[code])
+        continue
+      total += np.bincount(ids, weights=values, minlength=n)
+      squares += np.bincount(ids, weights=values * values, minlength=n)
+      np.minimum.at(low, ids, values)
+      np.maximum.at(high, ids, values)
+      if histogram is not None:
+        # bin of each pixel (zone major), the values outside [min, max) left out like Earth Engine
+        positions = np.floor((values - bin_low) / (bin_high - bin_low) * bins)
+        inside = (positions >= 0) & (positions < bins)
+        pixels += np.bincount(ids[inside].astype(np.int64) * bins + positions[inside].astype(np.int64),
+                              minlength=n * bins)
+  results = []
+  for zone in range(1, n):
+    if not count[zone]:
+      results.append(None)
+    elif classes is not None:
+      results.append({'count': int(count[zone]), 'areas': areas.get(zone, {})})
+    else:
+      mean = total[zone] / count[zone]
+      results.append({'count': int(count[zone]), 'mean': mean, 'min': low[zone], 'max': high[zone],
+                      'std': math.sqrt(max(squares[zone] / count[zone] - mean * mean, 0.0))})
+      if histogram is not None:
+        results[-1]['histogram'] = [int(value) for value in pixels[zone * bins:(zone + 1) * bins]]
+  return results
+
+#################### PROPERTIES ####################
+
+# feature properties of the raw statistics of a raster: <name>_count, <name>_mean, ... (and
+# <name>_hist: pixels per bin, for a raster with a histogram) or, for a classified raster,
+# <name>_count, <name>_class (main class) and <name>_ha ('label: x ha, ...')
+def stats_properties(name, stats, classes=None, histogram=None):
+  if stats is None:
+    keys = ('count', 'class', 'ha') if classes is not None else ('count', 'mean', 'min', 'max', 'std')
+    if classes is None and histogram is not None:
+      keys += ('hist',)
+    return dict({'{}_{}'.format(name, key): None for key in keys}, **{'{}_count'.format(name): 0})
+  if classes is not None:
+    areas = sorted(stats['areas'].items(), key=lambda item: -item[1])
+    labels = {value: label for value, label in enumerate(classes.labels, 1)}
+    return {
+      '{}_count'.format(name): stats['count'],
+      '{}_class'.format(name): labels.get(areas[0][0]) if areas else None,
+      '{}_ha'.format(name): ', '.join('{}: {:.2f} ha'.format(labels.get(value, value), area / 10000)
+                                      for value, area in areas)
+    }
+  properties = {'{}_count'.format(name): stats['count']}
+  for key in ('mean', 'min', 'max', 'std'):
+    properties['{}_{}'.format(name, key)] = round(float(stats[key]), DECIMALS)
+  if histogram is not None:
+    properties['{}_hist'.format(name)] = stats['histogram']
+  return properties
+
+# tooltip fields and aliases of the zonal statistics of a layer
+def tooltip_fields(rasters, names):
+  fields, aliases = [], []
+  for name in names:
+    raster = rasters[name]
+    if raster.classes is not None:
+      fields += ['{}_class'.format(name), '{}_ha'.format(name)]
+      aliases += ['{} (main class): '.format(raster.label), '{}: '.format(raster.label)]
+    else:
+      fields.append('{}_mean'.format(name))
+      aliases.append('{} (mean): '.format(raster.label))
+  return fields, aliases
+
+#################### ENGINE ####################
+
+# rasters: {name: portmap.registry.ZonalRaster}, local_engine: portmap.raster.LocalEngine for
+# the local backend (None: Earth Engine)
+class ZonalStats:
+
+  def __init__(self, rasters, local_engine=None):
+    self.rasters = rasters
+    self.local_engine = local_engine
+
+  # inputs state of the rasters (for the build cache)
+  def fingerprint(self, names):
+    from portmap.ee_cache import cache_key
+    state = []
+    for name in names:
+      raster = self.rasters[name]
+      if self.local_engine is not None:
+        state.append([name, self.local_engine.fingerprint(raster.local), repr(raster.classes), raster.histogram])
+      else:
+        state.append([name, cache_key(raster.image, {'scale': raster.scale}), repr(raster.classes), raster.histogram])
+    return state
+
+  # statistics properties of every feature of data (FeatureCollection dict) for the rasters names
+  def compute(self, data, names):
+    features = data['features']
+    properties = [{} for _ in features]
+    zones = {}
+    for name in names:
+      raster = self.rasters[name]
+      if self.local_engine is not None:
+        stats = local_stats(features, self.local_engine.product(raster.local), raster.classes, zones,
+                            self.local_engine.block_rows, raster.histogram)
+      else:
+        stats = ee_stats(features, raster.image, raster.scale, raster.classes, raster.histogram)
+      for feature_properties, feature_stats in zip(properties, stats):
+        feature_properties.update(stats_properties(name, feature_stats, raster.classes, raster.histogram))
+    return properties
+
+# writing the statistics properties into the features
+def apply(data, properties):
+  for feature, values in zip(data['features'], properties):
+    feature['properties'] = dict(feature.get('properties') or {}, **values)
+  return data
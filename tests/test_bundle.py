@@ -0,0 +1,48 @@
+import math
+import os
+import re
+
+import folium
+
+from portmap.bundle import DATA_GLOBAL, Bundle
+from portmap.lod import LodGeoJson, variants
+
+# zones with jagged borders: every level of detail is still over the data threshold
+def _layer(lon, lat, zones=40, sides=200):
+  features = []
+  for zone in range(zones):
+    x, y = lon + 0.02 * (zone % 8), lat + 0.02 * (zone // 8)
+    ring = [[round(x + 0.008 * (1 + 0.3 * (i % 3)) * math.cos(2 * math.pi * i / sides), 6),
+             round(y + 0.008 * (1 + 0.3 * (i % 3)) * math.sin(2 * math.pi * i / sides), 6)] for i in range(sides)]
+    features.append({'type': 'Feature', 'properties': {'name': 'zone {}'.format(zone)},
+                     'geometry': {'type': 'Polygon', 'coordinates': [ring + [ring[0]]]}})
+  return {'type': 'FeatureCollection', 'features': features}
+
+def _bundle(tmp_path, m):
+  bundle = Bundle(str(tmp_path / 'dist'), str(tmp_path / 'vendor'), root=str(tmp_path), download=False)
+  bundle.build(m.get_root().render())
+  script = ''
+  for name, entry in bundle.assets.items():
+    if entry['kind'] == 'script':
+      with open(os.path.join(str(tmp_path / 'dist'), 'assets', name), encoding='utf-8') as f:
+        script += f.read()
+  return script, [name for name, entry in bundle.assets.items() if entry['kind'] == 'data']
+
+def test_layers_data_moved_to_assets(tmp_path):
+  m = folium.Map(location=[36.58, 2.31])
+  folium.GeoJson(_layer(2.31, 36.58)).add_to(m)
+  script, data = _bundle(tmp_path, m)
+  assert len(data) == 1
+  assert 'FeatureCollection' not in script and DATA_GLOBAL in script
+
+def test_levels_of_detail_variants_moved_to_assets(tmp_path):
+  m = folium.Map(location=[36.58, 2.31])
+  for topojson, lon in ((False, 2.31), (True, 2.5)):
+    data = _layer(lon, 36.58)
+    LodGeoJson(data, variants(data, [10, 12, 14]), name='layer {}'.format(lon), topojson=topojson,
+               style={'color': 'red'}).add_to(m)
+  script, data = _bundle(tmp_path, m)
+  # every variant of both layers, the script only referencing them
+  assert len(data) == 6
+  assert 'FeatureCollection' not in script and 'Topology' not in script
+  assert len(re.findall(DATA_GLOBAL + r'\["\w+"\]', script)) == 6
@@ -0,0 +1,24 @@
+import folium
+
+from portmap.canvas import HoverIndex, filled
+from portmap.styles import StyledGeoJson
+
+SQUARE = {'type': 'FeatureCollection', 'features': [
+  {'type': 'Feature', 'properties': {}, 'geometry': {'type': 'Polygon', 'coordinates': [[[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]]}}
+]}
+
+def test_filled():
+  assert filled({'fillColor': '#555555', 'fillOpacity': 0.1})
+  assert filled({'color': 'red'})
+  assert not filled({'fillColor': 'none', 'color': 'red'})
+  assert not filled({'fillColor': '#555555', 'fillOpacity': 0})
+  assert not filled({'fill': False})
+
+def test_fill_state_passed_to_the_hover_engine():
+  m = folium.Map()
+  layer = StyledGeoJson(SQUARE, style={'fillColor': 'none'}, renderer='canvas')
+  layer.add_child(HoverIndex(SQUARE, filled=False))
+  layer.add_to(m)
+  html = m.get_root().render()
+  assert 'portmapHover.add(' in html
+  assert html.split('portmapHover.add(')[-1].split(');')[0].rstrip().endswith('false')
@@ -0,0 +1,138 @@
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from portmap import ee_tiles
+
+BOUNDS = [2.25, 36.55, 2.37, 36.61]
+
+# stand-in tile server: a tile's body is its z/x/y, the first request of the paths in 'flaky'
+# answers 503, the paths in 'missing' 404
+class StandIn:
+
+  def __init__(self):
+    self.requests = []
+    self.flaky = set()
+    self.missing = set()
+    stand_in = self
+
+    class Handler(BaseHTTPRequestHandler):
+
+      def do_GET(self):
+        path = self.path.lstrip('/')
+        stand_in.requests.append(path)
+        if path in stand_in.missing:
+          self.send_error(404)
+          return
+        if path in stand_in.flaky:
+          stand_in.flaky.discard(path)
+          self.send_error(503)
+          return
+        body = path[:-len('.png')].encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      def log_message(self, *args):
+        pass
+
+    self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    self.url_format = 'http://127.0.0.1:{}/{{z}}/{{x}}/{{y}}.png'.format(self.server.server_address[1])
+
+def _serve(server):
+  thread = threading.Thread(target=server.serve_forever, daemon=True)
+  thread.start()
+  return server
+
+@pytest.fixture
+def stand_in(monkeypatch):
+  monkeypatch.setattr(ee_tiles.time, 'sleep', lambda seconds: None)
+  server = StandIn()
+  _serve(server.server)
+  yield server
+  server.server.shutdown()
+  server.server.server_close()
+
+def _read(path):
+  with open(path, 'rb') as f:
+    return f.read()
+
+def test_fetch_tile_retries_server_errors(stand_in):
+  stand_in.flaky.add('10/518/397.png')
+  assert ee_tiles.fetch_tile(ee_tiles.tile_url(stand_in.url_format, 10, 518, 397)) == b'10/518/397'
+  assert stand_in.requests == ['10/518/397.png', '10/518/397.png']
+
+def test_fetch_tile_does_not_retry_client_errors(stand_in):
+  stand_in.missing.add('10/518/397.png')
+  with pytest.raises(urllib.error.HTTPError):
+    ee_tiles.fetch_tile(ee_tiles.tile_url(stand_in.url_format, 10, 518, 397))
+  assert len(stand_in.requests) == 1
+
+@pytest.mark.parametrize('tiles_format', ['xyz', 'mbtiles'])
+def test_cache_tiles(stand_in, tmp_path, tiles_format):
+  root = str(tmp_path)
+  tiles = ee_tiles.tile_coordinates(BOUNDS, 10, 12)
+  stand_in.flaky.add('{}/{}/{}.png'.format(*tiles[0]))
+  stand_in.missing.add('{}/{}/{}.png'.format(*tiles[-1]))
+  assert not ee_tiles.is_cached(root, 'ndvi', tiles_format, BOUNDS, 10, 12)
+
+  stats = ee_tiles.cache_tiles(stand_in.url_format, root, 'ndvi', BOUNDS, 10, 12, tiles_format, workers=4)
+  assert (stats['fetched'], stats['cached'], stats['failed']) == (len(tiles) - 1, 0, 1)
+  assert not ee_tiles.is_cached(root, 'ndvi', tiles_format, BOUNDS, 10, 12)
+
+  # only the missing tile is requested again
+  stand_in.missing.clear()
+  stand_in.requests.clear()
+  stats = ee_tiles.cache_tiles(stand_in.url_format, root, 'ndvi', BOUNDS, 10, 12, tiles_format, workers=4)
+  assert (stats['fetched'], stats['cached'], stats['failed']) == (1, len(tiles) - 1, 0)
+  assert stand_in.requests == ['{}/{}/{}.png'.format(*tiles[-1])]
+  assert ee_tiles.is_cached(root, 'ndvi', tiles_format, BOUNDS, 10, 12)
+
+  z, x, y = tiles[0]
+  if tiles_format == 'mbtiles':
+    assert ee_tiles.read_mbtiles_tile(str(tmp_path / 'ndvi.mbtiles'), z, x, y) == '{}/{}/{}'.format(z, x, y).encode()
+  else:
+    assert _read(str(tmp_path / 'ndvi' / str(z) / str(x) / '{}.png'.format(y))) == '{}/{}/{}'.format(z, x, y).encode()
+
+@pytest.mark.parametrize('tiles_format', ['xyz', 'mbtiles'])
+def test_cache_tiles_stamp(stand_in, tmp_path, tiles_format):
+  root = str(tmp_path)
+  tiles = ee_tiles.tile_coordinates(BOUNDS, 10, 11)
+  ee_tiles.cache_tiles(stand_in.url_format, root, 'ndvi', BOUNDS, 10, 11, tiles_format, stamp='first')
+  assert ee_tiles.is_cached(root, 'ndvi', tiles_format, BOUNDS, 10, 11, stamp='first')
+  assert not ee_tiles.is_cached(root, 'ndvi', tiles_format, BOUNDS, 10, 11, stamp='second')
+
+  # the same stamp reuses the tiles, a new one fetches them all again
+  stand_in.requests.clear()
+  stats = ee_tiles.cache_tiles(stand_in.url_format, root, 'ndvi', BOUNDS, 10, 11, tiles_format, stamp='first')
+  assert (stats['fetched'], stats['cached']) == (0, len(tiles))
+  stats = ee_tiles.cache_tiles(stand_in.url_format, root, 'ndvi', BOUNDS, 10, 11, tiles_format, stamp='second')
+  assert (stats['fetched'], stats['cached']) == (len(tiles), 0)
+  assert len(stand_in.requests) == len(tiles)
+  assert ee_tiles.is_cached(root, 'ndvi', tiles_format, BOUNDS, 10, 11, stamp='second')
+  if tiles_format == 'xyz':
+    assert not list(tmp_path.glob('ndvi/**/*.tmp'))
+
+def test_serve_mbtiles(stand_in, tmp_path):
+  root = tmp_path / 'tiles'
+  ee_tiles.cache_tiles(stand_in.url_format, str(root), 'ndvi', BOUNDS, 10, 10, 'mbtiles')
+  (tmp_path / 'webmap.html').write_text('<html></html>')
+  server = _serve(ThreadingHTTPServer(('127.0.0.1', 0), ee_tiles.make_handler(str(tmp_path))))
+  base = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+  try:
+    z, x, y = ee_tiles.tile_coordinates(BOUNDS, 10, 10)[0]
+    with urllib.request.urlopen(base + 'tiles/ndvi/{}/{}/{}.png'.format(z, x, y)) as response:
+      assert response.headers['Content-Type'] == 'image/png'
+      assert response.read() == '{}/{}/{}'.format(z, x, y).encode()
+    with pytest.raises(urllib.error.HTTPError) as error:
+      urllib.request.urlopen(base + 'tiles/ndvi/{}/0/0.png'.format(z))
+    assert error.value.code == 404
+    with urllib.request.urlopen(base + 'webmap.html') as response:
+      assert response.read() == b'<html></html>'
+  finally:
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,134 @@
+import math
+import os
+
+import pytest
+
+from portmap.mvt import _clip_ring, _clean_polygons, write_tiles
+from portmap.preprocess import preprocess_layer
+
+shapely_geometry = pytest.importorskip('shapely.geometry')
+
+LAYERS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'layers')
+
+def _varint(data, pos):
+  value = shift = 0
+  while True:
+    byte = data[pos]
+    pos += 1
+    value |= (byte & 0x7f) << shift
+    shift += 7
+    if not byte & 0x80:
+      return value, pos
+
+# (field number, value) of a protobuf message, length delimited values as bytes
+def _fields(data):
+  pos = 0
+  while pos < len(data):
+    key, pos = _varint(data, pos)
+    if key & 7 == 0:
+      value, pos = _varint(data, pos)
+    else:
+      length, pos = _varint(data, pos)
+      value, pos = data[pos:pos + length], pos + length
+    yield key >> 3, value
+
+# rings of the polygon features of a tile
+def _decode_polygons(tile):
+  features = []
+  for _, layer in _fields(tile):
+    for number, feature in _fields(layer):
+      if number != 2:
+        continue
+      fields = dict(_fields(feature))
+      if fields[3] != 3:
+        continue
+      commands, pos = [], 0
+      while pos < len(fields[4]):
+        value, pos = _varint(fields[4], pos)
+        commands.append(value)
+      rings, cursor, i = [], [0, 0], 0
+      while i < len(commands):
+        command, count = commands[i] & 7, commands[i] >> 3
+        i += 1
+        if command == 7:
+          rings[-1].append(rings[-1][0])
+          continue
+        for _ in range(count):
+          for axis in (0, 1):
+            delta = commands[i + axis]
+            cursor[axis] += (delta >> 1) ^ -(delta & 1)
+          i += 2
+          if command == 1:
+            rings.append([])
+          rings[-1].append(tuple(cursor))
+      features.append(rings)
+  return features
+
+def _valid_tiles(directory):
+  checked = 0
+  for root, _, files in os.walk(directory):
+    for name in files:
+      with open(os.path.join(root, name), 'rb') as f:
+        for rings in _decode_polygons(f.read()):
+          polygons, polygon = [], None
+          for ring in rings:
+            # exterior rings: positive area (clockwise with y down)
+            if sum(a[0] * b[1] - b[0] * a[1] for a, b in zip(ring, ring[1:])) > 0:
+              polygon = [ring]
+              polygons.append(polygon)
+            else:
+              polygon.append(ring)
+          geometry = shapely_geometry.MultiPolygon([(p[0], p[1:]) for p in polygons])
+          assert geometry.is_valid, (root, name, rings)
+          checked += 1
+  return checked
+
+def _polygon(lon, lat, radius, sides=40, angle=0.0):
+  ring = [[lon + radius * math.cos(angle + 2 * math.pi * i / sides), lat + radius * math.sin(angle + 2 * math.pi * i / sides)]
+          for i in range(sides)]
+  return {'type': 'Polygon', 'coordinates': [ring + [ring[0]]]}
+
+def test_clip_ring_crossing_both_limits():
+  square = [(0, 0), (1, 0), (1, 1), (0, 1), (0, 0)]
+  clipped = [point[:2] for point in _clip_ring(square, 0.4, 0.6, 0)]
+  assert clipped == [(0.4, 0), (0.6, 0), (0.6, 1), (0.4, 1), (0.4, 0)]
+
+def test_tiles_polygons_are_valid(tmp_path):
+  geometries = [
+    _polygon(2.31, 36.58, 0.05),
+    _polygon(2.25, 36.6, 0.02, sides=7, angle=0.3),
+    # thin rectangle: its long edges cross both limits of the tiles they pass through
+    {'type': 'Polygon', 'coordinates': [[[2.1, 36.5], [2.5, 36.52], [2.5, 36.521], [2.1, 36.501], [2.1, 36.5]]]},
+    {'type': 'Polygon', 'coordinates': [[[2.2, 36.4], [2.201, 36.4], [2.24, 36.7], [2.239, 36.7], [2.2, 36.4]]]}
+  ]
+  data = {'type': 'FeatureCollection', 'features': [{'type': 'Feature', 'properties': {}, 'geometry': g} for g in geometries]}
+  write_tiles(data, str(tmp_path), 'layer', min_zoom=8, max_zoom=13)
+  assert _valid_tiles(str(tmp_path)) > 50
+
+# U shape cut through both arms: the clipped ring runs back and forth along the limit
+def test_clean_polygons_bridges():
+  ring = [(0, 0), (30, 0), (30, 10), (20, 10), (20, 5), (10, 5), (10, 10), (0, 10)]
+  clipped = _clip_ring([(x, y, 0) for x, y in ring + [ring[0]]], 6, 20, 1)
+  rings = [[(int(p[0]), int(p[1])) for p in clipped[:-1]]]
+  polygons = _clean_polygons(rings)
+  assert len(polygons) == 2
+  assert all(shapely_geometry.Polygon(polygon[0]).is_valid for polygon in polygons)
+
+def test_clean_polygons_hole_on_the_limit():
+  exterior = [(0, 0), (10, 0), (10, 10), (0, 10)]
+  hole = [(10, 2), (5, 2), (5, 8), (10, 8)]
+  polygons = _clean_polygons([exterior, hole])
+  assert len(polygons) == 1 and len(polygons[0]) == 1
+  assert shapely_geometry.Polygon(polygons[0][0]).area == 100 - 30
+
+def test_layer_tiles_are_valid(tmp_path):
+  data, _ = preprocess_layer(os.path.join(LAYERS, 'municipalities_admin_borders.geojson'))
+  write_tiles(data, str(tmp_path), 'layer', min_zoom=8, max_zoom=14)
+  assert _valid_tiles(str(tmp_path)) > 1000
+
+def test_emptied_layer_tiles_removed(tmp_path):
+  data = {'type': 'FeatureCollection', 'features': [{'type': 'Feature', 'properties': {}, 'geometry': _polygon(2.31, 36.58, 0.05)}]}
+  write_tiles(data, str(tmp_path / 'layer'), 'layer', min_zoom=8, max_zoom=10)
+  assert os.listdir(str(tmp_path / 'layer'))
+  write_tiles({'type': 'FeatureCollection', 'features': []}, str(tmp_path / 'layer'), 'layer', min_zoom=8, max_zoom=10)
+  assert not os.path.exists(str(tmp_path / 'layer'))
@@ -0,0 +1,37 @@
+import os
+
+import pytest
+
+pytest.importorskip('shapely')
+
+from portmap import overlay
+from portmap.geometry import buffer_bounds
+from portmap.registry import VectorLayer
+
+LAYERS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'layers')
+
+def _vector_layers(bbox):
+  return [VectorLayer(name=layer.name, path=os.path.join(LAYERS, os.path.basename(layer.path)), style={}, bbox=bbox)
+          for layer in overlay.OVERLAY_SOURCES + overlay.OVERLAY_TARGETS]
+
+def test_from_vector_layers_reads_the_site_files():
+  vector_layers = _vector_layers([2.30, 36.57, 2.32, 36.59])
+  sources = overlay.from_vector_layers(overlay.OVERLAY_SOURCES, vector_layers)
+  assert [layer.path for layer in sources] == [layer.path for layer in vector_layers[:len(sources)]]
+  assert all(layer.bbox == [2.30, 36.57, 2.32, 36.59] for layer in sources)
+  # names, keys and buffers kept
+  assert [(layer.name, layer.keys, layer.buffer) for layer in sources] == \
+    [(layer.name, layer.keys, layer.buffer) for layer in overlay.OVERLAY_SOURCES]
+
+def test_overlay_of_a_site_extent():
+  everything = _vector_layers(None)
+  rows, _ = overlay.overlay(overlay.from_vector_layers(overlay.OVERLAY_SOURCES, everything),
+                            overlay.from_vector_layers(overlay.OVERLAY_TARGETS, everything))
+  site = _vector_layers(buffer_bounds(2.310362, 36.577489, 1500))
+  site_rows, _ = overlay.overlay(overlay.from_vector_layers(overlay.OVERLAY_SOURCES, site),
+                                 overlay.from_vector_layers(overlay.OVERLAY_TARGETS, site))
+  assert 0 < len(site_rows) < len(rows)
+  # an extent without features: no intersections
+  far = _vector_layers(buffer_bounds(5.0, 36.0, 1000))
+  assert overlay.overlay(overlay.from_vector_layers(overlay.OVERLAY_SOURCES, far),
+                         overlay.from_vector_layers(overlay.OVERLAY_TARGETS, far))[0] == []
@@ -0,0 +1,52 @@
+import os
+
+import numpy as np
+import pytest
+
+rasterio = pytest.importorskip('rasterio')
+from rasterio.transform import from_bounds
+
+from portmap.raster import LocalEngine
+
+BOUNDS = [2.25, 36.55, 2.37, 36.61]
+VIS = {'min': 0, 'max': 1, 'palette': ['000000', 'ffffff']}
+
+# single band product over the bounds (values rising from west to east)
+def _product(path):
+  values = np.tile(np.linspace(0, 1, 64, dtype=np.float32), (32, 1))
+  west, south, east, north = BOUNDS
+  with rasterio.open(path, 'w', driver='GTiff', width=64, height=32, count=1, dtype='float32', crs='EPSG:4326',
+                     transform=from_bounds(west, south, east, north, 64, 32), nodata=np.nan) as dataset:
+    dataset.write(values, 1)
+  return path
+
+def _tiles(directory):
+  tiles = {}
+  for folder, _, files in os.walk(directory):
+    for file in files:
+      if file.endswith('.png'):
+        with open(os.path.join(folder, file), 'rb') as f:
+          tiles[os.path.join(folder, file)] = f.read()
+  return tiles
+
+def test_tiles_rendered_again_when_vis_params_change(tmp_path):
+  engine = LocalEngine({}, [2.31, 36.58], 1000, output_dir=str(tmp_path))
+  path = _product(str(tmp_path / 'ndvi.tif'))
+  engine.product = lambda product: path
+  root = str(tmp_path / 'tiles')
+  directory = os.path.join(root, 'ndvi')
+
+  engine.tiles('ndvi', VIS, root, 'ndvi', BOUNDS, 11, 12)
+  first = _tiles(directory)
+  assert first
+
+  # same product and visual parameters: kept
+  os.remove(sorted(first)[0])
+  engine.tiles('ndvi', dict(VIS), root, 'ndvi', BOUNDS, 11, 12)
+  assert len(_tiles(directory)) == len(first) - 1
+
+  # new palette: every tile rendered again
+  engine.tiles('ndvi', dict(VIS, palette=['ff0000', '00ff00']), root, 'ndvi', BOUNDS, 11, 12)
+  second = _tiles(directory)
+  assert sorted(second) == sorted(first)
+  assert all(second[tile] != first[tile] for tile in first)
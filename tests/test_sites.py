@@ -0,0 +1,36 @@
+import json
+import os
+
+from portmap.registry import VectorLayer
+from portmap.sites import Site, site_layer
+from portmap.stream import ingest
+
+LAYERS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'layers')
+LAYER = VectorLayer(name='Municipalities', path=os.path.join(LAYERS, 'municipalities_admin_borders.geojson'),
+                    style={'color': '#331D31'}, tooltip_fields=['name'])
+
+def _features(layer, tmp_path):
+  destination = str(tmp_path / 'layer.geojson')
+  ingest(layer.path, destination, bbox=layer.bbox, keep=layer.used_properties())
+  with open(destination, encoding='utf-8') as f:
+    return [feature['properties']['name'] for feature in json.load(f)['features']]
+
+def test_shared_layer_filtered_to_the_site_extent(tmp_path):
+  cherchell = Site(name='Cherchell', aoi=[2.310362, 36.577489])
+  west = Site(name='Tipaza West', aoi=[1.75, 36.45], radius=5000)
+  all_features = _features(LAYER, tmp_path)
+  cherchell_features = _features(site_layer(LAYER, cherchell), tmp_path)
+  west_features = _features(site_layer(LAYER, west), tmp_path)
+  assert site_layer(LAYER, west).bbox == west.extent()
+  assert 0 < len(west_features) < len(all_features)
+  assert 0 < len(cherchell_features) < len(all_features)
+  assert set(west_features) != set(cherchell_features)
+
+def test_site_own_layer_file(tmp_path):
+  (tmp_path / 'municipalities_admin_borders.geojson').write_text('{"type": "FeatureCollection", "features": []}')
+  site = Site(name='Tipaza West', aoi=[1.75, 36.45], layers=str(tmp_path))
+  layer = site_layer(LAYER, site)
+  assert layer.path == str(tmp_path / 'municipalities_admin_borders.geojson') and layer.bbox is None
+  # a file the site doesn't have: the shared one, filtered
+  site = Site(name='Tipaza West', aoi=[1.75, 36.45], layers=str(tmp_path / 'missing'))
+  assert site_layer(LAYER, site).path == LAYER.path and site_layer(LAYER, site).bbox == site.extent()
@@ -0,0 +1,61 @@
+import json
+import math
+
+from portmap.preprocess import preprocess, preprocess_layer
+from portmap.stream import ingest, iter_features
+
+# municipalities like polygons: a grid of cells whose shared borders are wavy lines
+def _grid(size=4, steps=20):
+  def border(x0, y0, x1, y1):
+    return [[round(x0 + (x1 - x0) * i / steps + 0.002 * math.sin(7 * (x0 + y0) + i), 6),
+             round(y0 + (y1 - y0) * i / steps + 0.002 * math.cos(5 * (x1 + y1) + i), 6)] for i in range(steps)]
+  def edge(x0, y0, x1, y1):
+    # same positions whatever the direction the edge is walked in
+    if (x0, y0) > (x1, y1):
+      return edge(x1, y1, x0, y0)[::-1]
+    return border(x0, y0, x1, y1) + [[x1, y1]]
+  features = []
+  for i in range(size):
+    for j in range(size):
+      x, y = 2.0 + i * 0.1, 36.3 + j * 0.1
+      corners = [(x, y), (x + 0.1, y), (x + 0.1, y + 0.1), (x, y + 0.1), (x, y)]
+      ring = [[x, y]]
+      for a, b in zip(corners, corners[1:]):
+        ring.extend(edge(*a, *b)[1:])
+      features.append({'type': 'Feature', 'properties': {'name': 'cell {} {}'.format(i, j), 'extra': 1},
+                       'geometry': {'type': 'Polygon', 'coordinates': [ring]}})
+  return {'type': 'FeatureCollection', 'features': features}
+
+def test_iter_features(tmp_path):
+  source = tmp_path / 'layer.geojson'
+  data = _grid()
+  source.write_text(json.dumps(dict(data, name='layer', crs=None)))
+  assert list(iter_features(str(source), chunk_size=64)) == data['features']
+
+def test_topology_matches_in_memory_preprocessing(tmp_path):
+  source, destination = tmp_path / 'layer.geojson', tmp_path / 'out.geojson'
+  data = _grid()
+  source.write_text(json.dumps(data))
+  stats = ingest(str(source), str(destination), keep=['name'], tolerance=0.003, topology=True, chunk_size=256)
+  with open(str(destination), encoding='utf-8') as f:
+    streamed = json.load(f)
+  # shared borders simplified the same way on both sides, like the whole layer in memory
+  assert streamed == preprocess(data, tolerance=0.003, keep=['name'])
+  assert stats['after']['vertices'] < stats['before']['vertices']
+  # the junction index is removed with the temporary output
+  assert sorted(p.name for p in tmp_path.iterdir()) == ['layer.geojson', 'out.geojson']
+
+def test_bbox_filter(tmp_path):
+  source, destination = tmp_path / 'layer.geojson', tmp_path / 'out.geojson'
+  source.write_text(json.dumps(_grid()))
+  stats = ingest(str(source), str(destination), bbox=[2.01, 36.31, 2.05, 36.35], tolerance=0.003, topology=True)
+  assert stats['features'] == [16, 1]
+
+def test_sizes_match_in_memory_preprocessing(tmp_path):
+  source, destination = tmp_path / 'layer.geojson', tmp_path / 'out.geojson'
+  # indented file with extra members: the sizes are the embedded ones, not the file's
+  source.write_text(json.dumps(dict(_grid(), name='layer'), indent=2))
+  stats = ingest(str(source), str(destination), keep=['name'], tolerance=0.003, topology=True)
+  _, expected = preprocess_layer(str(source), tolerance=0.003, keep=['name'])
+  assert stats['before'] == expected['before']
+  assert stats['after'] == expected['after']
@@ -0,0 +1,49 @@
+import os
+
+import numpy as np
+import pytest
+
+rasterio = pytest.importorskip('rasterio')
+from rasterio.transform import from_origin
+from rasterio.warp import transform_bounds
+
+from portmap import tiling
+
+# synthetic DEM (UTM 31N, 30m pixels): hills, so the slopes depend on the neighbouring pixels
+def _dem(path, width=70, height=50):
+  y, x = np.mgrid[0:height, 0:width]
+  values = (80 * np.sin(x / 7.0) * np.cos(y / 5.0) + 2 * x).astype(np.float32)
+  with rasterio.open(path, 'w', driver='GTiff', width=width, height=height, count=1, dtype='float32', crs='EPSG:32631',
+                     transform=from_origin(430000, 4050000, 30, 30)) as dataset:
+    dataset.write(values, 1)
+  return path
+
+def _read(path):
+  with rasterio.open(path) as dataset:
+    return dataset.read(), dataset.transform
+
+def test_tiled_mosaic_matches_single_pass(tmp_path):
+  sources = {'dem': _dem(str(tmp_path / 'dem.tif'))}
+  # bounds inside the DEM: the halo is read past the tiles on every side
+  bounds = list(transform_bounds('EPSG:32631', 'EPSG:4326', 430150, 4048650, 431950, 4049850))
+  single = tiling.run(sources, 'slopes', str(tmp_path / 'single'), bounds=bounds, tile_size=4096, workers=1, report=False)
+  tiled = tiling.run(sources, 'slopes', str(tmp_path / 'tiled'), bounds=bounds, tile_size=16, workers=2, report=False)
+  (expected, expected_transform), (values, transform) = _read(single), _read(tiled)
+  assert len(os.listdir(str(tmp_path / 'tiled' / 'tiles'))) > 4
+  assert transform == expected_transform
+  np.testing.assert_array_equal(values, expected)
+
+def test_restart_skips_finished_tiles(tmp_path, capsys):
+  sources = {'dem': _dem(str(tmp_path / 'dem.tif'))}
+  bounds = list(transform_bounds('EPSG:32631', 'EPSG:4326', 430150, 4048650, 431950, 4049850))
+  run_dir = str(tmp_path / 'run')
+  tiling.run(sources, 'slopes', run_dir, bounds=bounds, tile_size=16, workers=2, report=False)
+  tiles_dir = os.path.join(run_dir, 'tiles')
+  names = sorted(os.listdir(tiles_dir))
+  modified = {name: os.stat(os.path.join(tiles_dir, name)).st_mtime_ns for name in names}
+  # interrupted run: one tile missing
+  os.remove(os.path.join(tiles_dir, names[0]))
+  tiling.run(sources, 'slopes', run_dir, bounds=bounds, tile_size=16, workers=2)
+  assert '{} tiles ({} reused)'.format(len(names), len(names) - 1) in capsys.readouterr().out
+  assert sorted(os.listdir(tiles_dir)) == names
+  assert all(os.stat(os.path.join(tiles_dir, name)).st_mtime_ns == modified[name] for name in names[1:])
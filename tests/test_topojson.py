@@ -0,0 +1,57 @@
+import pytest
+
+from portmap.topojson import to_geojson, topology
+
+def _collection(*geometries):
+  return {'type': 'FeatureCollection',
+          'features': [{'type': 'Feature', 'properties': {'id': i}, 'geometry': g} for i, g in enumerate(geometries)]}
+
+# same positions within the quantization grid
+def _close(positions, expected):
+  return len(positions) == len(expected) and all(abs(p[0] - e[0]) < 1e-4 and abs(p[1] - e[1]) < 1e-4
+                                                 for p, e in zip(positions, expected))
+
+def test_empty_layer():
+  encoded = topology(_collection(), 'layer')
+  assert encoded['arcs'] == []
+  assert to_geojson(encoded, 'layer')['features'] == []
+
+def test_points_only_layer():
+  data = _collection({'type': 'Point', 'coordinates': [2.31, 36.58]},
+                     {'type': 'MultiPoint', 'coordinates': [[2.3, 36.5], [2.4, 36.6]]}, None)
+  decoded = to_geojson(topology(data, 'layer'), 'layer')['features']
+  assert _close([decoded[0]['geometry']['coordinates']], [[2.31, 36.58]])
+  assert _close(decoded[1]['geometry']['coordinates'], [[2.3, 36.5], [2.4, 36.6]])
+  assert decoded[2]['geometry'] is None
+
+def test_shared_border_stored_once():
+  left = [[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]
+  right = [[1, 0], [2, 0], [2, 1], [1, 1], [1, 0]]
+  encoded = topology(_collection({'type': 'Polygon', 'coordinates': [left]}, {'type': 'Polygon', 'coordinates': [right]}), 'layer')
+  # the shared edge and the other sides of each square
+  assert len(encoded['arcs']) == 3
+  for feature, ring in zip(to_geojson(encoded, 'layer')['features'], (left, right)):
+    assert _close(sorted(feature['geometry']['coordinates'][0][:-1]), sorted(ring[:-1]))
+
+def test_geometry_collection():
+  left = [[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]
+  right = [[1, 0], [2, 0], [2, 1], [1, 1], [1, 0]]
+  collection = {'type': 'GeometryCollection', 'geometries': [
+    {'type': 'Point', 'coordinates': [0.5, 2]},
+    {'type': 'LineString', 'coordinates': [[0, 2], [2, 2]]},
+    {'type': 'GeometryCollection', 'geometries': [{'type': 'Polygon', 'coordinates': [right]}]}
+  ]}
+  encoded = topology(_collection({'type': 'Polygon', 'coordinates': [left]}, collection), 'layer')
+  # the border shared with the polygon nested in the collection is stored once
+  assert len(encoded['arcs']) == 4
+  geometry = to_geojson(encoded, 'layer')['features'][1]['geometry']
+  assert geometry['type'] == 'GeometryCollection'
+  point, line, nested = geometry['geometries']
+  assert _close([point['coordinates']], [[0.5, 2]])
+  assert _close(line['coordinates'], [[0, 2], [2, 2]])
+  assert nested['type'] == 'GeometryCollection'
+  assert _close(sorted(nested['geometries'][0]['coordinates'][0][:-1]), sorted(right[:-1]))
+
+def test_unsupported_geometry_type():
+  with pytest.raises(ValueError):
+    topology(_collection({'type': 'Circle', 'coordinates': [0, 0]}), 'layer')
@@ -0,0 +1,23 @@
+import numpy as np
+
+from portmap.values import LEVELS, decode_values, encode_values
+
+def test_round_trip():
+  low, high = -1, 1
+  values = np.array([[-1, -0.5, 0, 0.123456, 0.99999, 1, np.nan, -np.inf]])
+  rgba = encode_values(values, low, high)
+  assert rgba.shape == (8, 4) and rgba.dtype == np.uint8
+  # no data: transparent
+  assert list(rgba[:, 3]) == [255] * 6 + [0, 0]
+  decoded = decode_values(rgba, low, high)
+  assert np.all(np.abs(decoded[:6] - values[0, :6]) <= (high - low) / LEVELS)
+  assert np.all(np.isnan(decoded[6:]))
+
+def test_out_of_range_values_clamped():
+  rgba = encode_values(np.array([[-600.0, 9500.0]]), -500, 9000)
+  assert list(decode_values(rgba, -500, 9000)) == [-500, 9000]
+
+def test_random_values():
+  values = np.random.default_rng(1).uniform(0, 90, (1, 10000))
+  decoded = decode_values(encode_values(values, 0, 90), 0, 90)
+  assert np.max(np.abs(decoded - values[0])) <= 90.0 / LEVELS / 2 + 1e-9
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+rasterio = pytest.importorskip('rasterio')
+from rasterio.transform import from_origin
+
+from portmap.zonal import local_stats, stats_properties
+
+# 8x8 pixels raster (UTM 31N, 10m pixels) and two features covering its left and right halves
+X0, Y0 = 430000, 4050000
+
+def _square(x0, x1):
+  from rasterio.warp import transform
+  xs, ys = transform('EPSG:32631', 'EPSG:4326', [x0, x1, x1, x0, x0], [Y0, Y0, Y0 - 80, Y0 - 80, Y0])
+  return {'type': 'Polygon', 'coordinates': [list(map(list, zip(xs, ys)))]}
+
+def test_local_histogram(tmp_path):
+  values = np.random.default_rng(3).uniform(-1.2, 1, (8, 8)).astype(np.float32)
+  values[0, 0] = np.nan
+  path = str(tmp_path / 'ndvi.tif')
+  with rasterio.open(path, 'w', driver='GTiff', width=8, height=8, count=1, dtype='float32', crs='EPSG:32631',
+                     transform=from_origin(X0, Y0, 10, 10), nodata=np.nan) as dataset:
+    dataset.write(values, 1)
+  features = [{'type': 'Feature', 'properties': {}, 'geometry': _square(X0 + 0.1, X0 + 39.9)},
+              {'type': 'Feature', 'properties': {}, 'geometry': _square(X0 + 40.1, X0 + 79.9)}]
+  stats = local_stats(features, path, block_rows=3, histogram=[-1, 1, 4])
+  for feature_stats, half in zip(stats, (values[:, :4], values[:, 4:])):
+    half = half[~np.isnan(half)]
+    assert feature_stats['count'] == half.size
+    # values under -1 left out
+    expected, _ = np.histogram(half[half >= -1], bins=4, range=(-1, 1))
+    assert feature_stats['histogram'] == list(expected)
+  properties = stats_properties('ndvi', stats[0], histogram=[-1, 1, 4])
+  assert properties['ndvi_hist'] == stats[0]['histogram']
+  assert stats_properties('ndvi', None, histogram=[-1, 1, 4])['ndvi_hist'] is None
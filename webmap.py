@@ -1,14 +1,108 @@
 # importing all project related libraries
-import ee
-from ee import image
-import folium
-from folium import features
-from folium.plugins import MiniMap
-from folium import WmsTileLayer
-from branca.element import Template, MacroElement
-import geojson
+# Earth Engine, folium and the analysis modules are only imported by the functions needing them:
+# importing this module builds nothing, and a vector only or offline build never loads Earth Engine
+import argparse
 import os
 import webbrowser
+from portmap import trace
+from portmap.classify import NDVI_CLASSES
+from portmap.geometry import buffer_bounds
+from portmap.registry import VectorLayer, RasterLayer, ZonalRaster
+
+#################### BUILD OPTIONS ####################
+# Vector layers output mode:
+# - 'inline': GeoJSON data embedded in webmap.html
+# - 'mvt': each layer tiled into a tiles/vector/<layer>/{z}/{x}/{y}.pbf pyramid of vector tiles
+#   (zoom 8 to 14) drawn with Leaflet.VectorGrid, the map then has to be served over http
+#   (e.g: python -m http.server) for the browser to fetch the tiles.
+# - 'lazy': each layer written to data/<layer>.json and only fetched when toggled on in the
+#   layer control, except the layers marked 'eager' which are embedded and shown on load
+#   (the map has to be served over http as well).
+VECTOR_MODE = 'inline'
+
+# Vector layers renderer ('inline' and 'lazy' modes, see portmap.canvas):
+# - 'svg': Leaflet's default, one DOM node with its mouse listeners per feature
+# - 'canvas': layers drawn on a canvas, the hovered feature (highlight style and tooltip) found
+#   through an R-tree of the features bounding boxes packed at build time: smooth panning and
+#   hovering with large layers
+RENDERER = 'svg'
+
+# Value tiles (see portmap.values): the NDVI, NDWI, elevation and slopes layers exported as
+# 16 bits encoded value tiles into tiles/values/<layer> over the AOI (EE_TILES_ZOOM range),
+# colored in the browser with their palette: the value under the cursor is shown without any
+# request and the palette can be changed without refetching. The map has to be served over http
+VALUE_TILES = False
+
+# Earth Engine raster layers tiles:
+# - None: tiles served live by Earth Engine (stops working when the 48h token expires)
+# - 'xyz': tiles pre-rendered over the AOI for the EE_TILES_ZOOM range into tiles/ee/<layer>/{z}/{x}/{y}.png
+#   and referenced locally by the map, layers already cached don't call Earth Engine at all
+# - 'mbtiles': same in a tiles/ee/<layer>.mbtiles file, the map has then to be served with
+#   python -m portmap.ee_tiles (serves the tiles from the MBTiles files)
+EE_TILES = None
+EE_TILES_ZOOM = (10, 15)
+
+# Incremental build: the rendered layers (and legend) are stored in .cache/build under a
+# fingerprint of their inputs (layer file, registry entry, ee expression + vis_params, build
+# options) and reused as long as these don't change, only the changed layers are rebuilt.
+INCREMENTAL = True
+
+# Raster layers backend:
+# - 'ee': computed by Earth Engine (needs an authenticated account)
+# - 'local': computed offline with NumPy from the Sentinel-2 band files and the SRTM DEM listed
+#   in LOCAL_RASTERS (needs rasterio), written to rasters/local/<product>.tif (Cloud Optimized
+#   GeoTIFFs) and rendered into tiles/local/<layer>/{z}/{x}/{y}.png for the EE_TILES_ZOOM range
+RASTER_BACKEND = 'ee'
+LOCAL_RASTERS = {
+  'B2': os.path.join('rasters', 'T31SDA_20211019T104051_B02_10m.jp2'),
+  'B3': os.path.join('rasters', 'T31SDA_20211019T104051_B03_10m.jp2'),
+  'B4': os.path.join('rasters', 'T31SDA_20211019T104051_B04_10m.jp2'),
+  'B8': os.path.join('rasters', 'T31SDA_20211019T104051_B08_10m.jp2'),
+  'B11': os.path.join('rasters', 'T31SDA_20211019T104051_B11_20m.jp2'),
+  'dem': os.path.join('rasters', 'srtm_37_05.tif')
+}
+
+# Overlay analysis: intersections of the project layers (port, construction/logistic zones, roads)
+# with the forests, farmlands and waterways written to analysis/overlay.csv and overlay.geojson
+# (affected hectares/meters per pair of features, see portmap.overlay, needs shapely) and drawn
+# as the 'Overlay - Affected areas' layer
+OVERLAY = False
+
+# Time series (Earth Engine backend): None (single scene analysis) or a date range monitored
+# period by period, e.g: {'start': '2021-01-01', 'end': '2022-01-01', 'months': 1}
+# cloud masked median composites per period (see portmap.timeseries): adds the last period
+# NDVI/NDWI and the NDVI change since the first period layers, and writes the mean NDVI/NDWI of
+# the project zones per period to analysis/timeseries.csv (past periods reused from the cache)
+TIME_SERIES = None
+# project zones (VECTOR_LAYERS names) of the per period mean NDVI/NDWI
+TIME_SERIES_ZONES = ['Port Main Infrastructure', 'Construction Zones', 'Logistic industrial zones']
+
+# Build tracing (see portmap.trace), no cost when off:
+# - None: off
+# - 'log': time, bytes read/written, features and ee requests of every stage and layer written
+#   to .cache/trace/build.jsonl (one JSON object per span), slowest stages printed at the end
+# - 'chrome': same plus .cache/trace/build.trace.json to open in chrome://tracing or Perfetto
+TRACE = None
+# Whole build profiling: None, 'cpu' (cProfile, .cache/trace/build.prof), 'memory' (tracemalloc)
+# or 'all'
+PROFILE = None
+
+# Bundle output (see portmap.bundle): None (webmap.html only) or a directory, e.g: 'dist', where
+# webmap.html is also written as a small HTML shell plus content hashed, precompressed (gzip,
+# brotli) JS/CSS/data assets with the third party libraries vendored; served with cache headers
+# by: python webmap.py serve
+BUNDLE = None
+
+
+# map file, its initial view and the outputs it references (moved to per site subdirectories by
+# the batch builds, see portmap.sites)
+MAP_FILE = 'webmap.html'
+MAP_LOCATION = [36.6193, 2.2450]
+MAP_ZOOM = 14
+DATA_DIR = 'data'
+TILES_ROOT = 'tiles'
+ANALYSIS_DIR = 'analysis'
+LOCAL_DIR = os.path.join('rasters', 'local')
 
 #################### Earth Engine Configuration #################### 
 # ########## Earth Engine Setup
@@ -17,37 +111,23 @@ import webbrowser
 
 #ee.Authenticate()
 
-# initializing the earth engine library
-ee.Initialize()
-
-# ##### earth-engine drawing method setup
-def add_ee_layer(self, ee_image_object, vis_params, name):
-  map_id_dict = ee.Image(ee_image_object).getMapId(vis_params)
-  folium.raster_layers.TileLayer(
-      tiles = map_id_dict['tile_fetcher'].url_format,
-      attr = 'Map Data &copy; <a href="https://earthengine.google.com/">Google Earth Engine</a>',
-      name = name,
-      overlay = True,
-      control = True
-  ).add_to(self)
-
-# configuring earth engine display rendering method in folium
-folium.Map.add_ee_layer = add_ee_layer
-
 #################### IMAGERY ANALYSIS ####################
 
 # creating delimitation Area Of Interest/Study of the project (AOI/AOS)
 #aoi = ee.Geometry.Rectangle([[2.4125581916503958, 36.49689168784115], [2.1626192268066458, 36.653497195420755]])
 # Buffer/Circular AOI
-aoi = ee.Geometry.Point([2.310362, 36.577489]).buffer(10500)
+aoi_center = [2.310362, 36.577489]
+aoi_radius = 10500
+# AOI bounding box [west, south, east, north] (used for the local tiles cache)
+aoi_bounds = buffer_bounds(aoi_center[0], aoi_center[1], aoi_radius)
 
-# Passing main Sentinel-2 imagery ID: image1 (date: 2021-10-21)
-image = ee.Image('COPERNICUS/S2_SR/20211019T104051_20211019T104645_T31SDA')
+# Sentinel-2 scene of the analysis (date: 2021-10-21), or SCENE_DATES: a date range, e.g:
+# {'start': '2021-06-01', 'end': '2021-09-01'}, analysed as the median composite of its cloud
+# masked scenes instead (see portmap.timeseries)
+SCENE = 'COPERNICUS/S2_SR/20211019T104051_20211019T104645_T31SDA'
+SCENE_DATES = None
 
 # ########## Visual Displays
-# clipping the image to study area borders
-image_satellite = image.clip(aoi).divide(10000)
-
 # visual parameters for the satellite imagery natural colors display
 image_params = {
   'bands': ['B4',  'B3',  'B2'],
@@ -56,23 +136,12 @@ image_params = {
   'gamma': 2
 }
 
-#################### Custom Visual Displays ####################
-
-# ########## Elevation
-
-# ##### NASA DEM (Digital Elevation Model) collection: 30m resolution
-dem = ee.Image('CGIAR/SRTM90_V4').clip(aoi)
-
 # visual parameters for the DEM imagery
 dem_params = {
   'min': 0,
   'max': 905
 }
 
-# ##### Elevation
-# deriving elevation from previous DEM
-elevation = dem.select('elevation').clip(aoi)
-
 # visual parameters for the elevation imagery
 elevation_params = {
   'min' : 0,
@@ -80,10 +149,6 @@ elevation_params = {
   'palette' : ['#440044', '#FF00FF', '#00FFFF'] # color palette for drawing the elevation model on the map
 }
 
-# ##### Slopes (30m resolution)
-# deriving slopes from previous DEM through Elevation
-slopes = ee.Terrain.slope(elevation).clip(aoi)
-
 # visual parameters for the slopes imagery
 slopes_params = {
   'min' : 0,
@@ -91,15 +156,6 @@ slopes_params = {
   'palette' : ['#830cab','#7556f3','#5590e7','#3bbcac','#52d965','#86ea50','#ccec5a']  # color palette for drawing the layer based on slope angle on the map
 }
 
-####################  INDECES #################### 
-# ##### NDVI (Normalized Difference Vegetation Index)
-# defining NDVI compue function that normalizes the differences between two bands
-def getNDVI(image):
-  return image.normalizedDifference(['B8', 'B4'])
-
-# clipping to AOI
-ndvi = getNDVI(image.clip(aoi))
-
 # NDVI visual parameters:
 # Generating a color palette as visual parameter for NDVI display:
 # White/Light Green to Dark Green : No vegetation to High/Healthy vegetation
@@ -109,12 +165,6 @@ ndvi_params = {
   'palette': ['#ffffe5', '#f7fcb9', '#78c679', '#41ab5d', '#238443', '#005a32']
 }
 
-# ##### NDWI (Normalized Difference Water Index)
-def getNDWI(image):
-  return image.normalizedDifference(['B3', 'B11'])
-
-ndwi = getNDWI(image.clip(aoi))
-
 # NDWI visual parameters: (shallow water to deep water)
 ndwi_params = {
     'min': 0,
@@ -122,474 +172,412 @@ ndwi_params = {
     'palette': ['#00FFFF', '#0000FF']
 }
 
-# ########## IMAGES MASKS
-# Mask the non-watery parts of the image, where NDVI ratio value > 0.0
-ndvi_masked = ndvi.updateMask(ndvi.gte(0))
-
-# NDWI Masking: NDWI > 0.1
-ndwi_masked = ndwi.updateMask(ndwi.gte(0.1))
-
-# ########## ANALYSIS RESULTS CLASSIFICATION
-# ##### NDVI classification: 7 classes
-ndvi_classified = ee.Image(ndvi_masked) \
-  .where(ndvi.gte(0).And(ndvi.lte(0.15)), 2) \
-  .where(ndvi.gte(0.15).And(ndvi.lte(0.25)), 3) \
-  .where(ndvi.gte(0.25).And(ndvi.lte(0.35)), 4) \
-  .where(ndvi.gte(0.35).And(ndvi.lte(0.45)), 5) \
-  .where(ndvi.gte(0.45).And(ndvi.lte(0.65)), 6) \
-  .where(ndvi.gte(0.65).And(ndvi.lte(0.75)), 7) \
-  .where(ndvi.gte(0.75), 8) \
-
-# Classified NDVI visual parameters
-ndvi_classified_params = {
-  'min': 1,
-  'max': 7,
-  'palette': ['#a50026', '#ed5e3d', '#f9f7ae', '#fec978', '#9ed569', '#229b51', '#006837'] 
-  # each color corresponds to an NDVI class.
+# NDVI change visual parameters: vegetation loss (red) to gain (green)
+ndvi_change_params = {
+  'min': -0.5,
+  'max': 0.5,
+  'palette': ['#d7191c', '#fdae61', '#ffffbf', '#a6d96a', '#1a9641']
 }
 
-###########################################################
-#################### MAIN PROJECT MAP ####################
-# setting up the main map for the project
-m = folium.Map(location = [36.6193, 2.2450], tiles='OpenStreetMap', zoom_start = 14, control_scale = True)
-
-# setting up a minimap for general orientation when on zoom
-miniMap = MiniMap(
-  toggle_display = True,
-  zoom_level_offset = -5,
-  tile_layer='cartodbdark_matter',
-  width=140,
-  height=100
-).add_to(m)
-
-m.add_child(miniMap)
-
-
-#################### BASEMAPS ####################
-# Adding different types of basemaps helps better visualize the different map features.
-
-# ########## Primary basemaps (victor data):
-basemap1 = folium.TileLayer('stamenterrain', name='Stamen Terrain')
-# basemap1.add_to(m)
-
-basemap2 = folium.TileLayer('cartodbdark_matter', name='Dark Matter')
-basemap2.add_to(m)
-
-# # ########## Secondary basemaps (raster data):
-# ##### CyclOSM
-basemap3 = (
-  'https://{s}.tile-cyclosm.openstreetmap.fr/cyclosm/{z}/{x}/{y}.png'
-)
-WmsTileLayer(
-  url=basemap3,
-  layers=None,
-  name='Topography Map',
-  attr='Topography Map'
-).add_to(m)
-
-# ##### ESRI sattelite imagery service
-basemap4 = (
-    'http://services.arcgisonline.com/arcgis/rest/services/World_Imagery' + '/MapServer/tile/{z}/{y}/{x}'
-)
-WmsTileLayer(
-  url=basemap4,
-  layers=None,
-  name='ESRI Sattelite Imagery',
-  attr='ESRI World Imagery'
-).add_to(m)
-
-# ##### Google sattelite imagery service
-basemap5 = (
-    'https://mt1.google.com/vt/lyrs=y&x={x}&y={y}&z={z}'
-)
-WmsTileLayer(
-  url=basemap5,
-  layers=None,
-  name='Google Sattelite Imagery',
-  attr='Google'
-).add_to(m)
+# Classified NDVI visual parameters: one color per NDVI class (class values 1 to 7), the
+# classes bounds, colors and labels are defined once in portmap.classify.NDVI_CLASSES
+ndvi_classified_params = NDVI_CLASSES.vis_params()
 
-#################### SPATIAL FEATURES LAYERS ####################
-#################### DATA ####################
-# Here I'll store all spatial features layers data variables despite their categories
-#  (all new data of same type should be added here)
-wilaya_admin_borders = os.path.join(r'layers/tipaza_admin_borders.geojson')
-municipalities_admin_borders = os.path.join(r'layers/municipalities_admin_borders.geojson')
-shoreline = os.path.join(r'layers/shoreline.geojson')
-forests_affected_zones = os.path.join(r'layers/forests_affected_zones.geojson')
-forests_preserved_natural_area = os.path.join(r'layers/forest_preserved_natural_area.geojson')
-logistic_zones = os.path.join(r'layers/logistic_zones.geojson')
-port_infrastructure = os.path.join(r'layers/port_main_infrastructure.geojson')
-construction_zones = os.path.join(r'layers/construction_zones.geojson')
-agro_farm_land = os.path.join(r'layers/agro_farm_land.geojson')
-waterways = os.path.join(r'layers/waterways.geojson')
-roads = os.path.join(r'layers/roads.geojson')
-
-# ########## Administrative features layers
-# ##### Wilaya Tipaza administrative borders
-# style defining fuction
-wilaya_admin_style_function = lambda x: {
-  'fillColor' : 'none',
-  'color' : 'red',
-  'opacity' : 0.50,
-  'weight' : 2,
-  'dashArray' : '3, 6'
-}
+# ##### analysis images (ee.Image objects) of the Earth Engine backend
+def ee_analysis(build_cache):
+  import ee
+  from portmap.timeseries import TimeSeries, periods
 
-# style change on highlight defining fuction (for the hover effect)
-wilaya_admin_highlight_function = lambda x: {
-  'fillColor': '#555555', 
-  'color':'#555555', 
-  'fillOpacity': 0.50,
-  'opacity' : 0.50,
-  'weight': 2,
-  'dashArray' : '3, 6'
-}
+  # initializing the earth engine library (not used by the local raster backend)
+  with trace.span('ee.initialize'):
+    ee.Initialize()
 
-# main function of drawing and displaying the spatial feature 
-WILAYA_ADMIN_INFO = folium.features.GeoJson(
-  wilaya_admin_borders,
-  name = 'Tipaza - Wilaya Administrative Borders',
-  control = True,
-  style_function = wilaya_admin_style_function, 
-  highlight_function = wilaya_admin_highlight_function,
-  tooltip=folium.features.GeoJsonTooltip(
-    # using fields from the geojson file
-    fields=['name', 'area', 'density', 'city_code'],
-    aliases=['Wilaya: ', 'Area (km2 ): ', 'Density (popualtion/km2): ', 'City Code: '],
-    style=("background-color: white; color: #333333; font-family: arial; font-size: 12px; padding: 10px;") # setting style for popup box
-  )
-)
-m.add_child(WILAYA_ADMIN_INFO)
-
-# ##### Tipaza - Municipalities borders
-municipalities_admin_style_function = lambda x: {
-  'fillColor' : '#555555',
-  'color' : '#331D31',
-  'fillOpacity': 0.10,
-  'opacity' : 0.50,
-  'weight' : 3,
-  'dashArray' : '2, 6'
-}
+  aoi = ee.Geometry.Point(aoi_center).buffer(aoi_radius)
 
-municipalities_admin_highlight_function = lambda x: {
-  'fillColor': '#555555', 
-  'color':'#331D31', 
-  'fillOpacity': 0.30,
-  'opacity' : 0.90,
-  'weight': 3,
-  'dashArray' : '2, 6'
-}
+  if SCENE_DATES:
+    # median composite of the cloud masked scenes (reflectances already scaled)
+    image = TimeSeries(aoi, []).composite((SCENE_DATES['start'], SCENE_DATES['end'], 'scene'))
+    image_satellite = image
+  else:
+    # Passing main Sentinel-2 imagery ID
+    image = ee.Image(SCENE)
 
-MUNICIPALITIES_ADMIN_INFO = folium.features.GeoJson(
-  municipalities_admin_borders,
-  name = 'Tipaza - Municipalities Administrative Borders',
-  control = True,
-  style_function = municipalities_admin_style_function, 
-  highlight_function = municipalities_admin_highlight_function,
-  tooltip=folium.features.GeoJsonTooltip(
-    fields=['name', 'ONS_Code'],
-    aliases=['Municipality: ', 'ONS Code: '],
-    style=("background-color: white; color: #333333; font-family: arial; font-size: 12px; padding: 10px;") 
-  )
-)
-m.add_child(MUNICIPALITIES_ADMIN_INFO)
-
-# ########## Artificial features (Infrastructure) layers
-# ##### Logistic industrial zones
-logistic_zones_style_function = lambda x: {
-  'fillColor' : '#9e57b0',
-  'color' : '#9e57b0',
-  'fillOpacity': 0.50,
-  'opacity' : 0.50,
-  'weight' : 2
-}
+    # clipping the image to study area borders
+    image_satellite = image.clip(aoi).divide(10000)
 
-logistic_zones_highlight_function = lambda x: {
-  'fillColor': '#9e57b0', 
-  'color':'#9e57b0', 
-  'fillOpacity': 0.90,
-  'opacity' : 0.90,
-  'weight': 2
-}
+  #################### Custom Visual Displays ####################
 
-LOGISTIC_ZONES_INFO = folium.features.GeoJson(
-  logistic_zones,
-  name = 'Logistic industrial zones',
-  control = True,
-  style_function = logistic_zones_style_function, 
-  highlight_function = logistic_zones_highlight_function,
-  tooltip=folium.features.GeoJsonTooltip(
-    fields=['name', 'area', 'district-jurisdiction', 'municipal-jurisdiction'],
-    aliases=['Name: ', 'Area (Ha)', 'Jurisdiction (District): ', 'Jurisdiction (Municipality): '],
-    style=("background-color: white; color: #333333; font-family: arial; font-size: 12px; padding: 10px;") 
-  )
-)
-m.add_child(LOGISTIC_ZONES_INFO)
-
-# ##### Port Main Infrastructure
-port_infrastructure_style_function = lambda x: {
-  'fillColor': '#a80223',
-  'color': '#740118',
-  'fillOpacity': 0.50,
-  'opacity': 0.50,
-  'weight': 2
-}
+  # ########## Elevation
 
-port_infrastructure_highlight_function = lambda x: {
-  'fillColor': '#a80223',
-  'color': '#740118',
-  'fillOpacity': 0.90,
-  'opacity': 1,
-  'weight': 2
-}
+  # ##### NASA DEM (Digital Elevation Model) collection: 30m resolution
+  dem = ee.Image('CGIAR/SRTM90_V4').clip(aoi)
 
-PORT_INFRASTRUCTURE_INFO = folium.features.GeoJson(
-  port_infrastructure,
-  name = 'Port Main Infrastructure',
-  control = True,
-  style_function = port_infrastructure_style_function, 
-  highlight_function = port_infrastructure_highlight_function,
-  tooltip=folium.features.GeoJsonTooltip(
-    fields=['name', 'area'],
-    aliases=['Name: ', 'Area (Ha): '],
-    style=("background-color: white; color: #333333; font-family: arial; font-size: 12px; padding: 10px;") 
-  )
-)
-m.add_child(PORT_INFRASTRUCTURE_INFO)
-
-# ##### Construction zones
-construction_zones_style_function = lambda x: {
-  'fillColor': '#0000ff',
-  'color': '#0b8a03',
-  'fillOpacity': 0.50,
-  'opacity': 0.50,
-  'weight': 4,
-  'dashArray' : '3, 6'
-}
+  # ##### Elevation
+  # deriving elevation from previous DEM
+  elevation = dem.select('elevation').clip(aoi)
 
-construction_zones_highlight_function = lambda x: {
-  'fillColor': '#0000ff',
-  'color': '#0b8a03',
-  'fillOpacity': 0.80,
-  'opacity': 0.90,
-  'weight': 4,
-  'dashArray' : '3, 6'
-}
+  # ##### Slopes (30m resolution)
+  # deriving slopes from previous DEM through Elevation
+  slopes = ee.Terrain.slope(elevation).clip(aoi)
 
-CONSTRUCTION_ZONES_INFO = folium.features.GeoJson(
-  construction_zones,
-  name = 'Construction Zones',
-  control = True,
-  style_function = construction_zones_style_function, 
-  highlight_function = construction_zones_highlight_function,
-  tooltip=folium.features.GeoJsonTooltip(
-    fields=['name', 'zone-designation', 'area'],
-    aliases=['Name: ', 'Zone designation: ', 'Area: '],
-    style=("background-color: white; color: #333333; font-family: arial; font-size: 12px; padding: 10px;")
-  )
-)
-m.add_child(CONSTRUCTION_ZONES_INFO)
-
-# roads / mobility infrastructure
-roads_style_function = lambda x: {
-  'color' : x['properties']['stroke'],
-  'opacity' : 0.50,
-  'weight' : x['properties']['stroke-width'],
-  'dashArray' : x['properties']['dashArray']
-}
+  ####################  INDECES #################### 
+  # ##### NDVI (Normalized Difference Vegetation Index)
+  # defining NDVI compue function that normalizes the differences between two bands
+  def getNDVI(image):
+    return image.normalizedDifference(['B8', 'B4'])
 
-roads_highlight_function = lambda x: {
-  'color' : x['properties']['stroke'],
-  'opacity' : 0.9,
-  'weight' : x['properties']['stroke-width'],
-  'dashArray' : x['properties']['dashArray-highlight']
-}
+  # clipping to AOI
+  ndvi = getNDVI(image.clip(aoi))
 
-ROADS_INFO = folium.features.GeoJson(
-  roads,
-  name = 'Roads - Port access infrastructure',
-  control = True,
-  style_function = roads_style_function, 
-  highlight_function = roads_highlight_function,
-  tooltip=folium.features.GeoJsonTooltip(
-    fields=['Type', 'Name'],
-    aliases=['Type: ', 'Name: '],
-    style=("background-color: white; color: #333333; font-family: arial; font-size: 12px; padding: 10px;") 
-  )
-)
-m.add_child(ROADS_INFO)
-
-# ########## Natural features layers
-# ##### Shoreline
-folium.GeoJson(
-  shoreline,
-  name = 'Shoreline',
-  tooltip = 'Shoreline',
-  style_function = lambda feature : {
-    'fillColor' : 'none',
-    'color' : '#0070ec',
-    'weight' : 8,
-    'opacity' : 0.50,
-  }
-).add_to(m)
-
-# ##### Affected Forests zones
-forests_az_style_function = lambda x: {
-  'fillColor' : '#145B27',
-  'color' : '#145B27',
-  'fillOpacity' : 0.50,
-  'opacity' : 0.50,
-  'weight' : 2
-}
+  # ##### NDWI (Normalized Difference Water Index)
+  def getNDWI(image):
+    return image.normalizedDifference(['B3', 'B11'])
 
-forests_az_highlight_function = lambda x: {
-  'fillColor': '#177A31', 
-  'color':'#145B27', 
-  'fillOpacity': 0.80,
-  'opacity' : 0.50,
-  'weight': 2
-}
+  ndwi = getNDWI(image.clip(aoi))
 
-FORESTS_AFFECTED_INFO = folium.features.GeoJson(
-  forests_affected_zones,
-  name = 'Forests - Affected Zones',
-  control = True,
-  style_function = forests_az_style_function, 
-  highlight_function = forests_az_highlight_function,
-  tooltip=folium.features.GeoJsonTooltip(
-    fields=['name', 'type', 'status', 'section', 'ilot', 'area'],
-    aliases=['Name: ', 'Type: ', 'Project status: ', 'Section: ', 'Ilot: ', 'Superficie Touchee (Ha): '],
-    style=("background-color: white; color: #333333; font-family: arial; font-size: 12px; padding: 10px;") 
-  )
-)
-m.add_child(FORESTS_AFFECTED_INFO)
-
-# ##### Preserved Natural Forest Area
-forests_pz_style_function = lambda x: {
-  'fillColor' : '#0b8a03',
-  'color' : '#0b8a03',
-  'fillOpacity' : 0.50,
-  'opacity' : 0.50,
-  'weight' : 2,
-  'dashArray' : '3, 6'
-}
+  # ########## IMAGES MASKS
+  # Mask the non-watery parts of the image, where NDVI ratio value > 0.0
+  ndvi_masked = ndvi.updateMask(ndvi.gte(0))
 
-forests_pz_highlight_function = lambda x: {
-  'fillColor': '#0b8a03',
-  'color':'#0b8a03', 
-  'fillOpacity': 0.80,
-  'opacity' : 0.50,
-  'weight': 2,
-  'dashArray' : '3, 6'
-}
+  # NDWI Masking: NDWI > 0.1
+  ndwi_masked = ndwi.updateMask(ndwi.gte(0.1))
 
-FORESTS_PRESERVED_INFO = folium.features.GeoJson(
-  forests_preserved_natural_area,
-  name = 'Forests - Preserved Natural Zones',
-  control = True,
-  style_function = forests_pz_style_function, 
-  highlight_function = forests_pz_highlight_function,
-  tooltip=folium.features.GeoJsonTooltip(
-    fields=['name', 'type', 'status', 'area'],
-    aliases=['Name: ', 'Type: ', 'Project status: ', 'Superficie (Ha): '],
-    style=("background-color: white; color: #333333; font-family: arial; font-size: 12px; padding: 10px;") 
-  )
-)
-m.add_child(FORESTS_PRESERVED_INFO)
-
-# ##### Agricultural and Farm lands
-agro_farm_land_style_function = lambda x: {
-  'fillColor' : '#00c632',
-  'color' : '#607254',
-  'fillOpacity' : 0.50,
-  'opacity' : 0.50,
-  'weight' : 2,
-  'dashArray' : '3, 6'
-}
+  # ########## ANALYSIS RESULTS CLASSIFICATION
+  # ##### NDVI classification: 7 classes (single pass over the NDVI_CLASSES bounds, NDVI < 0 masked)
+  ndvi_classified = NDVI_CLASSES.ee_classify(ndvi)
 
-agro_farm_land_highlight_function = lambda x: {
-  'fillColor': '#00c632', 
-  'color':'#607254', 
-  'fillOpacity': 0.80,
-  'opacity' : 0.50,
-  'weight': 2,
-  'dashArray' : '3, 6'
-}
+  # ########## TIME SERIES
+  # monthly composites over the TIME_SERIES date range
+  time_series = None
+  if TIME_SERIES:
+    time_series = TimeSeries(aoi, periods(TIME_SERIES['start'], TIME_SERIES['end'], TIME_SERIES.get('months', 1)), cache=build_cache)
 
-AGRO_FARM_LAND_INFO = folium.features.GeoJson(
-  agro_farm_land,
-  name = 'Agricultural and Farm lands',
-  control = True,
-  style_function = agro_farm_land_style_function, 
-  highlight_function = agro_farm_land_highlight_function,
-  tooltip=folium.features.GeoJsonTooltip(
-    fields=['designation', 'status'],
-    aliases=['Land designation: ', 'Project status: '],
-    style=("background-color: white; color: #333333; font-family: arial; font-size: 12px; padding: 10px;") 
-  )
-)
-m.add_child(AGRO_FARM_LAND_INFO)
-
-# ##### Waterways
-waterways_style_function = lambda x: {
-  'fillColor' : '#75cff0',
-  'color' :  '#75cff0',
-  'fillOpacity' : 0.50,
-  'opacity' : 0.50,
-  'weight' : 2,
-}
+  return {
+    'aoi': aoi, 'satellite': image_satellite, 'dem': dem, 'elevation': elevation, 'slopes': slopes, 'ndvi': ndvi,
+    'ndwi': ndwi, 'ndvi_masked': ndvi_masked, 'ndwi_masked': ndwi_masked, 'ndvi_classified': ndvi_classified,
+    'time_series': time_series, 'local_engine': None
+  }
 
-waterways_highlight_function = lambda x: {
-  'fillColor': '#75cff0', 
-  'color': '#75cff0', 
-  'fillOpacity': 0.80,
-  'opacity' : 0.9,
-  'weight': 4,
-}
+# ########## Local analysis
+# same products computed with NumPy from the LOCAL_RASTERS files (see portmap.raster)
+def local_analysis():
+  from portmap.raster import LocalEngine
+  analysis = dict.fromkeys(['aoi', 'satellite', 'dem', 'elevation', 'slopes', 'ndvi', 'ndwi', 'ndvi_masked',
+                            'ndwi_masked', 'ndvi_classified', 'time_series'])
+  analysis['local_engine'] = LocalEngine(LOCAL_RASTERS, aoi_center, aoi_radius, output_dir=LOCAL_DIR)
+  return analysis
 
-WATERWAYS_INFO = folium.features.GeoJson(
-  waterways,
-  name = 'Waterways',
-  control = True,
-  style_function = waterways_style_function, 
-  highlight_function = waterways_highlight_function,
-  tooltip=folium.features.GeoJsonTooltip(
-    fields=['name', 'type'],
-    aliases=['Name: ', 'Type: '],
-    style=("background-color: white; color: #333333; font-family: arial; font-size: 12px; padding: 10px;") 
-  )
-)
-m.add_child(WATERWAYS_INFO)
+###########################################################
+#################### MAIN PROJECT MAP ####################
+# setting up the main map for the project
+def base_map():
+  import folium
+  from folium import WmsTileLayer
+  from folium.plugins import MiniMap
 
-############################################################
-#################### COMPUTED RASTER LAYERS ####################
+  m = folium.Map(location = MAP_LOCATION, tiles='OpenStreetMap', zoom_start = MAP_ZOOM, control_scale = True)
+
+  # setting up a minimap for general orientation when on zoom
+  miniMap = MiniMap(
+    toggle_display = True,
+    zoom_level_offset = -5,
+    tile_layer='cartodbdark_matter',
+    width=140,
+    height=100
+  ).add_to(m)
 
-# adding main satellite image as layer
-m.add_ee_layer(image_satellite, image_params, 'Sentinel-2 True Colors')
+  m.add_child(miniMap)
 
-# ##### SRTM elevation & slopes
-# adding DEM layer
-#m.add_ee_layer(dem, dem_params, 'NASA DEM 30m')
 
-# adding SRTM elevation layer
-m.add_ee_layer(elevation, elevation_params, 'Elevation')
+  #################### BASEMAPS ####################
+  # Adding different types of basemaps helps better visualize the different map features.
 
-# adding slopes layer
-m.add_ee_layer(slopes, slopes_params, 'Slopes')
+  # ########## Primary basemaps (victor data):
+  basemap1 = folium.TileLayer('stamenterrain', name='Stamen Terrain')
+  # basemap1.add_to(m)
 
-# adding NDVI layer to the map
-m.add_ee_layer(ndvi_masked, ndvi_params, 'NDVI')
+  basemap2 = folium.TileLayer('cartodbdark_matter', name='Dark Matter')
+  basemap2.add_to(m)
 
-# adding Classified NDVI layer to the map
-m.add_ee_layer(ndvi_classified, ndvi_classified_params, 'NDVI - Classified')
+  # # ########## Secondary basemaps (raster data):
+  # ##### CyclOSM
+  basemap3 = (
+    'https://{s}.tile-cyclosm.openstreetmap.fr/cyclosm/{z}/{x}/{y}.png'
+  )
+  WmsTileLayer(
+    url=basemap3,
+    layers=None,
+    name='Topography Map',
+    attr='Topography Map'
+  ).add_to(m)
+
+  # ##### ESRI sattelite imagery service
+  basemap4 = (
+      'http://services.arcgisonline.com/arcgis/rest/services/World_Imagery' + '/MapServer/tile/{z}/{y}/{x}'
+  )
+  WmsTileLayer(
+    url=basemap4,
+    layers=None,
+    name='ESRI Sattelite Imagery',
+    attr='ESRI World Imagery'
+  ).add_to(m)
+
+  # ##### Google sattelite imagery service
+  basemap5 = (
+      'https://mt1.google.com/vt/lyrs=y&x={x}&y={y}&z={z}'
+  )
+  WmsTileLayer(
+    url=basemap5,
+    layers=None,
+    name='Google Sattelite Imagery',
+    attr='Google'
+  ).add_to(m)
+
+  return m
+
+#################### SPATIAL FEATURES LAYERS ####################
+# ########## Vector layers registry
+# Every vector layer is described here (all new layers should be added to this table):
+# - style/highlight: Leaflet path style, and style on hover (the hover effect)
+# - style_properties/highlight_properties: style keys read from the features properties
+# - tooltip_fields/tooltip_aliases: fields from the geojson file shown in the tooltip box
+# - tolerance: simplification tolerance in degrees (0.0001 ~ 10m, topology preserving), the
+#   coordinates are truncated to 5 decimals (~1m) and only the properties used by the
+#   tooltip/style are embedded in the map
+# - eager: embedded and shown on load in the 'lazy' vector mode
+# - transport: 'topojson' for the layers sharing long borders (smaller than the plain GeoJSON,
+#   compare the layers with: python -m portmap.topojson)
+# - lod: zoom levels of the simplified variants fetched and drawn when zoomed out in the 'lazy'
+#   vector mode, the full layer being drawn from the last one on (vertices per level: python
+#   webmap.py stats)
+VECTOR_LAYERS = [
+  # ########## Administrative features layers
+  # ##### Wilaya Tipaza administrative borders
+  VectorLayer(
+    name = 'Tipaza - Wilaya Administrative Borders',
+    path = os.path.join(r'layers/tipaza_admin_borders.geojson'),
+    style = {'fillColor': 'none', 'color': 'red', 'opacity': 0.50, 'weight': 2, 'dashArray': '3, 6'},
+    highlight = {'fillColor': '#555555', 'color': '#555555', 'fillOpacity': 0.50, 'opacity': 0.50, 'weight': 2, 'dashArray': '3, 6'},
+    tooltip_fields = ['name', 'area', 'density', 'city_code'],
+    tooltip_aliases = ['Wilaya: ', 'Area (km2 ): ', 'Density (popualtion/km2): ', 'City Code: '],
+    tolerance = 0.0001,
+    transport = 'topojson',
+    lod = [8, 10, 12, 14]
+  ),
+
+  # ##### Tipaza - Municipalities borders
+  VectorLayer(
+    name = 'Tipaza - Municipalities Administrative Borders',
+    path = os.path.join(r'layers/municipalities_admin_borders.geojson'),
+    style = {'fillColor': '#555555', 'color': '#331D31', 'fillOpacity': 0.10, 'opacity': 0.50, 'weight': 3, 'dashArray': '2, 6'},
+    highlight = {'fillColor': '#555555', 'color': '#331D31', 'fillOpacity': 0.30, 'opacity': 0.90, 'weight': 3, 'dashArray': '2, 6'},
+    tooltip_fields = ['name', 'ONS_Code'],
+    tooltip_aliases = ['Municipality: ', 'ONS Code: '],
+    tolerance = 0.0001,
+    transport = 'topojson',
+    lod = [8, 10, 12, 14]
+  ),
+
+  # ########## Artificial features (Infrastructure) layers
+  # ##### Logistic industrial zones
+  VectorLayer(
+    name = 'Logistic industrial zones',
+    path = os.path.join(r'layers/logistic_zones.geojson'),
+    style = {'fillColor': '#9e57b0', 'color': '#9e57b0', 'fillOpacity': 0.50, 'opacity': 0.50, 'weight': 2},
+    highlight = {'fillColor': '#9e57b0', 'color': '#9e57b0', 'fillOpacity': 0.90, 'opacity': 0.90, 'weight': 2},
+    tooltip_fields = ['name', 'area', 'district-jurisdiction', 'municipal-jurisdiction'],
+    tooltip_aliases = ['Name: ', 'Area (Ha)', 'Jurisdiction (District): ', 'Jurisdiction (Municipality): '],
+    tolerance = 0.00002,
+    eager = True,
+    zonal = ['ndvi', 'slopes', 'elevation']
+  ),
+
+  # ##### Port Main Infrastructure
+  VectorLayer(
+    name = 'Port Main Infrastructure',
+    path = os.path.join(r'layers/port_main_infrastructure.geojson'),
+    style = {'fillColor': '#a80223', 'color': '#740118', 'fillOpacity': 0.50, 'opacity': 0.50, 'weight': 2},
+    highlight = {'fillColor': '#a80223', 'color': '#740118', 'fillOpacity': 0.90, 'opacity': 1, 'weight': 2},
+    tooltip_fields = ['name', 'area'],
+    tooltip_aliases = ['Name: ', 'Area (Ha): '],
+    tolerance = 0.00002,
+    eager = True
+  ),
+
+  # ##### Construction zones
+  VectorLayer(
+    name = 'Construction Zones',
+    path = os.path.join(r'layers/construction_zones.geojson'),
+    style = {'fillColor': '#0000ff', 'color': '#0b8a03', 'fillOpacity': 0.50, 'opacity': 0.50, 'weight': 4, 'dashArray': '3, 6'},
+    highlight = {'fillColor': '#0000ff', 'color': '#0b8a03', 'fillOpacity': 0.80, 'opacity': 0.90, 'weight': 4, 'dashArray': '3, 6'},
+    tooltip_fields = ['name', 'zone-designation', 'area'],
+    tooltip_aliases = ['Name: ', 'Zone designation: ', 'Area: '],
+    tolerance = 0.00002,
+    eager = True,
+    zonal = ['ndvi', 'slopes', 'elevation']
+  ),
+
+  # ##### Roads / mobility infrastructure (color, width and dashes of each road read from its properties)
+  VectorLayer(
+    name = 'Roads - Port access infrastructure',
+    path = os.path.join(r'layers/roads.geojson'),
+    style = {'opacity': 0.50},
+    style_properties = {'color': 'stroke', 'weight': 'stroke-width', 'dashArray': 'dashArray'},
+    highlight = {'opacity': 0.9},
+    highlight_properties = {'color': 'stroke', 'weight': 'stroke-width', 'dashArray': 'dashArray-highlight'},
+    tooltip_fields = ['Type', 'Name'],
+    tooltip_aliases = ['Type: ', 'Name: '],
+    tolerance = 0.00002,
+    eager = True
+  ),
+
+  # ########## Natural features layers
+  # ##### Shoreline
+  VectorLayer(
+    name = 'Shoreline',
+    path = os.path.join(r'layers/shoreline.geojson'),
+    style = {'fillColor': 'none', 'color': '#0070ec', 'weight': 8, 'opacity': 0.50},
+    tooltip_text = 'Shoreline',
+    tolerance = 0.00005,
+    transport = 'topojson'
+  ),
+
+  # ##### Affected Forests zones
+  VectorLayer(
+    name = 'Forests - Affected Zones',
+    path = os.path.join(r'layers/forests_affected_zones.geojson'),
+    style = {'fillColor': '#145B27', 'color': '#145B27', 'fillOpacity': 0.50, 'opacity': 0.50, 'weight': 2},
+    highlight = {'fillColor': '#177A31', 'color': '#145B27', 'fillOpacity': 0.80, 'opacity': 0.50, 'weight': 2},
+    tooltip_fields = ['name', 'type', 'status', 'section', 'ilot', 'area'],
+    tooltip_aliases = ['Name: ', 'Type: ', 'Project status: ', 'Section: ', 'Ilot: ', 'Superficie Touchee (Ha): '],
+    tolerance = 0.00002,
+    zonal = ['ndvi', 'ndvi_classified', 'slopes']
+  ),
+
+  # ##### Preserved Natural Forest Area
+  VectorLayer(
+    name = 'Forests - Preserved Natural Zones',
+    path = os.path.join(r'layers/forest_preserved_natural_area.geojson'),
+    style = {'fillColor': '#0b8a03', 'color': '#0b8a03', 'fillOpacity': 0.50, 'opacity': 0.50, 'weight': 2, 'dashArray': '3, 6'},
+    highlight = {'fillColor': '#0b8a03', 'color': '#0b8a03', 'fillOpacity': 0.80, 'opacity': 0.50, 'weight': 2, 'dashArray': '3, 6'},
+    tooltip_fields = ['name', 'type', 'status', 'area'],
+    tooltip_aliases = ['Name: ', 'Type: ', 'Project status: ', 'Superficie (Ha): '],
+    tolerance = 0.00002,
+    zonal = ['ndvi', 'ndvi_classified', 'slopes']
+  ),
+
+  # ##### Agricultural and Farm lands
+  VectorLayer(
+    name = 'Agricultural and Farm lands',
+    path = os.path.join(r'layers/agro_farm_land.geojson'),
+    style = {'fillColor': '#00c632', 'color': '#607254', 'fillOpacity': 0.50, 'opacity': 0.50, 'weight': 2, 'dashArray': '3, 6'},
+    highlight = {'fillColor': '#00c632', 'color': '#607254', 'fillOpacity': 0.80, 'opacity': 0.50, 'weight': 2, 'dashArray': '3, 6'},
+    tooltip_fields = ['designation', 'status'],
+    tooltip_aliases = ['Land designation: ', 'Project status: '],
+    tolerance = 0.00002,
+    zonal = ['ndvi', 'ndwi', 'ndvi_classified']
+  ),
+
+  # ##### Waterways
+  VectorLayer(
+    name = 'Waterways',
+    path = os.path.join(r'layers/waterways.geojson'),
+    style = {'fillColor': '#75cff0', 'color': '#75cff0', 'fillOpacity': 0.50, 'opacity': 0.50, 'weight': 2},
+    highlight = {'fillColor': '#75cff0', 'color': '#75cff0', 'fillOpacity': 0.80, 'opacity': 0.9, 'weight': 4},
+    tooltip_fields = ['name', 'type'],
+    tooltip_aliases = ['Name: ', 'Type: '],
+    tolerance = 0.00002
+  )
+]
 
-# adding NDWI layer to the map
-m.add_ee_layer(ndwi_masked, ndwi_params, 'NDWI')
+############################################################
+#################### COMPUTED RASTER LAYERS ####################
+# ########## Raster layers registry
+# ee image and its local backend product (layers without a local product are skipped offline)
+def raster_layers(analysis):
+  layers = [
+    # main satellite image
+    RasterLayer('Sentinel-2 True Colors', analysis['satellite'], image_params, local='true_colors'),
+
+    # ##### SRTM elevation & slopes
+    # DEM layer
+    #RasterLayer('NASA DEM 30m', analysis['dem'], dem_params),
+
+    # SRTM elevation layer
+    RasterLayer('Elevation', analysis['elevation'], elevation_params, local='elevation',
+                values={'min': -500, 'max': 9000, 'unit': ' m', 'decimals': 1}),
+
+    # slopes layer
+    RasterLayer('Slopes', analysis['slopes'], slopes_params, local='slopes', values={'min': 0, 'max': 90, 'unit': '°', 'decimals': 1}),
+
+    # NDVI layer
+    RasterLayer('NDVI', analysis['ndvi_masked'], ndvi_params, local='ndvi_masked', values={'min': -1, 'max': 1, 'decimals': 3}),
+
+    # Classified NDVI layer
+    RasterLayer('NDVI - Classified', analysis['ndvi_classified'], ndvi_classified_params, local='ndvi_classified'),
+
+    # NDWI layer
+    RasterLayer('NDWI', analysis['ndwi_masked'], ndwi_params, local='ndwi_masked', values={'min': -1, 'max': 1, 'decimals': 3})
+  ]
+
+  # ########## Time series layers (Earth Engine only): last period indices and NDVI change since the first one
+  time_series = analysis['time_series']
+  if time_series is not None:
+    first, last = time_series.periods[0], time_series.periods[-1]
+    layers += [
+      RasterLayer('NDVI - {}'.format(last[2]), time_series.ndvi(last).updateMask(time_series.ndvi(last).gte(0)), ndvi_params),
+      RasterLayer('NDWI - {}'.format(last[2]), time_series.ndwi(last).updateMask(time_series.ndwi(last).gte(0.1)), ndwi_params),
+      RasterLayer('NDVI change since {}'.format(first[2]), time_series.ndvi_change(last), ndvi_change_params)
+    ]
+  return layers
+
+# ########## Overlay analysis layer
+def overlay_layer(build_cache):
+  from portmap import overlay
+  return VectorLayer(
+    name = 'Overlay - Affected areas',
+    # (layers read from the VECTOR_LAYERS files: a site's own or filtered layers in batch builds)
+    path = overlay.run(overlay.from_vector_layers(overlay.OVERLAY_SOURCES, VECTOR_LAYERS),
+                       overlay.from_vector_layers(overlay.OVERLAY_TARGETS, VECTOR_LAYERS),
+                       output_dir=ANALYSIS_DIR, cache=build_cache),
+    style = {'fillColor': '#ff0000', 'color': '#ff0000', 'fillOpacity': 0.40, 'opacity': 0.80, 'weight': 3},
+    highlight = {'fillColor': '#ff0000', 'color': '#ff0000', 'fillOpacity': 0.70, 'opacity': 1, 'weight': 4},
+    tooltip_fields = ['source', 'target_layer', 'target', 'area_ha', 'target_share', 'length_m', 'crossings'],
+    tooltip_aliases = ['Project: ', 'Affected layer: ', 'Affected: ', 'Area (Ha): ', 'Share of the affected feature (%): ', 'Length (m): ', 'Crossings: '],
+    tolerance = 0.00002
+  )
 
-#################### Layer controller ####################
+# ########## Zonal statistics rasters
+# rasters summarized over the features of the vector layers listing them in 'zonal' (statistics
+# added to the features properties and tooltips, see portmap.zonal)
+def zonal_rasters(analysis):
+  return {
+    'ndvi': ZonalRaster('NDVI', analysis['ndvi'], local='ndvi', scale=10, histogram=[-1, 1, 10]),
+    'ndwi': ZonalRaster('NDWI', analysis['ndwi'], local='ndwi', scale=20, histogram=[-1, 1, 10]),
+    'slopes': ZonalRaster('Slope', analysis['slopes'], local='slopes', scale=30, histogram=[0, 45, 9]),
+    'elevation': ZonalRaster('Elevation', analysis['elevation'], local='elevation', scale=30, histogram=[0, 500, 10]),
+    'ndvi_classified': ZonalRaster('NDVI classes', analysis['ndvi_classified'], local='ndvi_classified', scale=10, classes=NDVI_CLASSES)
+  }
 
-folium.LayerControl(collapsed=True).add_to(m)
+#################### NDVI CLASSES AREAS ####################
+# pixels count and hectares of each NDVI class over the AOI (stored in the build cache)
+def ndvi_areas(analysis, build_cache):
+  local_engine = analysis['local_engine']
+  if local_engine is None:
+    from portmap.ee_cache import cache_key
+    key = build_cache.key('areas', cache_key(analysis['ndvi_classified'], {}))
+  else:
+    key = build_cache.key('areas', local_engine.fingerprint('ndvi_classified'))
+  entry = build_cache.read(key) if build_cache.enabled else None
+  if entry is None:
+    if local_engine is None:
+      areas = NDVI_CLASSES.ee_areas(analysis['ndvi_classified'], analysis['aoi'], scale=10)
+    else:
+      areas = local_engine.value_areas('ndvi_classified')
+    entry = {'areas': [[value, pixels, area] for value, (pixels, area) in areas.items()]}
+    if build_cache.enabled:
+      build_cache.write(key, entry)
+  return {value: (pixels, area) for value, pixels, area in entry['areas']}
 
 #################### MAP LEGEND ####################
 #<link rel="stylesheet" href="style.css">
@@ -672,12 +660,7 @@ legend_setup = """
         <div class='legend-scale' id="NDVI">
             <h4>NDVI</h4>
             <ul class='legend-labels'>
-                <li><span style='background:#ed5e3d;opacity:0.8;'></span>0.0 - 0.1 : Bareland / Settlements</li>
-                <li><span style='background:#fec978;opacity:0.8;'></span>0.1 - 0.25 : Low vegeation</li>
-                <li><span style='background:#f9f7ae;opacity:0.8;'></span>0.25 - 0.35 : Crops</li>
-                <li><span style='background:#9ed569;opacity:0.8;'></span>0.35 - 0.55 : Low vegetation</li>
-                <li><span style='background:#229b51;opacity:0.8;'></span>0.55 - 0.75 : High vegetation</li>
-                <li><span style='background:#006837;opacity:0.8;'></span>> 0.75 : Forest</li>
+                {{ this.ndvi_classes }}
             </ul>
         </div>
 
@@ -742,17 +725,177 @@ legend_setup = """
 {% endmacro %}
 """
 
-# configuring the legend
-legend = MacroElement()
-legend._template = Template(legend_setup)
-
-# adding legend to the map
-m.get_root().add_child(legend)
-
-#################### Creating the map file #################### 
-
-# Generating a file for the map and setting it to open on default browser
-m.save('webmap.html')
-
-# Opening the map file in default browser on execution
-webbrowser.open('webmap.html')
\ No newline at end of file
+# configuring the legend (rebuilt when its template, the NDVI classes or the ui stylesheet change)
+def legend_element(ndvi_legend):
+  from branca.element import Template, MacroElement
+  legend = MacroElement()
+  legend._template = Template(legend_setup)
+  legend.ndvi_classes = ndvi_legend
+  return legend, {}
+
+#################### MAP BUILD ####################
+# ##### building the map into MAP_FILE:
+# vector_only: only the vector layers (no raster analysis, zonal statistics or NDVI areas: no
+# Earth Engine and no raster files needed)
+# offline: never calls Earth Engine, the raster layers are computed locally from the
+# LOCAL_RASTERS files (RASTER_BACKEND = 'local'), or left out if these files are missing
+# returns the layers builder and the build cache (layers payload, timings, steps...)
+def build(vector_only=False, offline=False, open_browser=True):
+  profiler = trace.Profiler(cpu=PROFILE in ('cpu', 'all'), memory=PROFILE in ('memory', 'all'))
+  profiler.start()
+  # (the trace and profiler are stopped, their outputs written, when the build fails as well)
+  try:
+    if TRACE:
+      trace.start(chrome=os.path.join(trace.TRACE_DIR, 'build.trace.json') if TRACE == 'chrome' else None)
+
+    import folium
+    from portmap.build import LayerBuilder
+    from portmap.incremental import BuildCache, file_digest
+    from portmap.zonal import ZonalStats
+
+    build_cache = BuildCache(enabled=INCREMENTAL)
+
+    backend = None if vector_only else RASTER_BACKEND
+    if offline and backend == 'ee':
+      missing = [path for path in LOCAL_RASTERS.values() if not os.path.exists(path)]
+      backend = None if missing else 'local'
+      if missing:
+        print('Offline build without raster layers (missing: {})'.format(', '.join(missing)))
+    analysis = None
+    if backend == 'ee':
+      analysis = ee_analysis(build_cache)
+    elif backend == 'local':
+      analysis = local_analysis()
+
+    m = base_map()
+
+    vector_layers = list(VECTOR_LAYERS)
+    if OVERLAY:
+      with build_cache.step('overlay'):
+        vector_layers.append(overlay_layer(build_cache))
+
+    #################### LAYERS BUILD ####################
+    # preparing all the registered layers concurrently (files preprocessing, Earth Engine map ids
+    # reused from the .cache/ee cache or requested, local tiles cache) then adding them to the map
+    # in the registry order, see portmap.build
+    local_engine = analysis['local_engine'] if analysis is not None else None
+    zonal = ZonalStats(zonal_rasters(analysis), local_engine=local_engine) if analysis is not None else None
+    builder = LayerBuilder(vector_mode=VECTOR_MODE, ee_tiles=EE_TILES, ee_tiles_zoom=EE_TILES_ZOOM, aoi_bounds=aoi_bounds, cache=build_cache,
+                           local_engine=local_engine, zonal=zonal, renderer=RENDERER, data_dir=DATA_DIR, tiles_root=TILES_ROOT,
+                           value_tiles=VALUE_TILES)
+    with build_cache.step('layers'):
+      builder.build(m, vector_layers + (raster_layers(analysis) if analysis is not None else []))
+
+    #################### TIME SERIES ####################
+    # mean NDVI/NDWI of the project zones for every period (one batched reduction of the new periods)
+    time_series = analysis['time_series'] if analysis is not None else None
+    if time_series is not None:
+      from portmap.timeseries import write_csv as write_time_series
+      with build_cache.step('time series'):
+        zones_series, reduced = time_series.zone_series({layer.name: layer.path for layer in VECTOR_LAYERS
+                                                         if layer.name in TIME_SERIES_ZONES})
+        os.makedirs(ANALYSIS_DIR, exist_ok=True)
+        write_time_series(zones_series, os.path.join(ANALYSIS_DIR, 'timeseries.csv'))
+        print('time series: {} periods, {} reduced, {} from the cache'.format(
+          len(time_series.periods), reduced, len(time_series.periods) - reduced))
+
+    ndvi_class_areas = None
+    if analysis is not None:
+      with build_cache.step('ndvi classes'):
+        ndvi_class_areas = ndvi_areas(analysis, build_cache)
+        print(NDVI_CLASSES.report(ndvi_class_areas, title='NDVI classes'))
+
+    #################### Layer controller ####################
+
+    folium.LayerControl(collapsed=True).add_to(m)
+
+    # adding legend to the map
+    ndvi_legend = NDVI_CLASSES.legend(ndvi_class_areas)
+    with build_cache.step('legend'):
+      legend, _ = build_cache.fragment('Legend', build_cache.key('legend', legend_setup, ndvi_legend, file_digest('src/ui.css')), m.get_root(),
+                                       lambda: legend_element(ndvi_legend))
+      m.get_root().add_child(legend)
+
+    #################### Creating the map file #################### 
+
+    # Generating a file for the map and setting it to open on default browser
+    with build_cache.step('save'):
+      m.save(MAP_FILE)
+      trace.count('bytes_written', os.path.getsize(MAP_FILE))
+
+    if BUNDLE:
+      from portmap import bundle
+      with build_cache.step('bundle'):
+        bundle.build(MAP_FILE, BUNDLE, download=not offline)
+
+    # build steps timing, reused vs rebuilt layers
+    print(build_cache.report())
+  finally:
+    if TRACE:
+      print(trace.stop())
+    profiler.stop()
+
+  # Opening the map file in default browser on execution
+  if open_browser:
+    webbrowser.open(MAP_FILE)
+  return builder, build_cache
+
+# ##### features, vertices and bytes of every vector layer before/after preprocessing (the
+# payload embedded in the map), without building it
+def stats():
+  from portmap.lod import lod_report, variants
+  from portmap.preprocess import PRECISION, payload_report, preprocess_layer
+  processed = [(layer, preprocess_layer(layer.path, tolerance=layer.tolerance, precision=PRECISION,
+                                        keep=layer.used_properties())) for layer in VECTOR_LAYERS]
+  print(payload_report([layer_stats for _, (_, layer_stats) in processed]))
+  levels = {layer.name: [(zoom, level_stats['vertices']) for zoom, _, level_stats in variants(data, layer.lod, layer.tolerance, PRECISION)]
+            for layer, (data, _) in processed if layer.lod}
+  if levels:
+    print(lod_report(levels))
+
+# ##### serving the map over http (needed by the 'mvt'/'lazy' vector modes and the mbtiles tiles),
+# the BUNDLE directory when the map was bundled
+def serve(port=8000):
+  if BUNDLE and os.path.exists(os.path.join(BUNDLE, 'manifest.json')):
+    from portmap.bundle import serve as serve_bundle
+    serve_bundle(BUNDLE, port)
+  else:
+    from portmap.ee_tiles import serve as serve_directory
+    serve_directory('.', port)
+
+#################### COMMAND LINE ####################
+#   python webmap.py                         (same as build)
+#   python webmap.py build [--vector-only] [--offline] [--no-browser]
+#   python webmap.py stats
+#   python webmap.py serve [--port 8000]
+#   python webmap.py batch sites.json [--workers 4] [--vector-only] [--offline]
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Cherchell port environmental study webmap')
+  commands = parser.add_subparsers(dest='command')
+  build_parser = commands.add_parser('build', help='build {}'.format(MAP_FILE))
+  build_parser.add_argument('--vector-only', action='store_true', help='only the vector layers (no raster analysis)')
+  build_parser.add_argument('--offline', action='store_true', help='no Earth Engine: local raster backend or no rasters')
+  build_parser.add_argument('--no-browser', action='store_true', help="don't open the map once built")
+  commands.add_parser('stats', help='vector layers payload before/after preprocessing')
+  serve_parser = commands.add_parser('serve', help='serve the map over http')
+  serve_parser.add_argument('--port', type=int, default=8000)
+  batch_parser = commands.add_parser('batch', help='build the map of every site of a sites file (see portmap.sites)')
+  batch_parser.add_argument('sites', help='JSON list of sites')
+  batch_parser.add_argument('--workers', type=int, default=None, help='sites built in parallel')
+  batch_parser.add_argument('--vector-only', action='store_true', help='only the vector layers (no raster analysis)')
+  batch_parser.add_argument('--offline', action='store_true', help='no Earth Engine: local raster backend or no rasters')
+  args = parser.parse_args(argv)
+  if args.command == 'stats':
+    stats()
+  elif args.command == 'batch':
+    from portmap.sites import WORKERS, build_sites, load_sites
+    build_sites(load_sites(args.sites), workers=args.workers or WORKERS, vector_only=args.vector_only, offline=args.offline)
+  elif args.command == 'serve':
+    serve(args.port)
+  elif args.command == 'build':
+    build(vector_only=args.vector_only, offline=args.offline, open_browser=not args.no_browser)
+  else:
+    build()
+
+if __name__ == '__main__':
+  main()